@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+# Micro-benchmark of the cell statistics: compares the five separate min/max/sum scans of v1.0.12
+# with cell_stats for 16, 24 and 48 cell packs, sent as dict and as list. Both are run alternately
+# and the median and spread of all runs are printed, see timing.py.
+#
+# Usage: python benchmarks/bench_cells.py [--number N] [--repeat N]
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "dbus-mqtt-battery"))
+from cell_stats import cell_stats  # noqa: E402
+from timing import compare, header, paired_runs, row  # noqa: E402
+
+
+def legacy_cell_stats(voltages):
+    """Cell values of on_message in v1.0.12, without mean and standard deviation."""
+    return (
+        min(voltages, key=voltages.get),
+        min(voltages.values()),
+        max(voltages, key=voltages.get),
+        max(voltages.values()),
+        sum(voltages.values()),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=5000, help="calls per run")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of both implementations")
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    print("%-10s %s" % ("cells", header))
+    for count in (16, 24, 48):
+        voltages = {"Cell" + str(i): round(random.uniform(3.20, 3.40), 3) for i in range(1, count + 1)}
+        voltages_list = list(voltages.values())
+
+        # both implementations have to return the same values
+        stats = cell_stats(voltages)
+        if legacy_cell_stats(voltages) != (stats.min_id, stats.min, stats.max_id, stats.max, stats.sum):
+            print("  value mismatch: legacy %r, new %r" % (legacy_cell_stats(voltages), stats))
+
+        for name, cells in (("dict", voltages), ("list", voltages_list)):
+            legacy, new = paired_runs(lambda: legacy_cell_stats(voltages), lambda: cell_stats(cells), args.number, args.repeat)
+            print("%-10s %s" % ("%i %s" % (count, name), row(compare(legacy, new))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Micro-benchmark of the velib_python D-Bus value conversion: compares the isinstance chains of
+# wrap_dbus_value / unwrap_dbus_value with the exact type dispatch.
+# Without dbus-python the types of mock_dbus are used, which are Python types like the ones of
+# dbus-python, but not implemented in C. Run it on the GX device for the real numbers.
+#
+# Usage: python benchmarks/bench_dbus_values.py [--number N]
+
+import argparse
+import os
+import sys
+from timeit import repeat
+
+try:
+    import dbus  # pyright: ignore[reportMissingImports]
+except ImportError:
+    sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "tests"))
+    import mock_dbus
+
+    mock_dbus.install()
+    import dbus  # pyright: ignore[reportMissingImports]
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "dbus-mqtt-battery", "ext", "velib_python"))
+from ve_utils import VEDBUS_INVALID, dbus_int_types, unwrap_dbus_value, wrap_dbus_value  # noqa: E402
+
+
+def legacy_wrap_dbus_value(value):
+    """wrap_dbus_value of velib_python before the type dispatch."""
+    if value is None:
+        return VEDBUS_INVALID
+    if isinstance(value, float):
+        return dbus.Double(value, variant_level=1)
+    if isinstance(value, bool):
+        return dbus.Boolean(value, variant_level=1)
+    if isinstance(value, int):
+        try:
+            return dbus.Int32(value, variant_level=1)
+        except OverflowError:
+            return dbus.Int64(value, variant_level=1)
+    if isinstance(value, str):
+        return dbus.String(value, variant_level=1)
+    if isinstance(value, list):
+        if len(value) == 0:
+            return dbus.Array([], signature=dbus.Signature("u"), variant_level=1)
+        return dbus.Array([legacy_wrap_dbus_value(x) for x in value], variant_level=1)
+    if isinstance(value, dict):
+        return dbus.Dictionary({(k, legacy_wrap_dbus_value(v)) for k, v in value.items()}, variant_level=1)
+    return value
+
+
+def legacy_unwrap_dbus_value(val):
+    """unwrap_dbus_value of velib_python before the type dispatch."""
+    if isinstance(val, dbus_int_types):
+        return int(val)
+    if isinstance(val, dbus.Double):
+        return float(val)
+    if isinstance(val, dbus.Array):
+        v = [legacy_unwrap_dbus_value(x) for x in val]
+        return None if len(v) == 0 else v
+    if isinstance(val, (dbus.Signature, dbus.String)):
+        return str(val)
+    if isinstance(val, dbus.Byte):
+        return int(val)
+    if isinstance(val, dbus.ByteArray):
+        return "".join([bytes(x) for x in val])
+    if isinstance(val, (list, tuple)):
+        return [legacy_unwrap_dbus_value(x) for x in val]
+    if isinstance(val, (dbus.Dictionary, dict)):
+        return dict([(x, legacy_unwrap_dbus_value(y)) for x, y in val.items()])
+    if isinstance(val, dbus.Boolean):
+        return bool(val)
+    return val
+
+
+def measure(function, value, number):
+    return min(repeat(lambda: function(value), number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100000, help="calls per run")
+    args = parser.parse_args()
+
+    values = {
+        "None": None,
+        "float": 52.7,
+        "int": 63,
+        "int64": 2**40,
+        "bool": True,
+        "str": "Cell5",
+    }
+
+    print("D-Bus types of %s" % ("mock_dbus" if "mock_dbus" in sys.modules else "dbus-python"))
+    print("%-8s %12s %12s %12s %12s %8s" % ("type", "old wrap µs", "wrap µs", "old unwrap µs", "unwrap µs", "speedup"))
+    for name, value in values.items():
+        wrapped = legacy_wrap_dbus_value(value)
+
+        # both implementations have to return the same values
+        if type(wrap_dbus_value(value)) is not type(wrapped) or unwrap_dbus_value(wrapped) != legacy_unwrap_dbus_value(wrapped):
+            print("  value mismatch for %s" % name)
+
+        old_wrap = measure(legacy_wrap_dbus_value, value, args.number)
+        new_wrap = measure(wrap_dbus_value, value, args.number)
+        old_unwrap = measure(legacy_unwrap_dbus_value, wrapped, args.number)
+        new_unwrap = measure(unwrap_dbus_value, wrapped, args.number)
+
+        print("%-8s %12.3f %12.3f %12.3f %12.3f %7.2fx" % (name, old_wrap, new_wrap, old_unwrap, new_unwrap, (old_wrap + old_unwrap) / (new_wrap + new_unwrap)))
+
+
+if __name__ == "__main__":
+    main()
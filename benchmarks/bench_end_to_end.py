@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+# End-to-end benchmark of the driver with the MQTT broker of mqtt_broker.py: the real main() of the
+# driver connects to the broker, a publisher sends battery messages at a fixed rate and the values are
+# taken from the MockDbusService of tests/driver_loader.py. Disconnects of the driver can be injected to
+# test the reconnect under load. Needs no MQTT broker, no dbus-daemon and no dbus-python.
+#
+# The power of every message is its sequence number, so the latency is measured from the publish until
+# the value is set on the D-Bus service. Messages received by the driver, but combined with a later
+# one before they were published, are counted as combined. Messages published while the driver was
+# disconnected are lost, unless they are retained, and counted as lost_while_disconnected. All other
+# lost messages were lost by the driver, which is reported on stderr and with the exit code 1.
+#
+# For every injected disconnect the time until the driver subscribed again is measured as reconnect_s.
+# A disconnect which is due while the driver is still reconnecting is injected as soon as it is
+# connected again. If the driver does not reconnect after a disconnect, the exit code is also 1.
+#
+# Usage: python benchmarks/bench_end_to_end.py [--rate N] [--duration S] [--disconnect-every S]
+#                                              [--qos 0|1] [--retain] [--mqtt5] [--output FILE]
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import types
+from time import monotonic, sleep
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "dbus-mqtt-battery"))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "tests"))
+from bench_pipeline import cells  # noqa: E402
+from driver_loader import MockVeDbusService, load_driver  # noqa: E402
+from latency_histogram import LatencyHistogram  # noqa: E402
+from mqtt_broker import MqttBroker  # noqa: E402
+import mock_gobject  # noqa: E402
+import paho.mqtt.client as mqtt  # noqa: E402
+
+config = """[DEFAULT]
+logging = WARNING
+device_name = End-to-end
+device_instance = 100
+timeout = 0
+
+[DBUS]
+publish_mode = event
+publish_min_interval = {publish_min_interval}
+
+[SNAPSHOT]
+enabled = 0
+
+[MQTT]
+broker_address = 127.0.0.1
+broker_port = {port}
+topic = bench/battery/JsonData
+"""
+
+
+class MainLoop:
+    """GLib.MainLoop for the driver: runs the timers of mock_gobject in real time until quit()."""
+
+    running = None
+
+    def run(self):
+        MainLoop.running = self
+        self._quit = False
+        timer_manager = mock_gobject.timer_manager
+        last = monotonic()
+        while not self._quit:
+            now = monotonic()
+            timer_manager.run((now - last) * 1000)
+            last = now
+            sleep(0.0005)
+
+    def quit(self):
+        self._quit = True
+
+
+class RecordingDbusService(MockVeDbusService):
+    """Records the time when every power value, the sequence number of a message, was set."""
+
+    published = {}
+
+    def add_path(self, path, value, *args, **kwargs):
+        super().add_path(path, value, *args, **kwargs)
+        if path == "/Dc/0/Power" and value is not None:
+            RecordingDbusService.published.setdefault(value, monotonic())
+
+    def __setitem__(self, path, value):
+        super().__setitem__(path, value)
+        if path == "/Dc/0/Power" and value is not None:
+            RecordingDbusService.published.setdefault(value, monotonic())
+
+
+def reconnect_times(disconnects, subscribed):
+    """Time from every injected disconnect until the driver subscribed again, None if it did not."""
+    times = []
+    for disconnect in disconnects:
+        resubscribed = [time for time in subscribed if time > disconnect]
+        times.append(min(resubscribed) - disconnect if len(resubscribed) > 0 else None)
+    return times
+
+
+def run(rate=100, duration=10, disconnect_every=0, qos=0, retain=False, mqtt5=False, publish_min_interval=0):
+    """Run the driver against the broker while publishing for duration seconds and return the results."""
+    broker = MqttBroker()
+    port = broker.start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        driver = load_driver(os.path.join(directory, "dbus-mqtt-battery"), config.format(port=port, publish_min_interval=publish_min_interval))
+        driver.VeDbusService = RecordingDbusService
+        driver.get_vrm_portal_id = lambda: "bench"
+        mock_gobject.MainLoop = MainLoop
+        RecordingDbusService.published = {}
+
+        # keep the MQTT client of the driver, to stop it afterwards
+        clients = []
+
+        class Client(mqtt.Client):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                clients.append(self)
+
+        driver.mqtt = types.ModuleType(mqtt.__name__)
+        driver.mqtt.__dict__.update(vars(mqtt))
+        driver.mqtt.Client = Client
+
+        # count the messages received by the driver
+        received = []
+        on_message = driver.on_message
+
+        def counting_on_message(client, userdata, msg):
+            received.append(msg.timestamp)
+            on_message(client, userdata, msg)
+
+        driver.on_message = counting_on_message
+
+        client_id = "MqttBattery_bench_100"
+        threading.Thread(target=driver.main, daemon=True).start()
+        while client_id not in broker.subscribed:
+            sleep(0.01)
+
+        publisher = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="bench_publisher", protocol=mqtt.MQTTv5 if mqtt5 else mqtt.MQTTv311)
+        publisher.max_inflight_messages_set(1000)
+        publisher.connect("127.0.0.1", port)
+        publisher.loop_start()
+
+        payload = {"Dc": {"Power": 0, "Voltage": 52.7}, "Soc": 63, "Voltages": cells(16, 3.2)}
+        sent = {}
+        start = monotonic()
+        next_disconnect = start + disconnect_every
+        sequence = 0
+
+        # time of every injected disconnect
+        disconnects = []
+
+        while monotonic() - start < duration:
+            sequence += 1
+            payload["Dc"]["Power"] = sequence
+            sent[sequence] = monotonic()
+            publisher.publish("bench/battery/JsonData", json.dumps(payload), qos=qos, retain=retain)
+
+            # while the driver is still reconnecting, the disconnect is injected as soon as it is connected again
+            if disconnect_every > 0 and monotonic() >= next_disconnect and broker.disconnect("MqttBattery_") > 0:
+                disconnects.append(monotonic())
+                next_disconnect += disconnect_every
+
+            if rate > 0:
+                delay = start + sequence / rate - monotonic()
+                if delay > 0:
+                    sleep(delay)
+
+        elapsed = monotonic() - start
+
+        # wait for the last messages and the reconnect after the last disconnect
+        sleep(max(publish_min_interval / 1000, 0.5))
+        deadline = monotonic() + driver.reconnect_max_delay + 1
+        while len(disconnects) > 0 and max(broker.subscribed[client_id]) < disconnects[-1] and monotonic() < deadline:
+            sleep(0.01)
+
+        MainLoop.running.quit()
+        publisher.loop_stop()
+        publisher.disconnect()
+        for client in clients:
+            client.disconnect()
+            client.loop_stop()
+
+    broker.stop()
+
+    lost = max(len(sent) - len(received), 0)
+    lost_while_disconnected = min(broker.undelivered, lost)
+
+    latency = LatencyHistogram()
+    published = dict(RecordingDbusService.published)
+    for value, published_time in published.items():
+        if value in sent:
+            latency.add(published_time - sent[value])
+
+    reconnects = [time for time in reconnect_times(disconnects, broker.subscribed[client_id]) if time is not None]
+
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "rate": rate,
+        "duration": duration,
+        "qos": qos,
+        "retain": retain,
+        "mqtt5": mqtt5,
+        "publish_min_interval": publish_min_interval,
+        "sent": len(sent),
+        "messages_per_second": round(len(sent) / elapsed),
+        "received": len(received),
+        "lost": lost,
+        "lost_while_disconnected": lost_while_disconnected,
+        "lost_by_driver": lost - lost_while_disconnected,
+        "published": len(published),
+        "combined": max(len(received) - len(published), 0),
+        "disconnects": len(disconnects),
+        "reconnects": len(reconnects),
+        "connects": broker.connects.get(client_id, 0),
+        "reconnect_s": {
+            "mean": round(sum(reconnects) / len(reconnects), 3) if len(reconnects) > 0 else None,
+            "max": round(max(reconnects), 3) if len(reconnects) > 0 else None,
+        },
+        "latency_ms": {
+            "p50": round(latency.percentile(50) * 1000, 3) if latency.count > 0 else None,
+            "p95": round(latency.percentile(95) * 1000, 3) if latency.count > 0 else None,
+            "p99": round(latency.percentile(99) * 1000, 3) if latency.count > 0 else None,
+            "max": round(latency.max * 1000, 3) if latency.count > 0 else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rate", type=float, default=100, help="messages per second, 0 = as fast as possible")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to publish")
+    parser.add_argument("--disconnect-every", type=float, default=0, help="disconnect the driver every S seconds, 0 = never")
+    parser.add_argument("--qos", type=int, default=0, choices=(0, 1), help="QoS of the publisher")
+    parser.add_argument("--retain", action="store_true", help="publish retained messages")
+    parser.add_argument("--mqtt5", action="store_true", help="use MQTT 5 for the publisher")
+    parser.add_argument("--publish-min-interval", type=int, default=0, help="publish_min_interval of the driver in milliseconds")
+    parser.add_argument("--output", help="write the JSON to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = run(args.rate, args.duration, args.disconnect_every, args.qos, args.retain, args.mqtt5, args.publish_min_interval)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    if results["lost"] > 0:
+        print("%i of %i messages were lost, %i of them while the driver was disconnected" % (results["lost"], results["sent"], results["lost_while_disconnected"]), file=sys.stderr)
+    if results["reconnects"] < results["disconnects"]:
+        print("The driver did not reconnect after %i of %i disconnects" % (results["disconnects"] - results["reconnects"], results["disconnects"]), file=sys.stderr)
+    if results["lost_by_driver"] > 0 or results["reconnects"] < results["disconnects"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
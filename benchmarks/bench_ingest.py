@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+# Micro-benchmark of the MQTT message ingest: compares the previous nested dict walk of
+# on_message with the compiled BatterySchema/BatteryState ingest. Both are run alternately and the
+# median, the standard deviation and the spread of the speedup of all runs are printed, see timing.py.
+#
+# The compiled ingest saves the string building and type checks per key. The payload is parsed with
+# the scanner of the json module directly, a frame holds only the changed values and the cells are only
+# checked, if the message contains cells. So every payload, also the minimal one, has to be faster.
+# With --check the benchmark exits with 1, if the verdict for one of the payloads is not "faster".
+#
+# Usage: python benchmarks/bench_ingest.py [--number N] [--repeat N] [--changing] [--check]
+
+import argparse
+import copy
+import itertools
+import json
+import logging
+import os
+import sys
+from time import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "dbus-mqtt-battery"))
+from battery_schema import BatterySchema, battery_dict, ignore_list  # noqa: E402
+from battery_state import BatteryState  # noqa: E402
+from timing import compare, header, paired_runs, row, verdict  # noqa: E402
+
+TTG_enabled = 1
+TTG_soc = 10
+TTG_recalculate_every = 300
+TTG_update = 0
+
+
+def legacy_ingest(payload, battery_dict):
+    """on_message of v1.0.12 without the MQTT and error handling around it."""
+    global TTG_update
+
+    jsonpayload = json.loads(payload)
+
+    if "value" in jsonpayload:
+        jsonpayload = json.loads(jsonpayload["value"])
+
+    if (
+        "Dc" in jsonpayload
+        and "Soc" in jsonpayload
+        and (("Power" in jsonpayload["Dc"] and "Voltage" in jsonpayload["Dc"]) or ("0" in jsonpayload["Dc"] and "Power" in jsonpayload["Dc"]["0"] and "Voltage" in jsonpayload["Dc"]["0"]))
+    ):
+
+        # save JSON data into battery_dict
+        for key_1, data_1 in jsonpayload.items():
+
+            if type(data_1) is dict:
+
+                for key_2, data_2 in data_1.items():
+
+                    if key_1 == "Dc":
+
+                        # logging.error(f"data_1: {data_1}")
+                        # logging.error(f"data_2: {data_2}")
+
+                        if "0" in data_1:
+
+                            for key_3, data_3 in data_2.items():
+                                key = "/" + key_1 + "/" + key_2 + "/" + key_3
+                                if key in battery_dict and (type(data_3) is str or type(data_3) is int or type(data_3) is float or data_3 is None):
+                                    battery_dict[key]["value"] = data_3 if data_3 is not None else None  # use is not, because 0 is valid
+                                elif key not in ignore_list:
+                                    logging.warning('#3 Received key "' + str(key) + '" with value "' + str(data_3) + '" is not valid')
+
+                        else:
+                            key = "/" + key_1 + "/0/" + key_2
+                            if key in battery_dict and (type(data_2) is str or type(data_2) is int or type(data_2) is float or data_2 is None):
+                                battery_dict[key]["value"] = data_2 if data_2 is not None else None  # use is not, because 0 is valid
+                            elif key not in ignore_list:
+                                logging.warning('#2 Received key "' + str(key) + '" with value "' + str(data_2) + '" is not valid')
+
+                    else:
+                        key = "/" + key_1 + "/" + key_2
+                        if key in battery_dict and (type(data_2) is str or type(data_2) is int or type(data_2) is float or data_2 is None):
+                            battery_dict[key]["value"] = data_2 if data_2 is not None else None  # use is not, because 0 is valid
+                        elif key not in ignore_list:
+                            logging.warning('#2 Received key "' + str(key) + '" with value "' + str(data_2) + '" is not valid')
+
+            else:
+
+                key = "/" + key_1
+                if key in battery_dict and (type(data_1) is str or type(data_1) is int or type(data_1) is float or data_1 is None):
+                    battery_dict[key]["value"] = data_1 if data_1 is not None else None  # use is not, because 0 is valid
+                elif key not in ignore_list:
+                    logging.warning('#1 Received key "' + str(key) + '" with value "' + str(data_1) + '" is not valid')
+
+        # ------ calculate possible values if missing -----
+        # Current
+        if "Current" not in jsonpayload["Dc"]:
+            battery_dict["/Dc/0/Current"]["value"] = (
+                round(
+                    (battery_dict["/Dc/0/Power"]["value"] / battery_dict["/Dc/0/Voltage"]["value"]),
+                    3,
+                )
+                if battery_dict["/Dc/0/Voltage"]["value"] != 0
+                else 0
+            )
+
+        # ConsumedAmphours
+        if "ConsumedAmphours" not in jsonpayload and battery_dict["/InstalledCapacity"]["value"] is not None and battery_dict["/Capacity"]["value"] is not None:
+            battery_dict["/ConsumedAmphours"]["value"] = battery_dict["/InstalledCapacity"]["value"] - battery_dict["/Capacity"]["value"]
+
+        # Capacity
+        if "Capacity" not in jsonpayload and battery_dict["/InstalledCapacity"]["value"] is not None and battery_dict["/ConsumedAmphours"]["value"] is not None:
+            battery_dict["/Capacity"]["value"] = battery_dict["/InstalledCapacity"]["value"] - battery_dict["/ConsumedAmphours"]["value"]
+
+        # ConsumedAmphours & Capacity based on InstalledCapacity and SoC
+        if "ConsumedAmphours" not in jsonpayload and "Capacity" not in jsonpayload and battery_dict["/InstalledCapacity"]["value"] is not None:
+            battery_dict["/ConsumedAmphours"]["value"] = round(
+                battery_dict["/InstalledCapacity"]["value"] * (100 - battery_dict["/Soc"]["value"]) / 100,
+                2,
+            )
+            battery_dict["/Capacity"]["value"] = round(
+                battery_dict["/InstalledCapacity"]["value"] * battery_dict["/Soc"]["value"] / 100,
+                2,
+            )
+
+        # TimeToGo
+        if (
+            "TimeToGo" not in jsonpayload
+            and TTG_enabled == 1
+            and battery_dict["/Dc/0/Current"]["value"] is not None
+            and battery_dict["/InstalledCapacity"]["value"] is not None
+            and battery_dict["/Capacity"]["value"] is not None
+            and int(time()) - TTG_update >= TTG_recalculate_every
+        ):
+            TTG_update = int(time())
+
+            # charging -> calculate time until 100% SoC
+            if battery_dict["/Dc/0/Current"]["value"] > 0:
+                battery_dict["/TimeToGo"]["value"] = abs(
+                    round(
+                        ((battery_dict["/InstalledCapacity"]["value"] - battery_dict["/Capacity"]["value"]) / battery_dict["/Dc/0/Current"]["value"] * 60 * 60),
+                        0,
+                    )
+                )
+
+            # discharging -> calculate time until TTG_soc SoC
+            elif battery_dict["/Dc/0/Current"]["value"] < 0:
+                battery_dict["/TimeToGo"]["value"] = abs(
+                    round(
+                        ((battery_dict["/Capacity"]["value"] - (battery_dict["/InstalledCapacity"]["value"] * TTG_soc / 100)) / battery_dict["/Dc/0/Current"]["value"] * 60 * 60 * -1),
+                        0,
+                    )
+                )
+
+            # if current is 0 display 30 days
+            else:
+                battery_dict["/TimeToGo"]["value"] = 60 * 60 * 24 * 30
+
+        # MinVoltageCellId, MinCellVoltage, MaxVoltageCellId, MaxCellVoltage, Sum, Diff
+        if "Voltages" in jsonpayload and len(jsonpayload["Voltages"]) > 0:
+            if "System" not in jsonpayload or "MinVoltageCellId" not in jsonpayload["System"]:
+                battery_dict["/System/MinVoltageCellId"]["value"] = min(jsonpayload["Voltages"], key=jsonpayload["Voltages"].get)
+
+            if "System" not in jsonpayload or "MinCellVoltage" not in jsonpayload["System"]:
+                battery_dict["/System/MinCellVoltage"]["value"] = min(jsonpayload["Voltages"].values())
+
+            if "System" not in jsonpayload or "MaxVoltageCellId" not in jsonpayload["System"]:
+                battery_dict["/System/MaxVoltageCellId"]["value"] = max(jsonpayload["Voltages"], key=jsonpayload["Voltages"].get)
+
+            if "System" not in jsonpayload or "MaxCellVoltage" not in jsonpayload["System"]:
+                battery_dict["/System/MaxCellVoltage"]["value"] = max(jsonpayload["Voltages"].values())
+
+            if "Sum" not in jsonpayload["Voltages"]:
+                battery_dict["/Voltages/Sum"]["value"] = sum(jsonpayload["Voltages"].values())
+
+            if "Diff" not in jsonpayload["Voltages"] and battery_dict["/System/MinCellVoltage"]["value"] is not None and battery_dict["/System/MaxCellVoltage"]["value"] is not None:
+                battery_dict["/Voltages/Diff"]["value"] = battery_dict["/System/MaxCellVoltage"]["value"] - battery_dict["/System/MinCellVoltage"]["value"]
+
+
+def cells(count, value):
+    return {"Cell" + str(i): round(value + i / 1000, 3) for i in range(1, count + 1)}
+
+
+def payloads():
+    minimal = {"Dc": {"Power": 321.6, "Voltage": 52.7}, "Soc": 63}
+
+    full = {
+        "Dc": {"Power": 321.6, "Voltage": 52.7, "Current": 6.1, "Temperature": 23},
+        "InstalledCapacity": 200.0,
+        "ConsumedAmphours": 74.5,
+        "Capacity": 125.5,
+        "Soc": 63,
+        "Soh": 98,
+        "TimeToGo": 43967,
+        "Balancing": 0,
+        "SystemSwitch": 0,
+        "Alarms": {path.split("/")[2]: 0 for path in battery_dict if path.startswith("/Alarms/")},
+        "Info": {"ChargeRequest": 0, "MaxChargeVoltage": 55.2, "MaxChargeCurrent": 80.0, "MaxDischargeCurrent": 120.0, "MaxChargeCellVoltage": 3.65},
+        "History": {"ChargeCycles": 5, "MinimumVoltage": 40.8, "MaximumVoltage": 58.4, "TotalAhDrawn": 1057.3},
+        "System": {"MinTemperatureCellId": "C2", "MinCellTemperature": 22.5, "MaxTemperatureCellId": "C9", "MaxCellTemperature": 23.5, "MOSTemperature": 23.5, "NrOfCellsPerBattery": 16},
+        "Voltages": cells(16, 3.2),
+        "Balances": {key: 0 for key in cells(16, 0)},
+        "Io": {"AllowToCharge": 1, "AllowToDischarge": 1, "AllowToBalance": 1, "AllowToHeat": 0, "ExternalRelay": 0},
+        "Heating": 0,
+        "TimeToSoC": {str(soc): 0 for soc in range(0, 101, 5)},
+    }
+
+    serialbattery = copy.deepcopy(full)
+    serialbattery["Dc"] = {"0": serialbattery["Dc"]}
+    serialbattery["Mgmt"] = {"ProcessName": "dbus-serialbattery", "Connection": "Serial /dev/ttyUSB0"}
+    serialbattery["Serial"] = "1234567890"
+    serialbattery["JsonData"] = None
+
+    return {
+        "minimal": json.dumps(minimal).encode(),
+        "full": json.dumps(full).encode(),
+        "serialbattery": json.dumps({"value": json.dumps(serialbattery)}).encode(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=500, help="messages per run")
+    parser.add_argument("--repeat", type=int, default=20, help="runs of both implementations")
+    parser.add_argument("--changing", action="store_true", help="alternate the power value, so that every message changes the state")
+    parser.add_argument("--check", action="store_true", help="exit with 1, if the compiled ingest is not faster for every payload")
+    args = parser.parse_args()
+
+    # ignore warnings about ignored keys in the legacy code
+    logging.disable(logging.WARNING)
+
+    schema = BatterySchema()
+    verdicts = []
+
+    print("%-14s %s" % ("payload", header))
+    for name, payload in payloads().items():
+        # v1.0.12 exported a fixed number of 24 cells
+        legacy_dict = copy.deepcopy(battery_dict)
+        for cell in range(1, 25):
+            legacy_dict["/Voltages/Cell" + str(cell)] = {"value": None, "textformat": None}
+            legacy_dict["/Balances/Cell" + str(cell)] = {"value": None, "textformat": None}
+
+        state = BatteryState(schema, TTG_enabled=TTG_enabled, TTG_soc=TTG_soc, TTG_recalculate_every=TTG_recalculate_every)
+
+        variants = [payload, payload.replace(b"321.6", b"322.6")] if args.changing else [payload]
+        legacy_messages = itertools.cycle(variants)
+        messages = itertools.cycle(variants)
+
+        legacy, compiled = paired_runs(lambda: legacy_ingest(next(legacy_messages), legacy_dict), lambda: state.ingest_payload(next(messages)), args.number, args.repeat)
+
+        # both implementations have to end up with the same values. Known difference: for the nested
+        # {"Dc": {"0": {...}}} form the legacy code always recalculated Current from Power and Voltage
+        for path in legacy_dict:
+            if path not in ignore_list and legacy_dict[path]["value"] != (state[path] if path in schema.slots else None):
+                print("  value mismatch %s: legacy %r, compiled %r" % (path, legacy_dict[path]["value"], state[path]))
+
+        result = compare(legacy, compiled)
+        verdicts.append(verdict(result))
+        print("%-14s %s" % (name, row(result)))
+
+    if args.check and any(result != "faster" for result in verdicts):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
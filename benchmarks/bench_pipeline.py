@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+# Offline benchmark of the whole pipeline from on_message to the D-Bus service. It runs without a MQTT
+# broker and a dbus-daemon, the driver is loaded with the mocks of tests/driver_loader.py. The times
+# are the median of all runs with their standard deviation and the 10th and 90th percentile, see
+# timing.py. The result is printed as JSON with sorted keys, to diff two versions.
+#
+# Usage: python benchmarks/bench_pipeline.py [--number N] [--repeat N] [--debug] [--output FILE]
+
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "tests"))
+from driver_loader import load_driver, message  # noqa: E402
+import mock_gobject  # noqa: E402
+from timing import spread  # noqa: E402
+
+config = """[DEFAULT]
+logging = ERROR
+device_name = Benchmark
+device_instance = 100
+timeout = 0
+
+[DBUS]
+publish_mode = event
+publish_min_interval = 0
+
+[SNAPSHOT]
+enabled = 0
+
+[DEBUG]
+latency = {debug}
+perf = {debug}
+
+[MQTT]
+broker_address = localhost
+broker_port = 1883
+topic = bench/+/JsonData
+"""
+
+
+def cells(count, value):
+    return {"Cell" + str(i): round(value + i / 1000, 3) for i in range(1, count + 1)}
+
+
+def payloads(count):
+    """Two variants of every payload, which differ in the power and in one cell voltage."""
+    minimal = {"Dc": {"Power": 321.6, "Voltage": 52.7}, "Soc": 63}
+
+    full = {
+        "Dc": {"Power": 321.6, "Voltage": 52.7, "Current": 6.1, "Temperature": 23},
+        "InstalledCapacity": 200.0,
+        "ConsumedAmphours": 74.5,
+        "Capacity": 125.5,
+        "Soc": 63,
+        "Soh": 98,
+        "TimeToGo": 43967,
+        "Balancing": 0,
+        "SystemSwitch": 0,
+        "Alarms": {"LowVoltage": 0, "HighVoltage": 0, "LowSoc": 0, "HighChargeCurrent": 0, "HighDischargeCurrent": 0, "CellImbalance": 0, "InternalFailure": 0},
+        "Info": {"ChargeRequest": 0, "MaxChargeVoltage": 55.2, "MaxChargeCurrent": 80.0, "MaxDischargeCurrent": 120.0, "MaxChargeCellVoltage": 3.65},
+        "History": {"ChargeCycles": 5, "MinimumVoltage": 40.8, "MaximumVoltage": 58.4, "TotalAhDrawn": 1057.3},
+        "System": {"MinTemperatureCellId": "C2", "MinCellTemperature": 22.5, "MaxTemperatureCellId": "C9", "MaxCellTemperature": 23.5, "MOSTemperature": 23.5, "NrOfCellsPerBattery": count},
+        "Voltages": cells(count, 3.2),
+        "Balances": {key: 0 for key in cells(count, 0)},
+        "Io": {"AllowToCharge": 1, "AllowToDischarge": 1, "AllowToBalance": 1, "AllowToHeat": 0, "ExternalRelay": 0},
+        "Heating": 0,
+        "TimeToSoC": {str(soc): 0 for soc in range(0, 101, 5)},
+    }
+
+    serialbattery = copy.deepcopy(full)
+    serialbattery["Dc"] = {"0": serialbattery["Dc"]}
+    serialbattery["Mgmt"] = {"ProcessName": "dbus-serialbattery", "Connection": "Serial /dev/ttyUSB0"}
+    serialbattery["Serial"] = "1234567890"
+    serialbattery["JsonData"] = None
+
+    variants = {"minimal": [], "full": [], "serialbattery": []}
+    for power, cell in ((321.6, 3.2), (322.6, 3.21)):
+        minimal["Dc"]["Power"] = full["Dc"]["Power"] = serialbattery["Dc"]["0"]["Power"] = power
+        full["Voltages"]["Cell1"] = serialbattery["Voltages"]["Cell1"] = cell
+        variants["minimal"].append(json.dumps(minimal).encode())
+        variants["full"].append(json.dumps(full).encode())
+        variants["serialbattery"].append(json.dumps({"value": json.dumps(serialbattery)}).encode())
+    return variants
+
+
+def run(driver, messages):
+    """Send all messages and run the GLib callbacks after every message. Return the ingest and update time."""
+    ingest = update = 0.0
+    for msg in messages:
+        start = perf_counter()
+        driver.on_message(None, None, msg)
+        ingested = perf_counter()
+        mock_gobject.timer_manager.run(1)
+        update += perf_counter() - ingested
+        ingest += ingested - start
+    return ingest, update
+
+
+def measure(driver, topic, variants, number, repeat):
+    messages = [message(driver, topic, variants[index % 2]) for index in range(number)]
+
+    # create the D-Bus service and export all paths
+    run(driver, messages[:2])
+
+    runs = [run(driver, messages) for _ in range(repeat)]
+    ingest = spread([ingest / number * 1e6 for ingest, update in runs])
+    update = spread([update / number * 1e6 for ingest, update in runs])
+    total = spread([(ingest + update) / number * 1e6 for ingest, update in runs])
+
+    # memory allocated while handling a single message, the highest peak of all messages, and the
+    # memory blocks which were not freed afterwards
+    tracemalloc.start()
+    peak = 0
+    before = tracemalloc.take_snapshot()
+    for msg in messages[: min(number, 200)]:
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        run(driver, [msg])
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+    return {
+        "messages_per_second": round(1e6 / total["median"]),
+        "ingest_us": round(ingest["median"], 2),
+        "update_us": round(update["median"], 2),
+        "message_us": round(total["median"], 2),
+        "message_stdev_us": round(total["stdev"], 2),
+        "message_p10_us": round(total["p10"], 2),
+        "message_p90_us": round(total["p90"], 2),
+        "peak_bytes": peak,
+        "retained_blocks": retained,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=1000, help="messages per run")
+    parser.add_argument("--repeat", type=int, default=10, help="runs of every payload")
+    parser.add_argument("--debug", action="store_true", help="enable the latency histogram and the perf counters")
+    parser.add_argument("--output", help="write the JSON to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "number": args.number,
+        "repeat": args.repeat,
+        "debug": args.debug,
+        "cases": {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        driver = load_driver(os.path.join(directory, "dbus-mqtt-battery"), config.format(debug=int(args.debug)))
+
+        for count in (4, 16, 24, 48):
+            for name, variants in payloads(count).items():
+                # the minimal payload has no cells
+                if name == "minimal" and count != 4:
+                    continue
+                case = name if name == "minimal" else "%s_%i" % (name, count)
+                results["cases"][case] = measure(driver, "bench/" + case + "/JsonData", variants, args.number, args.repeat)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+
+# Minimal MQTT broker for tests and benchmarks on localhost, so that no real broker is needed.
+# Supports MQTT 3.1.1 and 5 with QoS 0 and 1, wildcard subscriptions, retained messages and injected
+# disconnects. Not supported: QoS 2 (the connection is closed), sessions, will messages,
+# authentication and redelivery of unacknowledged QoS 1 messages.
+#
+# Usage as module:
+#   broker = MqttBroker()
+#   port = broker.start()
+#   ...
+#   broker.disconnect("MqttBattery_")
+#   broker.stop()
+#
+# Usage standalone: python benchmarks/mqtt_broker.py [--port N]
+
+import argparse
+import logging
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from time import monotonic
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "dbus-mqtt-battery", "ext"))
+from paho.mqtt.client import topic_matches_sub  # noqa: E402
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+MQTTv5 = 5
+
+
+def _encode_length(length):
+    data = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        data.append(byte | 0x80 if length > 0 else byte)
+        if length == 0:
+            return bytes(data)
+
+
+def _encode_string(string):
+    data = string.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def _packet(packet_type, flags, body):
+    return bytes([packet_type << 4 | flags]) + _encode_length(len(body)) + body
+
+
+class _Reader:
+    """Reads the fields of a packet body."""
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def byte(self):
+        self.position += 1
+        return self.data[self.position - 1]
+
+    def uint16(self):
+        self.position += 2
+        return struct.unpack_from("!H", self.data, self.position - 2)[0]
+
+    def length(self):
+        length = 0
+        multiplier = 1
+        while True:
+            byte = self.byte()
+            length += (byte & 0x7F) * multiplier
+            if byte & 0x80 == 0:
+                return length
+            multiplier *= 128
+
+    def binary(self):
+        length = self.uint16()
+        self.position += length
+        return self.data[self.position - length : self.position]
+
+    def string(self):
+        return self.binary().decode()
+
+    def skip_properties(self):
+        length = self.length()
+        self.position += length
+
+    def rest(self):
+        return self.data[self.position :]
+
+
+class _Session(socketserver.BaseRequestHandler):
+    """Connection of one client, handled in its own thread."""
+
+    def setup(self):
+        self.client_id = None
+        self.protocol = 4
+        self.subscriptions = {}
+        self.packet_id = 0
+        self.send_lock = threading.Lock()
+
+    def send(self, data):
+        with self.send_lock:
+            try:
+                self.request.sendall(data)
+            except OSError:
+                pass
+
+    def _read(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if len(chunk) == 0:
+                raise EOFError
+            data += chunk
+        return bytes(data)
+
+    def _read_packet(self):
+        header = self._read(1)[0]
+        length = 0
+        multiplier = 1
+        while True:
+            byte = self._read(1)[0]
+            length += (byte & 0x7F) * multiplier
+            if byte & 0x80 == 0:
+                break
+            multiplier *= 128
+        return header >> 4, header & 0x0F, self._read(length)
+
+    def handle(self):
+        broker = self.server.broker
+        try:
+            while True:
+                packet_type, flags, body = self._read_packet()
+
+                if packet_type == CONNECT:
+                    self._connect(broker, _Reader(body))
+                elif packet_type == PUBLISH:
+                    if not self._publish(broker, flags, _Reader(body)):
+                        break
+                elif packet_type == PUBACK:
+                    pass
+                elif packet_type == SUBSCRIBE:
+                    self._subscribe(broker, _Reader(body))
+                elif packet_type == UNSUBSCRIBE:
+                    self._unsubscribe(broker, _Reader(body))
+                elif packet_type == PINGREQ:
+                    self.send(_packet(PINGRESP, 0, b""))
+                elif packet_type == DISCONNECT:
+                    break
+                else:
+                    logging.warning("MQTT broker: unsupported packet type %i from %s" % (packet_type, self.client_id))
+                    break
+
+        except (EOFError, OSError):
+            pass
+
+        finally:
+            broker._remove(self)
+
+    def _connect(self, broker, reader):
+        reader.string()
+        self.protocol = reader.byte()
+        reader.byte()
+        reader.uint16()
+        if self.protocol == MQTTv5:
+            reader.skip_properties()
+        self.client_id = reader.string()
+
+        broker._add(self)
+
+        # session present 0, return code 0, MQTT 5 without properties
+        self.send(_packet(CONNACK, 0, b"\x00\x00\x00" if self.protocol == MQTTv5 else b"\x00\x00"))
+
+    def _publish(self, broker, flags, reader):
+        qos = (flags >> 1) & 0x03
+        if qos > 1:
+            logging.warning("MQTT broker: QoS 2 is not supported, closing the connection of %s" % self.client_id)
+            return False
+
+        topic = reader.string()
+        if qos == 1:
+            packet_id = reader.uint16()
+        if self.protocol == MQTTv5:
+            reader.skip_properties()
+
+        broker.publish(topic, reader.rest(), qos, flags & 0x01 == 1)
+
+        if qos == 1:
+            self.send(_packet(PUBACK, 0, struct.pack("!H", packet_id)))
+        return True
+
+    def _subscribe(self, broker, reader):
+        packet_id = reader.uint16()
+        if self.protocol == MQTTv5:
+            reader.skip_properties()
+
+        granted = bytearray()
+        topics = []
+        while reader.position < len(reader.data):
+            topic = reader.string()
+            qos = min(reader.byte() & 0x03, 1)
+            topics.append((topic, qos))
+            granted.append(qos)
+
+        properties = b"\x00" if self.protocol == MQTTv5 else b""
+        self.send(_packet(SUBACK, 0, struct.pack("!H", packet_id) + properties + bytes(granted)))
+
+        for topic, qos in topics:
+            self.subscriptions[topic] = qos
+            for retained_topic, payload in broker._retained_messages(topic):
+                self.deliver(retained_topic, payload, qos, True)
+        broker._subscribed(self)
+
+    def _unsubscribe(self, broker, reader):
+        packet_id = reader.uint16()
+        if self.protocol == MQTTv5:
+            reader.skip_properties()
+
+        count = 0
+        while reader.position < len(reader.data):
+            self.subscriptions.pop(reader.string(), None)
+            count += 1
+
+        body = struct.pack("!H", packet_id)
+        if self.protocol == MQTTv5:
+            body += b"\x00" + b"\x00" * count
+        self.send(_packet(UNSUBACK, 0, body))
+
+    def deliver(self, topic, payload, qos, retain):
+        body = _encode_string(topic)
+        if qos == 1:
+            with self.send_lock:
+                self.packet_id = self.packet_id % 65535 + 1
+                packet_id = self.packet_id
+            body += struct.pack("!H", packet_id)
+        if self.protocol == MQTTv5:
+            body += b"\x00"
+        self.send(_packet(PUBLISH, qos << 1 | int(retain), body + payload))
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class MqttBroker:
+    """MQTT broker on localhost, which runs in background threads of the current process."""
+
+    def __init__(self, port=0):
+        self.port = port
+        self.sessions = []
+        self.retained = {}
+        self.connects = {}
+
+        # client ID -> time.monotonic() of every SUBSCRIBE, e.g. to measure the time of a reconnect
+        self.subscribed = {}
+        self.published = 0
+
+        # messages, which matched no subscription, e.g. while the subscriber was disconnected
+        self.undelivered = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        """Start the broker and return its port."""
+        self._server = _Server(("127.0.0.1", self.port), _Session)
+        self._server.broker = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.port
+
+    def stop(self):
+        self.disconnect()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Send a message to all matching subscriptions, like a PUBLISH of a client."""
+        with self._lock:
+            self.published += 1
+            if retain:
+                if len(payload) == 0:
+                    self.retained.pop(topic, None)
+                else:
+                    self.retained[topic] = payload
+            sessions = list(self.sessions)
+
+        delivered = False
+        for session in sessions:
+            for subscription, subscription_qos in list(session.subscriptions.items()):
+                if topic_matches_sub(subscription, topic):
+                    session.deliver(topic, payload, min(qos, subscription_qos), False)
+                    delivered = True
+                    break
+
+        if not delivered:
+            with self._lock:
+                self.undelivered += 1
+
+    def disconnect(self, client_id_prefix=""):
+        """Close the connection of all clients, whose client ID starts with client_id_prefix. Return their number."""
+        with self._lock:
+            sessions = [session for session in self.sessions if session.client_id.startswith(client_id_prefix)]
+
+        for session in sessions:
+            try:
+                session.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+            # removed right away, so that the messages published afterwards count as undelivered and
+            # the next disconnect only counts the new connection of the client
+            self._remove(session)
+        return len(sessions)
+
+    def _add(self, session):
+        with self._lock:
+            self.sessions.append(session)
+            self.connects[session.client_id] = self.connects.get(session.client_id, 0) + 1
+
+    def _subscribed(self, session):
+        with self._lock:
+            self.subscribed.setdefault(session.client_id, []).append(monotonic())
+
+    def _remove(self, session):
+        with self._lock:
+            if session in self.sessions:
+                self.sessions.remove(session)
+
+    def _retained_messages(self, subscription):
+        with self._lock:
+            return [(topic, payload) for topic, payload in self.retained.items() if topic_matches_sub(subscription, topic)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=1883, help="port to listen on")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    broker = MqttBroker(args.port)
+    logging.info("MQTT broker: listening on 127.0.0.1:%i" % broker.start())
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# Replays a capture of the driver (capture in the [DEBUG] section of the config.ini) through on_message,
+# without a MQTT broker and a dbus-daemon with the mocks of tests/driver_loader.py. The messages are sent with the timing
+# of the capture (--speed 1), N times faster (--speed N) or as fast as possible (--speed 0). The timers
+# of the driver always run in the time of the capture, so messages are combined like on the device.
+#
+# Prints the throughput and the resulting D-Bus values of every battery as JSON with sorted keys.
+#
+# Usage: python benchmarks/replay_capture.py CAPTURE [--speed N] [--config FILE] [--debug] [--output FILE]
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from time import perf_counter, process_time, sleep
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "dbus-mqtt-battery"))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "tests"))
+from driver_loader import load_driver, message  # noqa: E402
+import mock_gobject  # noqa: E402
+from mqtt_capture import read_capture  # noqa: E402
+
+# every topic of the capture is discovered as battery
+config = """[DEFAULT]
+logging = ERROR
+device_name = Replay
+device_instance = 100
+timeout = 0
+
+[SNAPSHOT]
+enabled = 0
+
+[DEBUG]
+latency = {debug}
+perf = {debug}
+
+[MQTT]
+broker_address = localhost
+broker_port = 1883
+topic = #
+"""
+
+
+def replay(driver, capture, speed):
+    """Send all messages of the capture to on_message. Return the number of messages and the capture duration."""
+    timer_manager = mock_gobject.timer_manager
+    count = 0
+    first = previous = None
+    start = perf_counter()
+
+    for timestamp, topic, payload in read_capture(capture):
+        if first is None:
+            first = previous = timestamp
+
+        if speed > 0:
+            delay = start + (timestamp - first) / speed - perf_counter()
+            if delay > 0:
+                sleep(delay)
+
+        # run the timers of the driver until the time of this message
+        timer_manager.run(max(timestamp - previous, 0) * 1000)
+        previous = timestamp
+
+        driver.on_message(None, None, message(driver, topic, payload))
+        count += 1
+
+    # publish the last messages
+    timer_manager.run(1000)
+
+    return count, (previous - first) if first is not None else 0
+
+
+def services(driver):
+    """Values of the D-Bus services of all batteries, without the management paths."""
+    result = {}
+    batteries = [battery for battery in driver.batteries.values() if battery is not None]
+    if driver.aggregate_config is not None:
+        batteries.append(driver.aggregate_config)
+
+    for battery in batteries:
+        if "service" in battery:
+            # update the debug values, which are updated only every interval
+            if driver.debug_latency or driver.perf is not None:
+                battery["service"]._update_debug()
+
+            dbusservice = battery["service"]._dbusservice
+            result[dbusservice._service_name] = {path: value for path, value in dbusservice._dbusobjects.items() if not path.startswith("/Mgmt/")}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("capture", help="capture file written by the driver")
+    parser.add_argument("--speed", type=float, default=0, help="1 = timing of the capture, N = N times faster, 0 = as fast as possible")
+    parser.add_argument("--config", help="config.ini to use instead of discovering every topic")
+    parser.add_argument("--debug", action="store_true", help="enable the latency histogram and the perf counters")
+    parser.add_argument("--output", help="write the JSON to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.config:
+        with open(args.config) as file:
+            config_text = file.read()
+    else:
+        config_text = config.format(debug=int(args.debug))
+
+    with tempfile.TemporaryDirectory() as directory:
+        driver = load_driver(os.path.join(directory, "dbus-mqtt-battery"), config_text)
+
+        started = perf_counter()
+        cpu_started = process_time()
+        count, duration = replay(driver, os.path.abspath(args.capture), args.speed)
+        elapsed = perf_counter() - started
+        cpu = process_time() - cpu_started
+
+        results = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "speed": args.speed,
+            "messages": count,
+            "capture_seconds": round(duration, 3),
+            "replay_seconds": round(elapsed, 3),
+            "messages_per_second": round(count / elapsed) if elapsed > 0 else None,
+            "cpu_seconds": round(cpu, 3),
+            "cpu_percent": round(cpu / elapsed * 100, 1) if elapsed > 0 else None,
+            "services": services(driver),
+        }
+        if driver.perf is not None:
+            results["perf"] = driver.perf.stats()
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+# Timing of the benchmarks, most of them compare an old with a new implementation. Single runs vary by
+# ±20% on a busy machine or with CPU frequency scaling, so both implementations are run alternately
+# and the median and spread of all runs are reported. A difference is only reported, if the speedup
+# is above or below 1 in 80% of the runs.
+
+import statistics
+from timeit import timeit
+
+
+def paired_runs(old, new, number, repeat):
+    """Run old and new number times each, alternately repeat times. Return the µs per call of all runs of both."""
+    old_runs = []
+    new_runs = []
+    for _ in range(repeat):
+        old_runs.append(timeit(old, number=number) / number * 1e6)
+        new_runs.append(timeit(new, number=number) / number * 1e6)
+    return old_runs, new_runs
+
+
+def compare(old_runs, new_runs):
+    """Median and standard deviation of both and the median speedup with its 10th and 90th percentile."""
+    speedups = [old / new for old, new in zip(old_runs, new_runs)]
+    deciles = statistics.quantiles(speedups, n=10)
+    return {
+        "old_us": round(statistics.median(old_runs), 3),
+        "old_stdev_us": round(statistics.stdev(old_runs), 3),
+        "new_us": round(statistics.median(new_runs), 3),
+        "new_stdev_us": round(statistics.stdev(new_runs), 3),
+        "speedup": round(statistics.median(speedups), 2),
+        "speedup_p10": round(deciles[0], 2),
+        "speedup_p90": round(deciles[-1], 2),
+    }
+
+
+def spread(runs):
+    """Median, standard deviation and the 10th and 90th percentile of the runs of one implementation."""
+    deciles = statistics.quantiles(runs, n=10)
+    return {
+        "median": statistics.median(runs),
+        "stdev": statistics.stdev(runs),
+        "p10": deciles[0],
+        "p90": deciles[-1],
+    }
+
+
+def verdict(result):
+    if result["speedup_p10"] > 1:
+        return "faster"
+    if result["speedup_p90"] < 1:
+        return "slower"
+    return "no difference"
+
+
+# header and row of a result, to print it as table
+header = "%12s %8s %12s %8s %8s %13s  %s" % ("old µs", "± µs", "new µs", "± µs", "speedup", "p10-p90", "verdict")
+
+
+def row(result):
+    return "%12.2f %8.2f %12.2f %8.2f %7.2fx %6.2f-%-6.2f  %s" % (
+        result["old_us"],
+        result["old_stdev_us"],
+        result["new_us"],
+        result["new_stdev_us"],
+        result["speedup"],
+        result["speedup_p10"],
+        result["speedup_p90"],
+        verdict(result),
+    )
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+import logging
+from time import monotonic
+
+from battery_schema import battery_dict
+
+# how the value of a path is combined over all batteries
+SUM = 0
+MEAN = 1
+MIN = 2
+MAX = 3
+
+aggregate_paths = {
+    "/Dc/0/Power": SUM,
+    "/Dc/0/Voltage": MEAN,
+    "/Dc/0/Current": SUM,
+    "/Dc/0/Temperature": MEAN,
+    "/InstalledCapacity": SUM,
+    "/ConsumedAmphours": SUM,
+    "/Capacity": SUM,
+    "/Soc": MEAN,
+    "/TimeToGo": MIN,
+    "/Balancing": MAX,
+    "/Info/ChargeRequest": MAX,
+    "/Info/MaxChargeVoltage": MIN,
+    "/Info/MaxChargeCurrent": SUM,
+    "/Info/MaxDischargeCurrent": SUM,
+    "/Info/MaxChargeCellVoltage": MIN,
+    "/History/ChargeCycles": MAX,
+    "/History/TotalAhDrawn": SUM,
+    "/System/MinCellVoltage": MIN,
+    "/System/MaxCellVoltage": MAX,
+    "/System/MinCellTemperature": MIN,
+    "/System/MaxCellTemperature": MAX,
+    "/System/MOSTemperature": MAX,
+    "/System/NrOfModulesOffline": SUM,
+    "/System/NrOfModulesBlockingCharge": SUM,
+    "/System/NrOfModulesBlockingDischarge": SUM,
+    "/Io/AllowToCharge": MIN,
+    "/Io/AllowToDischarge": MIN,
+    "/Io/AllowToBalance": MIN,
+    "/Soh": MIN,
+}
+
+# alarms are combined with OR, which is the highest level of all batteries
+for path in battery_dict:
+    if path.startswith("/Alarms/"):
+        aggregate_paths[path] = MAX
+
+# the cell ID of the battery with the lowest or highest value is prefixed with the battery name
+cell_id_paths = {
+    "/System/MinCellVoltage": "/System/MinVoltageCellId",
+    "/System/MaxCellVoltage": "/System/MaxVoltageCellId",
+    "/System/MinCellTemperature": "/System/MinTemperatureCellId",
+    "/System/MaxCellTemperature": "/System/MaxTemperatureCellId",
+}
+
+
+def _combine(mode, column):
+    values = [value for value in column if value is not None and value.__class__ is not str]
+    if len(values) == 0:
+        return None
+    if mode == SUM:
+        return sum(values)
+    if mode == MEAN:
+        return sum(values) / len(values)
+    if mode == MIN:
+        return min(values)
+    return max(values)
+
+
+class BatteryAggregate:
+    """Combines the values of several BatteryStates into one virtual battery.
+
+    Every aggregated path is a column with one value per battery. When a battery reports, only its
+    entries are updated and only the columns where its value changed are combined again. The result
+    is written into state, a normal BatteryState, which is published like any other battery.
+
+    A battery without a message for timeout seconds is removed from the columns, until it reports
+    again. With timeout 0 the batteries are never removed.
+    """
+
+    def __init__(self, state, timeout=0):
+        self.state = state
+        self.timeout = timeout
+        slots = state.schema.slots
+
+        self._paths = list(aggregate_paths)
+        self._slots = [slots[path] for path in self._paths]
+        self._modes = [aggregate_paths[path] for path in self._paths]
+        self._columns = [[] for _ in self._paths]
+
+        # column index of the cell values and slot of their cell ID
+        self._cell_ids = [(self._paths.index(path), slots[cell_id_path]) for path, cell_id_path in cell_id_paths.items()]
+
+        self._capacity = self._paths.index("/Capacity")
+        self._installed_capacity = self._paths.index("/InstalledCapacity")
+        self._soc = self._paths.index("/Soc")
+        self._time_to_go = self._paths.index("/TimeToGo")
+        self._nr_of_modules_online = slots["/System/NrOfModulesOnline"]
+
+        # source state -> index of the battery in the columns
+        self._batteries = {}
+        self._sources = []
+        self._names = []
+        self._generations = []
+
+        # False while the battery is offline
+        self._online_batteries = []
+
+    def add(self, source, name):
+        """Add a battery and return its index."""
+        index = len(self._names)
+        self._batteries[source] = index
+        self._sources.append(source)
+        self._names.append(name)
+        self._generations.append(-1)
+        self._online_batteries.append(False)
+        for column in self._columns:
+            column.append(None)
+        return index
+
+    def _expire(self, changed):
+        """Remove the batteries from the columns, which timed out. Add the changed columns to changed."""
+        now = monotonic()
+        for source, index in self._batteries.items():
+            if self._online_batteries[index] and now - source.last_changed > self.timeout:
+                logging.warning('Aggregate: battery "%s" timed out and is removed until it reports again' % self._names[index])
+                self._online_batteries[index] = False
+
+                # take the values of the battery again with its next message, even if they did not change
+                self._generations[index] = -1
+
+                for column_index, column in enumerate(self._columns):
+                    if column[index] is not None:
+                        column[index] = None
+                        changed.add(column_index)
+
+    def _online(self, column_index):
+        """Values of the column of the batteries which are online."""
+        column = self._columns[column_index]
+        return [column[index] for index, online in enumerate(self._online_batteries) if online]
+
+    def update(self, source, name=""):
+        """Take the values of source and update the aggregated values.
+
+        Called from the ingest thread after a message of source, so its values are complete.
+        """
+        index = self._batteries.get(source)
+        if index is None:
+            index = self.add(source, name)
+
+        columns = self._columns
+        changed = set()
+
+        if self.timeout != 0:
+            self._expire(changed)
+
+        if source.generation != self._generations[index]:
+            self._generations[index] = source.generation
+            self._online_batteries[index] = True
+
+            values = source.values
+            for column_index, slot in enumerate(self._slots):
+                value = values[slot]
+                column = columns[column_index]
+                if column[index] != value:
+                    column[index] = value
+                    changed.add(column_index)
+
+        result = []
+        for column_index in changed:
+            result.append((self._slots[column_index], _combine(self._modes[column_index], columns[column_index])))
+
+        # SoC weighted by the capacity of the batteries, if all of them report it
+        if self._capacity in changed or self._installed_capacity in changed or self._soc in changed:
+            capacity = self._online(self._capacity)
+            installed_capacity = self._online(self._installed_capacity)
+            if None not in capacity and None not in installed_capacity and sum(installed_capacity) > 0:
+                result.append((self._slots[self._soc], round(sum(capacity) / sum(installed_capacity) * 100, 1)))
+
+        # TimeToGo of the batteries in parallel, if all of them report their capacity. Every battery is
+        # discharged with remaining capacity / TimeToGo, so the bank lasts sum(capacity) / sum(discharge),
+        # as long as the currents do not change. An empty battery supplies nothing and is left out. Without
+        # the capacities the minimum is kept
+        if self._time_to_go in changed or self._capacity in changed:
+            time_to_go = self._online(self._time_to_go)
+            capacity = self._online(self._capacity)
+            if None not in time_to_go and None not in capacity:
+                supplying = [(ttg, remaining) for ttg, remaining in zip(time_to_go, capacity) if ttg > 0 and remaining > 0]
+                if supplying:
+                    discharge = sum(remaining / ttg for ttg, remaining in supplying)
+                    result.append((self._slots[self._time_to_go], round(sum(remaining for ttg, remaining in supplying) / discharge)))
+
+        for column_index, id_slot in self._cell_ids:
+            if column_index in changed:
+                column = columns[column_index]
+                combined = _combine(self._modes[column_index], column)
+                cell_id = None
+                if combined is not None:
+                    battery = column.index(combined)
+                    if self._sources[battery].values[id_slot] is not None:
+                        cell_id = self._names[battery] + ":" + str(self._sources[battery].values[id_slot])
+                result.append((id_slot, cell_id))
+
+        result.append((self._nr_of_modules_online, self._online_batteries.count(True)))
+
+        # also without changes, so that the aggregate times out only when no battery reports anymore
+        self.state.set_values(result)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+
+# D-Bus paths of the battery service, their default values and text formatters. The
+# BatterySchema compiles them once at startup into a flat slot table and a JSON key tree,
+# so incoming payloads can be mapped without building any path strings.
+
+
+# formatting, the format strings contain the unit, so that every text is created with one operation
+def _a(p, v):
+    return "%.1fA" % v
+
+
+def _ah(p, v):
+    return "%.1fAh" % v
+
+
+def _ms(p, v):
+    return "%.2fms" % v
+
+
+def _n(p, v):
+    return "%i" % v
+
+
+def _p(p, v):
+    return "%i%%" % v
+
+
+def _s(p, v):
+    return "%s" % v
+
+
+def _t(p, v):
+    return "%.1f°C" % v
+
+
+def _v(p, v):
+    return "%.2fV" % v
+
+
+def _v3(p, v):
+    return "%.3fV" % v
+
+
+def _w(p, v):
+    return "%iW" % v
+
+
+battery_dict = {
+    # general data
+    "/Dc/0/Power": {"value": None, "textformat": _w},
+    "/Dc/0/Voltage": {"value": None, "textformat": _v},
+    "/Dc/0/Current": {"value": None, "textformat": _a},
+    "/Dc/0/Temperature": {"value": None, "textformat": _t},
+    "/InstalledCapacity": {"value": None, "textformat": _ah},
+    "/ConsumedAmphours": {"value": None, "textformat": _ah},
+    "/Capacity": {"value": None, "textformat": _ah},
+    "/Soc": {"value": None, "textformat": _p},
+    "/TimeToGo": {"value": None, "textformat": _n},
+    "/Balancing": {"value": None, "textformat": _n},
+    "/SystemSwitch": {"value": None, "textformat": _n},
+    # alarms
+    "/Alarms/LowVoltage": {"value": 0, "textformat": _n},
+    "/Alarms/HighVoltage": {"value": 0, "textformat": _n},
+    "/Alarms/LowSoc": {"value": 0, "textformat": _n},
+    "/Alarms/HighChargeCurrent": {"value": 0, "textformat": _n},
+    "/Alarms/HighDischargeCurrent": {"value": 0, "textformat": _n},
+    "/Alarms/HighCurrent": {"value": 0, "textformat": _n},
+    "/Alarms/CellImbalance": {"value": 0, "textformat": _n},
+    "/Alarms/HighChargeTemperature": {"value": 0, "textformat": _n},
+    "/Alarms/LowChargeTemperature": {"value": 0, "textformat": _n},
+    "/Alarms/LowCellVoltage": {"value": 0, "textformat": _n},
+    "/Alarms/LowTemperature": {"value": 0, "textformat": _n},
+    "/Alarms/HighTemperature": {"value": 0, "textformat": _n},
+    "/Alarms/FuseBlown": {"value": 0, "textformat": _n},
+    # info
+    "/Info/ChargeRequest": {"value": None, "textformat": _n},
+    "/Info/MaxChargeVoltage": {"value": None, "textformat": _v},
+    "/Info/MaxChargeCurrent": {"value": None, "textformat": _a},
+    "/Info/MaxDischargeCurrent": {"value": None, "textformat": _a},
+    "/Info/MaxChargeCellVoltage": {"value": None, "textformat": _v3},
+    "/Info/HeatingCurrent": {"value": None, "textformat": _a},
+    "/Info/HeatingPower": {"value": None, "textformat": _w},
+    "/Info/HeatingTemperatureStart": {"value": None, "textformat": _t},
+    "/Info/HeatingTemperatureStop": {"value": None, "textformat": _t},
+    # history
+    "/History/ChargeCycles": {"value": None, "textformat": _n},
+    "/History/MinimumVoltage": {"value": None, "textformat": _v},
+    "/History/MaximumVoltage": {"value": None, "textformat": _v},
+    "/History/TotalAhDrawn": {"value": None, "textformat": _ah},
+    # system
+    "/System/MinVoltageCellId": {"value": None, "textformat": _s},
+    "/System/MinCellVoltage": {"value": None, "textformat": _v3},
+    "/System/MaxVoltageCellId": {"value": None, "textformat": _s},
+    "/System/MaxCellVoltage": {"value": None, "textformat": _v3},
+    "/System/MinTemperatureCellId": {"value": None, "textformat": _s},
+    "/System/MinCellTemperature": {"value": None, "textformat": _t},
+    "/System/MaxTemperatureCellId": {"value": None, "textformat": _s},
+    "/System/MaxCellTemperature": {"value": None, "textformat": _t},
+    "/System/MOSTemperature": {"value": None, "textformat": _t},
+    "/System/NrOfCellsPerBattery": {"value": 0, "textformat": _n},
+    "/System/NrOfModulesOnline": {"value": 1, "textformat": _n},
+    "/System/NrOfModulesOffline": {"value": 0, "textformat": _n},
+    "/System/NrOfModulesBlockingCharge": {"value": 0, "textformat": _n},
+    "/System/NrOfModulesBlockingDischarge": {"value": 0, "textformat": _n},
+    # cell voltages
+    "/Voltages/Sum": {"value": None, "textformat": _v},
+    "/Voltages/Diff": {"value": None, "textformat": _v3},
+    # IO
+    "/Io/AllowToBalance": {"value": None, "textformat": _n},
+    "/Io/AllowToCharge": {"value": None, "textformat": _n},
+    "/Io/AllowToDischarge": {"value": None, "textformat": _n},
+    "/Io/AllowToHeat": {"value": None, "textformat": _n},
+    "/Io/ExternalRelay": {"value": None, "textformat": _n},
+    # Time To Soc
+    "/TimeToSoC/0": {"value": None, "textformat": _s},
+    "/TimeToSoC/5": {"value": None, "textformat": _s},
+    "/TimeToSoC/10": {"value": None, "textformat": _s},
+    "/TimeToSoC/15": {"value": None, "textformat": _s},
+    "/TimeToSoC/20": {"value": None, "textformat": _s},
+    "/TimeToSoC/25": {"value": None, "textformat": _s},
+    "/TimeToSoC/30": {"value": None, "textformat": _s},
+    "/TimeToSoC/35": {"value": None, "textformat": _s},
+    "/TimeToSoC/40": {"value": None, "textformat": _s},
+    "/TimeToSoC/45": {"value": None, "textformat": _s},
+    "/TimeToSoC/50": {"value": None, "textformat": _s},
+    "/TimeToSoC/55": {"value": None, "textformat": _s},
+    "/TimeToSoC/60": {"value": None, "textformat": _s},
+    "/TimeToSoC/65": {"value": None, "textformat": _s},
+    "/TimeToSoC/70": {"value": None, "textformat": _s},
+    "/TimeToSoC/75": {"value": None, "textformat": _s},
+    "/TimeToSoC/80": {"value": None, "textformat": _s},
+    "/TimeToSoC/85": {"value": None, "textformat": _s},
+    "/TimeToSoC/90": {"value": None, "textformat": _s},
+    "/TimeToSoC/95": {"value": None, "textformat": _s},
+    "/TimeToSoC/100": {"value": None, "textformat": _s},
+    # EXTRA
+    "/Alarms/BmsCable": {"value": None, "textformat": _n},
+    "/Alarms/HighCellVoltage": {"value": None, "textformat": _n},
+    "/Alarms/HighInternalTemperature": {"value": None, "textformat": _n},
+    "/Alarms/InternalFailure": {"value": None, "textformat": _n},
+    "/Alarms/StateOfHealth": {"value": None, "textformat": _n},
+    "/ConnectionInformation": {"value": None, "textformat": _s},
+    "/CurrentAvg": {"value": None, "textformat": _a},
+    "/Dc/0/MidVoltage": {"value": None, "textformat": _v},
+    "/Dc/0/MidVoltageDeviation": {"value": None, "textformat": _v},
+    "/Heating": {"value": None, "textformat": _n},
+    "/History/AverageDischarge": {"value": None, "textformat": _n},
+    "/History/ChargedEnergy": {"value": None, "textformat": _n},
+    "/History/DeepestDischarge": {"value": None, "textformat": _n},
+    "/History/DischargedEnergy": {"value": None, "textformat": _n},
+    "/History/FullDischarges": {"value": None, "textformat": _n},
+    "/History/HighVoltageAlarms": {"value": None, "textformat": _n},
+    "/History/LastDischarge": {"value": None, "textformat": _n},
+    "/History/LowVoltageAlarms": {"value": None, "textformat": _n},
+    "/History/MaximumCellVoltage": {"value": None, "textformat": _n},
+    "/History/MaximumTemperature": {"value": None, "textformat": _n},
+    "/History/MinimumCellVoltage": {"value": None, "textformat": _n},
+    "/History/MinimumTemperature": {"value": None, "textformat": _n},
+    "/History/TimeSinceLastFullCharge": {"value": None, "textformat": _n},
+    "/Info/BatteryLowVoltage": {"value": None, "textformat": _n},
+    "/Info/ChargeLimitation": {"value": None, "textformat": _s},
+    "/Info/ChargeMode": {"value": None, "textformat": _s},
+    "/Info/DischargeLimitation": {"value": None, "textformat": _s},
+    "/Io/ForceChargingOff": {"value": None, "textformat": _n},
+    "/Io/ForceDischargingOff": {"value": None, "textformat": _n},
+    "/Io/TurnBalancingOff": {"value": None, "textformat": _n},
+    "/Settings/HasTemperature": {"value": None, "textformat": _n},
+    "/SocBms": {"value": None, "textformat": _p},
+    "/Soh": {"value": None, "textformat": _p},
+    "/State": {"value": None, "textformat": _n},
+    "/System/Temperature1": {"value": None, "textformat": _t},
+    "/System/Temperature1Name": {"value": None, "textformat": _s},
+    "/System/Temperature2": {"value": None, "textformat": _t},
+    "/System/Temperature2Name": {"value": None, "textformat": _s},
+    "/System/Temperature3": {"value": None, "textformat": _t},
+    "/System/Temperature3Name": {"value": None, "textformat": _s},
+    "/System/Temperature4": {"value": None, "textformat": _t},
+    "/System/Temperature4Name": {"value": None, "textformat": _s},
+}
+
+ignore_list = [
+    "/FirmwareVersion",
+    "/HardwareVersion",
+    "/Connected",
+    "/CustomName",
+    "/DeviceInstance",
+    "/DeviceName",
+    "/ErrorCode",
+    "/Family",
+    "/Manufacturer",
+    "/Mgmt/Connection",
+    "/Mgmt/ProcessName",
+    "/Mgmt/ProcessVersion",
+    "/ProductId",
+    "/ProductName",
+    "/Serial",
+    "/Info/ChargeModeDebug",
+    "/Info/ChargeModeDebugFloat",
+    "/Info/ChargeModeDebugBulk",
+    "/History/CanBeCleared",
+    "/History/Clear",
+    "/JsonData",
+    # time when the producer created the message, used for the latency
+    "/Timestamp",
+]
+
+
+# value types accepted from the JSON payload, bool is excluded on purpose
+VALUE_TYPES = frozenset((str, int, float, type(None)))
+
+# marks a JSON key that is known, but not exported (see ignore_list)
+IGNORED = -1
+
+# JSON keys that are mapped to the same node as another D-Bus subpath, e.g. {"Dc": {"Power": 1}}
+# is the same as {"Dc": {"0": {"Power": 1}}}
+aliases = {
+    "/Dc": "/Dc/0",
+}
+
+# nodes where a slot is created for every cell "Cell<n>" on first use, with the text formatter of the cells
+cell_paths = {
+    "/Voltages": _v3,
+    "/Balances": _n,
+}
+
+
+class SchemaNode:
+    """One JSON object level. Each child is either a slot index, IGNORED or another SchemaNode.
+
+    cells is the text formatter of the cells created on demand in this node, None if the node has no cells.
+    """
+
+    __slots__ = ("prefix", "children", "cells")
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.children = {}
+        self.cells = None
+
+
+class BatterySchema:
+    """Flat slot table compiled from battery_dict.
+
+    Every D-Bus path gets a fixed slot index. paths, defaults, textformats and validators are
+    lists indexed by slot, root is the JSON key tree that maps a payload key straight to its slot.
+    The slots of the cells are added on demand, is_cell marks them.
+    """
+
+    def __init__(self, paths=battery_dict, ignore=ignore_list):
+        self.paths = []
+        self.defaults = []
+        self.textformats = []
+        self.validators = []
+        self.is_cell = []
+        self.slots = {}
+        self.root = SchemaNode("")
+
+        # JSON key and node of every node with cells
+        self.cell_nodes = []
+        for path, textformat in cell_paths.items():
+            node = self._node(path + "/")[0]
+            node.cells = textformat
+            self.cell_nodes.append((path[1:], node))
+
+        for path, settings in paths.items():
+            self.add(path, settings["value"], settings["textformat"])
+
+        for path in ignore:
+            # do not hide exported paths
+            if path not in self.slots:
+                self._node(path)[0].children.setdefault(path.rsplit("/", 1)[1], IGNORED)
+
+        for alias, path in aliases.items():
+            node = self._node(path + "/")[0]
+            alias_node = self._node(alias + "/")[0]
+            alias_node.prefix = node.prefix
+            for key, child in node.children.items():
+                alias_node.children.setdefault(key, child)
+
+    def _node(self, path):
+        """Return the node holding the last key of path and the key itself, creating missing nodes."""
+        keys = path.split("/")[1:]
+        node = self.root
+        for key in keys[:-1]:
+            child = node.children.get(key)
+            if not isinstance(child, SchemaNode):
+                child = node.children[key] = SchemaNode(node.prefix + "/" + key)
+            node = child
+        return node, keys[-1]
+
+    def add(self, path, value=None, textformat=None, validator=VALUE_TYPES):
+        """Add a D-Bus path and return its slot index."""
+        if path in self.slots:
+            return self.slots[path]
+
+        slot = len(self.paths)
+        self.paths.append(path)
+        self.defaults.append(value)
+        self.textformats.append(textformat)
+        self.validators.append(validator)
+        self.is_cell.append(False)
+        self.slots[path] = slot
+
+        node, key = self._node(path)
+        node.children[key] = slot
+        return slot
+
+    def add_cell(self, node, key):
+        """Add the slot of a cell like "Cell17" to node and return it, None if key is no cell."""
+        if node.cells is None or not key.startswith("Cell") or not key[4:].isdigit():
+            return None
+
+        slot = self.add(node.prefix + "/" + key, None, node.cells)
+        self.is_cell[slot] = True
+        return slot
+
+    def slot(self, path):
+        """Return the slot of path, add it if it is a cell, None if the path is unknown."""
+        slot = self.slots.get(path)
+        if slot is None:
+            for key, node in self.cell_nodes:
+                if path.startswith(node.prefix + "/"):
+                    return self.add_cell(node, path[len(node.prefix) + 1 :])
+        return slot
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import glob
+import logging
+import marshal
+import os
+from time import monotonic
+from urllib.parse import quote
+
+# Snapshot of the last published values of a battery, used to publish the battery right after a
+# restart of the driver. The files are written to a tmpfs like /run, so time.monotonic() stays
+# valid between the driver restarts and a reboot removes them.
+
+SNAPSHOT_VERSION = 1
+
+
+def snapshot_file(directory, topic):
+    """Return the snapshot file of the battery with the MQTT topic. The topic is quoted, so every topic has its own file."""
+    return os.path.join(directory, "battery_" + quote(topic, safe="") + ".snapshot")
+
+
+def save_snapshot(filename, topic, paths, values):
+    """Write the values which are not None with their paths. The file is replaced atomically."""
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "time": monotonic(),
+        "topic": topic,
+        "values": {paths[slot]: value for slot, value in enumerate(values) if value is not None},
+    }
+
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename + ".tmp", "wb") as file:
+            marshal.dump(snapshot, file)
+        os.replace(filename + ".tmp", filename)
+    except OSError as e:
+        logging.warning('Could not write snapshot "%s": %s' % (filename, e))
+
+
+def load_snapshots(directory, max_age):
+    """Return (topic, values, age) of every snapshot in directory, which is younger than max_age seconds."""
+    snapshots = []
+    now = monotonic()
+
+    for filename in sorted(glob.glob(os.path.join(directory, "battery_*.snapshot"))):
+        try:
+            with open(filename, "rb") as file:
+                snapshot = marshal.load(file)
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            logging.warning('Could not read snapshot "%s": %s' % (filename, e))
+            continue
+
+        if snapshot.__class__ is not dict or snapshot.get("version") != SNAPSHOT_VERSION:
+            continue
+
+        # files of previous versions were named by the device instance, which could belong to another topic
+        if filename != snapshot_file(directory, snapshot["topic"]):
+            logging.info('Snapshot "%s" is not named after its topic and therefore it was removed' % filename)
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            continue
+
+        # a time in the future is from before a reboot
+        age = now - snapshot["time"]
+        if 0 <= age <= max_age:
+            snapshots.append((snapshot["topic"], snapshot["values"], age))
+        else:
+            logging.info('Snapshot "%s" is too old and therefore it was ignored' % filename)
+
+    return snapshots
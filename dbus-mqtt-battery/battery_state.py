@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+
+import logging
+import json
+from collections import namedtuple
+from time import monotonic, time
+
+import perf_counters
+from battery_schema import IGNORED
+from cell_stats import cell_name, cell_stats
+from perf_counters import DERIVED, JSON_LOADS, MAPPING
+
+# the scanner of the json module, which json.loads() calls after detecting the encoding and skipping whitespace
+_scan_once = json.JSONDecoder().scan_once
+
+
+def _loads(document):
+    """json.loads() for UTF-8 JSON without whitespace around it, which the producers send.
+
+    Everything else, also invalid JSON, is passed to json.loads(), so the results and errors are the same.
+    """
+    try:
+        text = document.decode() if document.__class__ is bytes else document
+        value, end = _scan_once(text, 0)
+        if end == len(text):
+            return value
+    except (StopIteration, ValueError, TypeError):
+        pass
+    return json.loads(document)
+
+
+def _walk(node, data, values, received, generation, validators, changes, add_cell):
+    """Copy all values of one JSON object level into their slots and add the changed ones to changes.
+
+    Return the number of invalid keys and values.
+    """
+    invalid = 0
+    children = node.children
+    for key, value in data.items():
+        entry = children.get(key)
+
+        # first value of a cell
+        if entry is None and node.cells is not None:
+            entry = add_cell(node, key)
+
+        if entry.__class__ is int:
+            if entry == IGNORED:
+                continue
+            if value.__class__ in validators[entry]:
+                if values[entry] != value:
+                    values[entry] = value
+                    changes[entry] = value
+                received[entry] = generation
+                continue
+
+        elif entry is not None and value.__class__ is dict:
+            invalid += _walk(entry, value, values, received, generation, validators, changes, add_cell)
+            continue
+
+        # cells sent as list, e.g. "Voltages": [3.31, 3.32, ...]. Replaced in data for the cell statistics
+        elif entry is not None and value.__class__ is list and entry.cells is not None:
+            value = data[key] = {cell_name(index): cell for index, cell in enumerate(value)}
+            invalid += _walk(entry, value, values, received, generation, validators, changes, add_cell)
+            continue
+
+        logging.warning('Received key "' + node.prefix + "/" + str(key) + '" with value "' + str(value) + '" is not valid')
+        invalid += 1
+
+    return invalid
+
+
+# frames which the publisher did not take are combined into one frame, when there are more
+MAX_FRAME_DEPTH = 32
+
+
+class BatteryFrame(namedtuple("BatteryFrame", ["generation", "changes", "previous", "depth", "cells", "received", "produced"])):
+    """Immutable changes of a complete message as slot -> value dict.
+
+    previous is the frame before, if the publisher did not take it yet, else None, and depth the number
+    of these previous frames. cells are the slots of the cells the battery currently has. received and
+    produced are the time.monotonic() when the oldest message of the frame was received by the MQTT
+    client and created by the producer, None if unknown.
+    """
+
+    __slots__ = ()
+
+    def changed(self):
+        """Return a slot -> value dict of the changes of this and the previous frames. It must not be modified."""
+        if self.previous is None:
+            return self.changes
+
+        frames = []
+        frame = self
+        while frame is not None:
+            frames.append(frame.changes)
+            frame = frame.previous
+
+        # apply the oldest frame first, so that the newest value of a slot is kept
+        changed = {}
+        for changes in reversed(frames):
+            changed.update(changes)
+        return changed
+
+
+# creates a BatteryFrame from a tuple of all fields, without the argument handling of BatteryFrame()
+_new_frame = tuple.__new__
+
+
+class BatteryState:
+    """Values of one battery, stored by slot index of a BatterySchema.
+
+    The ingest thread writes into values and, after a complete message, replaces front with a new
+    BatteryFrame of the changed values. The publisher only reads the frames and applies them to its
+    own copy of the values, so it always sees consistent values without a lock. Both sides exchange
+    references only, which is atomic in Python.
+    """
+
+    def __init__(self, schema, TTG_enabled=1, TTG_soc=10, TTG_recalculate_every=300):
+        self.schema = schema
+
+        # values after the last message, only used by the ingest thread. The publisher starts with
+        # schema.defaults and applies the changes of the frames
+        self.values = list(schema.defaults)
+
+        # generation of the message which last contained the slot
+        self.received = [0] * len(schema.paths)
+        self.generation = 0
+
+        # slot -> value of the slots changed by the current message
+        self._changes = {}
+
+        # cell slots of every node in schema.cell_nodes and all of them together
+        self._cells = [frozenset()] * len(schema.cell_nodes)
+        self.cells = frozenset()
+
+        # keys of every node in schema.cell_nodes in the last message, if all of them were valid, else None
+        self._cell_keys = [None] * len(schema.cell_nodes)
+
+        self.front = BatteryFrame(0, {}, None, 0, self.cells, None, None)
+
+        # generation of the last frame taken by the publisher
+        self.acked = 0
+
+        # called from the ingest thread after a message changed at least one value
+        self.on_change = None
+
+        # time.monotonic() of the last received message, not affected by changes of the system time
+        self.last_changed = 0
+
+        # the values were restored from a snapshot and no new message was received since
+        self.stale = False
+
+        # the publisher invalidated the values after a timeout, they are published again with the next message
+        self.invalidated = False
+
+        self.TTG_enabled = TTG_enabled
+        self.TTG_soc = TTG_soc
+        self.TTG_recalculate_every = TTG_recalculate_every
+        self.TTG_update = None
+
+        slots = schema.slots
+        self._power = slots["/Dc/0/Power"]
+        self._voltage = slots["/Dc/0/Voltage"]
+        self._current = slots["/Dc/0/Current"]
+        self._installed_capacity = slots["/InstalledCapacity"]
+        self._consumed_amphours = slots["/ConsumedAmphours"]
+        self._capacity = slots["/Capacity"]
+        self._soc = slots["/Soc"]
+        self._time_to_go = slots["/TimeToGo"]
+        self._min_voltage_cell_id = slots["/System/MinVoltageCellId"]
+        self._min_cell_voltage = slots["/System/MinCellVoltage"]
+        self._max_voltage_cell_id = slots["/System/MaxVoltageCellId"]
+        self._max_cell_voltage = slots["/System/MaxCellVoltage"]
+        self._voltages_sum = slots["/Voltages/Sum"]
+        self._voltages_diff = slots["/Voltages/Diff"]
+        self._nr_of_cells_per_battery = slots["/System/NrOfCellsPerBattery"]
+
+    def __getitem__(self, path):
+        return self.values[self.schema.slots[path]]
+
+    def _set(self, slot, value):
+        if self.values[slot] != value:
+            self.values[slot] = value
+            self._changes[slot] = value
+
+    def _swap(self, received=None, produced=None):
+        """Publish the changes of the current message as new front frame."""
+        changes = self._changes
+        self._changes = {}
+
+        # the publisher did not take the previous frame yet, keep it and the times of its message
+        front = self.front
+        if self.acked != front.generation:
+            if front.received is not None:
+                received = front.received
+                produced = front.produced
+            frame = _new_frame(BatteryFrame, (self.generation, changes, front, front.depth + 1, self.cells, received, produced))
+
+            # nobody takes the frames, e.g. without a publisher, combine them so that they do not pile up
+            if frame.depth > MAX_FRAME_DEPTH:
+                frame = _new_frame(BatteryFrame, (self.generation, frame.changed(), None, 0, self.cells, received, produced))
+        else:
+            frame = _new_frame(BatteryFrame, (self.generation, changes, None, 0, self.cells, received, produced))
+
+        self.front = frame
+
+    def _grow(self):
+        """Add the slots which other batteries added to the schema since."""
+        schema = self.schema
+        self.values.extend(schema.defaults[len(self.values) :])
+        self.received.extend([0] * (len(schema.paths) - len(self.received)))
+
+    def _add_cell(self, node, key):
+        slot = self.schema.add_cell(node, key)
+        if slot is not None and slot >= len(self.values):
+            self._grow()
+        return slot
+
+    def _update_cells(self, jsonpayload, generation, invalid):
+        """Update the cells of the battery from the cells in the payload. Return True if they changed.
+
+        invalid is the number of invalid keys and values in the payload.
+        """
+        schema = self.schema
+        received = self.received
+        is_cell = schema.is_cell
+
+        changed = False
+        for index, (key, node) in enumerate(schema.cell_nodes):
+            cells = self._cells[index]
+            data = jsonpayload.get(key)
+
+            if data.__class__ is dict:
+                # the same keys as in the last message and all values valid, so the cells are the same
+                if invalid == 0 and data.keys() == self._cell_keys[index]:
+                    continue
+                self._cell_keys[index] = frozenset(data) if invalid == 0 else None
+
+                current = frozenset(slot for slot in node.children.values() if slot.__class__ is int and is_cell[slot] and received[slot] == generation)
+
+                # remove the cells which are not sent anymore
+                for slot in cells - current:
+                    self._set(slot, None)
+
+            else:
+                # without cell values the cells are created from NrOfCellsPerBattery
+                number = self.values[self._nr_of_cells_per_battery] if received[self._nr_of_cells_per_battery] == generation else None
+                if len(cells) != 0 or number.__class__ is not int or number <= 0:
+                    continue
+
+                self._cell_keys[index] = None
+                current = frozenset(self._add_cell(node, "Cell" + str(cell)) for cell in range(1, number + 1))
+
+            if current != cells:
+                self._cells[index] = current
+                changed = True
+
+        if changed:
+            self.cells = frozenset().union(*self._cells)
+        return changed
+
+    def take_frame(self):
+        """Return the front frame, if it was not taken yet, else None."""
+        frame = self.front
+        if frame.generation == self.acked:
+            return None
+        self.acked = frame.generation
+        return frame
+
+    def set_values(self, items):
+        """Apply (slot, value) pairs which were calculated elsewhere, e.g. by a BatteryAggregate."""
+        self.last_changed = monotonic()
+        self.generation += 1
+
+        refresh = self.invalidated
+        self.invalidated = False
+
+        for slot, value in items:
+            self._set(slot, value)
+
+        if self._changes or refresh:
+            self._swap()
+            if self.on_change is not None:
+                self.on_change()
+
+    def restore(self, snapshot):
+        """Apply the path -> value dict of a snapshot. The values are stale until the next message."""
+        schema = self.schema
+        validators = schema.validators
+
+        for path, value in snapshot.items():
+            slot = schema.slot(path)
+            if slot is not None and value.__class__ in validators[slot]:
+                if slot >= len(self.values):
+                    self._grow()
+                self._set(slot, value)
+
+        # the snapshot contains only the cells the battery had
+        if len(self.values) < len(schema.paths):
+            self._grow()
+        for index, (key, node) in enumerate(schema.cell_nodes):
+            self._cells[index] = frozenset(slot for slot in node.children.values() if slot.__class__ is int and schema.is_cell[slot] and self.values[slot] is not None)
+            self._cell_keys[index] = None
+        self.cells = frozenset().union(*self._cells)
+
+        self.stale = True
+        self.last_changed = monotonic()
+        self.generation += 1
+        self._swap()
+        if self.on_change is not None:
+            self.on_change()
+
+    def ingest_payload(self, payload, timestamp=None):
+        """Parse a MQTT payload and apply it. Raises ValueError for invalid JSON.
+
+        timestamp is the time.monotonic() when the MQTT client received the message.
+        """
+        if payload == "" or payload == b"":
+            logging.warning("Received message was empty and therefore it was ignored")
+            logging.debug("MQTT payload: " + str(payload)[1:])
+            return False
+
+        perf = perf_counters.counters
+        if perf is not None:
+            start = monotonic()
+
+        jsonpayload = _loads(payload)
+
+        self.last_changed = monotonic()
+
+        if "value" in jsonpayload:
+            jsonpayload = _loads(jsonpayload["value"])
+
+        if perf is not None:
+            perf.add(JSON_LOADS, monotonic() - start)
+
+        return self.ingest(jsonpayload, timestamp)
+
+    def ingest(self, jsonpayload, timestamp=None):
+        """Apply a decoded JSON payload and calculate missing values."""
+        dc = jsonpayload.get("Dc") if jsonpayload.__class__ is dict else None
+        if dc.__class__ is not dict or "Soc" not in jsonpayload or not (("Power" in dc and "Voltage" in dc) or ("0" in dc and dc["0"].__class__ is dict and "Power" in dc["0"] and "Voltage" in dc["0"])):
+            logging.warning("Received JSON doesn't contain minimum required values")
+            logging.warning('Example: {"Dc":{"Power":321.6,"Voltage":52.7},"Soc":63}')
+            logging.debug("MQTT payload: " + str(jsonpayload))
+            return False
+
+        perf = perf_counters.counters
+        if perf is not None:
+            start = monotonic()
+
+        # slots which other batteries added to the schema
+        if len(self.values) < len(self.schema.paths):
+            self._grow()
+
+        self.generation += 1
+        generation = self.generation
+
+        # the first message after a restore or a timeout has to be published, even if no value changed
+        refresh = self.stale or self.invalidated
+        if refresh:
+            self.stale = False
+            self.invalidated = False
+        values = self.values
+        received = self.received
+
+        # save JSON data into the slots
+        invalid = _walk(self.schema.root, jsonpayload, values, received, generation, self.schema.validators, self._changes, self._add_cell)
+        _set = self._set
+
+        # the cells can only change with cell values or NrOfCellsPerBattery
+        if "Voltages" in jsonpayload or "Balances" in jsonpayload or received[self._nr_of_cells_per_battery] == generation:
+            cells_changed = self._update_cells(jsonpayload, generation, invalid)
+        else:
+            cells_changed = False
+
+        if perf is not None:
+            mapped = monotonic()
+            perf.add(MAPPING, mapped - start)
+
+        # ------ calculate possible values if missing -----
+        # Current, which changes with almost every message, so _set() is inlined
+        slot = self._current
+        if received[slot] != generation:
+            value = round(values[self._power] / values[self._voltage], 3) if values[self._voltage] != 0 else 0
+            if values[slot] != value:
+                values[slot] = value
+                self._changes[slot] = value
+
+        installed_capacity = values[self._installed_capacity]
+
+        # all of them need the InstalledCapacity
+        if installed_capacity is not None:
+            # ConsumedAmphours
+            if received[self._consumed_amphours] != generation and values[self._capacity] is not None:
+                _set(self._consumed_amphours, installed_capacity - values[self._capacity])
+
+            # Capacity
+            if received[self._capacity] != generation and values[self._consumed_amphours] is not None:
+                _set(self._capacity, installed_capacity - values[self._consumed_amphours])
+
+            # ConsumedAmphours & Capacity based on InstalledCapacity and SoC
+            if received[self._consumed_amphours] != generation and received[self._capacity] != generation:
+                _set(self._consumed_amphours, round(installed_capacity * (100 - values[self._soc]) / 100, 2))
+                _set(self._capacity, round(installed_capacity * values[self._soc] / 100, 2))
+
+            # TimeToGo
+            if (
+                received[self._time_to_go] != generation
+                and self.TTG_enabled == 1
+                and values[self._current] is not None
+                and values[self._capacity] is not None
+                and (self.TTG_update is None or monotonic() - self.TTG_update >= self.TTG_recalculate_every)
+            ):
+                self.TTG_update = monotonic()
+                current = values[self._current]
+
+                # charging -> calculate time until 100% SoC
+                if current > 0:
+                    _set(self._time_to_go, abs(round(((installed_capacity - values[self._capacity]) / current * 60 * 60), 0)))
+
+                # discharging -> calculate time until TTG_soc SoC
+                elif current < 0:
+                    _set(self._time_to_go, abs(round(((values[self._capacity] - (installed_capacity * self.TTG_soc / 100)) / current * 60 * 60 * -1), 0)))
+
+                # if current is 0 display 30 days
+                else:
+                    _set(self._time_to_go, 60 * 60 * 24 * 30)
+
+        # MinVoltageCellId, MinCellVoltage, MaxVoltageCellId, MaxCellVoltage, Sum, Diff
+        voltages = jsonpayload.get("Voltages")
+        if voltages.__class__ is dict and len(voltages) > 0:
+            stats = cell_stats(voltages)
+            if stats is not None:
+                if received[self._min_voltage_cell_id] != generation:
+                    _set(self._min_voltage_cell_id, stats.min_id)
+
+                if received[self._min_cell_voltage] != generation:
+                    _set(self._min_cell_voltage, stats.min)
+
+                if received[self._max_voltage_cell_id] != generation:
+                    _set(self._max_voltage_cell_id, stats.max_id)
+
+                if received[self._max_cell_voltage] != generation:
+                    _set(self._max_cell_voltage, stats.max)
+
+                if received[self._voltages_sum] != generation:
+                    _set(self._voltages_sum, stats.sum)
+
+                if received[self._voltages_diff] != generation and values[self._min_cell_voltage] is not None and values[self._max_cell_voltage] is not None:
+                    _set(self._voltages_diff, values[self._max_cell_voltage] - values[self._min_cell_voltage])
+
+        if perf is not None:
+            perf.add(DERIVED, monotonic() - mapped)
+
+        if self._changes or cells_changed or refresh:
+            # time when the producer created the message in seconds since the epoch, converted to time.monotonic()
+            produced = jsonpayload.get("Timestamp")
+            if produced.__class__ is int or produced.__class__ is float:
+                # milliseconds, e.g. Date.now() in JavaScript
+                if produced > 1e11:
+                    produced /= 1000
+                produced = monotonic() - (time() - produced)
+            else:
+                produced = None
+
+            self._swap(timestamp, produced)
+            if self.on_change is not None:
+                self.on_change()
+
+        return True
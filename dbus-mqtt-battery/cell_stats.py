@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+from collections import namedtuple
+
+# keys in the Voltages object which are no cells
+summary_keys = ("Sum", "Diff")
+
+
+class CellStats(namedtuple("CellStats", ["count", "min_id", "min", "max_id", "max", "sum", "diff", "values"])):
+    """Statistics of the cell values of one message. min_id and max_id are the key of the lowest and
+    highest cell, for a list the cell name "Cell<n>" starting with 1. values are the valid cell values.
+
+    mean and std are not published, so they are only calculated when they are used.
+    """
+
+    __slots__ = ()
+
+    @property
+    def mean(self):
+        return self.sum / self.count
+
+    @property
+    def std(self):
+        mean = self.mean
+        variance = sum((value - mean) * (value - mean) for value in self.values) / self.count
+        return variance**0.5
+
+
+def cell_name(index):
+    """Name of the cell at list index, as used in the Voltages and Balances paths."""
+    return "Cell" + str(index + 1)
+
+
+def cell_stats(cells):
+    """Calculate the statistics of a dict or list of cell values.
+
+    Values which are no numbers are skipped. Returns None if there is no valid cell.
+    """
+    if cells.__class__ is dict:
+        for key in summary_keys:
+            if key in cells:
+                cells = {key: value for key, value in cells.items() if key not in summary_keys}
+                break
+        keys = list(cells)
+        values = list(cells.values())
+    else:
+        keys = None
+        values = list(cells)
+
+    # the builtins iterate in C, which is faster than a single pass in Python. A TypeError means,
+    # that there are values which are no numbers
+    try:
+        total = sum(values)
+    except TypeError:
+        valid = [index for index, value in enumerate(values) if value.__class__ is float or value.__class__ is int]
+        keys = [keys[index] for index in valid] if keys is not None else [cell_name(index) for index in valid]
+        values = [values[index] for index in valid]
+        total = sum(values)
+
+    if len(values) == 0:
+        return None
+
+    low = min(values)
+    high = max(values)
+
+    # the first cell with the lowest and highest value
+    low_index = values.index(low)
+    high_index = values.index(high)
+    if keys is not None:
+        low_id = keys[low_index]
+        high_id = keys[high_index]
+    else:
+        low_id = cell_name(low_index)
+        high_id = cell_name(high_index)
+
+    return CellStats(len(values), low_id, low, high_id, high, total, high - low, values)
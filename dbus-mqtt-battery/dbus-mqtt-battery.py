@@ -1,24 +1,36 @@
 #!/usr/bin/env python
 
 from gi.repository import GLib  # pyright: ignore[reportMissingImports]
+import dbus  # pyright: ignore[reportMissingImports]
 import platform
 import logging
+import json
 import sys
 import os
-from time import sleep, time
-import json
+import zlib
+from time import sleep, monotonic
 import configparser  # for config/ini file
 import _thread
 
 # import external packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext"))
 import paho.mqtt.client as mqtt
+from paho.mqtt.matcher import MQTTMatcher
 
 # import Victron Energy packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext", "velib_python"))
 from vedbus import VeDbusService  # noqa: E402
 from ve_utils import get_vrm_portal_id  # noqa: E402
 
+# import driver modules
+from battery_schema import BatterySchema, _ms, _n  # noqa: E402
+from battery_state import BatteryState  # noqa: E402
+from battery_aggregate import BatteryAggregate  # noqa: E402
+from battery_snapshot import load_snapshots, save_snapshot, snapshot_file  # noqa: E402
+from latency_histogram import LatencyHistogram  # noqa: E402
+import perf_counters  # noqa: E402
+from perf_counters import DBUS_UPDATE, TEXT_FORMAT, stage_names  # noqa: E402
+from mqtt_capture import CaptureWriter  # noqa: E402
 
 # get values from config.ini file
 try:
@@ -69,6 +81,14 @@ if "DEFAULT" in config and "timeout" in config["DEFAULT"]:
 else:
     timeout = 60
 
+# get timeout action
+# invalidate = set /Connected to 0 and invalidate the values until new data arrives
+# exit = stop the driver, it is restarted by the service manager
+if "DEFAULT" in config and "timeout_action" in config["DEFAULT"] and config["DEFAULT"]["timeout_action"] == "exit":
+    timeout_action = "exit"
+else:
+    timeout_action = "invalidate"
+
 
 # check if Time-To-Go is enabled in config
 if "TIME_TO_GO" in config and "enabled" in config["TIME_TO_GO"] and config["TIME_TO_GO"]["enabled"] == "1":
@@ -89,275 +109,254 @@ else:
     TTG_recalculate_every = 300
 
 
+# check if the changes should be sent with one ItemsChanged signal per update
+if "DBUS" in config and "batch_signals" in config["DBUS"] and config["DBUS"]["batch_signals"] == "0":
+    batch_signals = 0
+else:
+    batch_signals = 1
+
+
+# check if the text of the values is sent with the change signals
+# without it, the text is only created when a D-Bus consumer requests it
+if "DBUS" in config and "signal_text" in config["DBUS"] and config["DBUS"]["signal_text"] == "0":
+    signal_text = 0
+else:
+    signal_text = 1
+
+
+# get publish mode
+# event = publish to D-Bus as soon as a new MQTT message was received
+# timer = publish to D-Bus every second
+if "DBUS" in config and "publish_mode" in config["DBUS"] and config["DBUS"]["publish_mode"] == "timer":
+    publish_mode = "timer"
+else:
+    publish_mode = "event"
+
+# get minimum interval between two publishes in event mode
+if "DBUS" in config and "publish_min_interval" in config["DBUS"]:
+    publish_min_interval = int(config["DBUS"]["publish_min_interval"]) / 1000
+else:
+    publish_min_interval = 0.1
+
+# check if the paths should be added to D-Bus only when they get their first value
+if "DBUS" in config and "lazy_export" in config["DBUS"] and config["DBUS"]["lazy_export"] == "0":
+    lazy_export = 0
+else:
+    lazy_export = 1
+
+
+# check if a snapshot of the values should be saved, to publish the battery immediately after a restart of the driver
+if "SNAPSHOT" in config and "enabled" in config["SNAPSHOT"] and config["SNAPSHOT"]["enabled"] == "0":
+    snapshot_enabled = 0
+else:
+    snapshot_enabled = 1
+
+# get snapshot directory, it should be on a tmpfs
+if "SNAPSHOT" in config and "path" in config["SNAPSHOT"]:
+    snapshot_path = config["SNAPSHOT"]["path"]
+else:
+    snapshot_path = "/run/dbus-mqtt-battery"
+
+# get maximum age of a snapshot in seconds to be used on startup
+if "SNAPSHOT" in config and "max_age" in config["SNAPSHOT"]:
+    snapshot_max_age = int(config["SNAPSHOT"]["max_age"])
+else:
+    snapshot_max_age = 120
+
+# get minimum time between two snapshots in seconds
+if "SNAPSHOT" in config and "interval" in config["SNAPSHOT"]:
+    snapshot_interval = int(config["SNAPSHOT"]["interval"])
+else:
+    snapshot_interval = 10
+
+
+# check if the latency from the MQTT message to D-Bus should be measured
+if "DEBUG" in config and "latency" in config["DEBUG"] and config["DEBUG"]["latency"] == "1":
+    debug_latency = 1
+else:
+    debug_latency = 0
+
+# check if the time of the stages from the socket to D-Bus should be measured
+if "DEBUG" in config and "perf" in config["DEBUG"] and config["DEBUG"]["perf"] == "1":
+    debug_perf = 1
+else:
+    debug_perf = 0
+
+# get MQTT topic, to which the perf counters are published every interval, empty to disable
+if "DEBUG" in config and "stats_topic" in config["DEBUG"]:
+    debug_stats_topic = config["DEBUG"]["stats_topic"]
+else:
+    debug_stats_topic = ""
+
+# get interval in seconds, in which the debug values are updated on D-Bus
+if "DEBUG" in config and "interval" in config["DEBUG"]:
+    debug_interval = int(config["DEBUG"]["interval"])
+else:
+    debug_interval = 10
+
+perf = perf_counters.enable() if debug_perf else None
+
+# get file, to which all received MQTT messages are appended, empty to disable
+if "DEBUG" in config and "capture" in config["DEBUG"]:
+    debug_capture = config["DEBUG"]["capture"]
+else:
+    debug_capture = ""
+
+# get maximum size of the capture file in MB
+if "DEBUG" in config and "capture_max_size" in config["DEBUG"]:
+    debug_capture_max_size = int(config["DEBUG"]["capture_max_size"]) * 1024 * 1024
+else:
+    debug_capture_max_size = 10 * 1024 * 1024
+
+# CaptureWriter of the received MQTT messages, created in main()
+capture = None
+
+
+# get batteries
+# every [BATTERY:n] section adds a battery with its own topic and D-Bus service. Without any section
+# the topic of [MQTT] and the device settings of [DEFAULT] are used
+battery_configs = []
+for section in config.sections():
+    if section.startswith("BATTERY:"):
+        battery_configs.append(
+            {
+                "topic": config[section]["topic"],
+                "device_instance": int(config[section]["device_instance"]),
+                "device_name": config[section]["device_name"],
+                "device_instance_level": config[section].get("device_instance_level", ""),
+            }
+        )
+
+if len(battery_configs) == 0:
+    battery_configs.append(
+        {
+            "topic": config["MQTT"]["topic"],
+            "device_instance": int(config["DEFAULT"]["device_instance"]),
+            "device_name": config["DEFAULT"]["device_name"],
+            "device_instance_level": config["MQTT"].get("device_instance_level", ""),
+        }
+    )
+
+# topic filters with the wildcards + or # are used to discover batteries, when their first message arrives
+discovery_configs = [battery for battery in battery_configs if "+" in battery["topic"] or "#" in battery["topic"]]
+battery_configs = [battery for battery in battery_configs if battery not in discovery_configs]
+
+discovery_matcher = MQTTMatcher()
+for battery in discovery_configs:
+    discovery_matcher[battery["topic"]] = battery
+
+# check if a virtual battery, which combines the values of all batteries, should be created
+if "AGGREGATE" in config and "enabled" in config["AGGREGATE"] and config["AGGREGATE"]["enabled"] == "1":
+    aggregate_config = {
+        "topic": "aggregate",
+        "device_instance": int(config["AGGREGATE"].get("device_instance", "200")),
+        "device_name": config["AGGREGATE"].get("device_name", "MQTT Battery Aggregate"),
+    }
+else:
+    aggregate_config = None
+
+# the batteries export the same object paths, so with more than one battery each service needs its own D-Bus connection
+private_bus = len(battery_configs) > 1 or len(discovery_configs) > 0 or aggregate_config is not None
+
+
 # set variables
 connected = 0
-last_changed = 0
-last_updated = 0
-TTG_update = 0
-
-
-# formatting
-def _a(p, v):
-    return str("%.1f" % v) + "A"
-
-
-def _ah(p, v):
-    return str("%.1f" % v) + "Ah"
-
-
-def _n(p, v):
-    return str("%i" % v)
-
-
-def _p(p, v):
-    return str("%i" % v) + "%"
-
-
-def _s(p, v):
-    return str("%s" % v)
-
-
-def _t(p, v):
-    return str("%.1f" % v) + "°C"
-
-
-def _v(p, v):
-    return str("%.2f" % v) + "V"
-
-
-def _v3(p, v):
-    return str("%.3f" % v) + "V"
-
-
-def _w(p, v):
-    return str("%i" % v) + "W"
-
-
-battery_dict = {
-    # general data
-    "/Dc/0/Power": {"value": None, "textformat": _w},
-    "/Dc/0/Voltage": {"value": None, "textformat": _v},
-    "/Dc/0/Current": {"value": None, "textformat": _a},
-    "/Dc/0/Temperature": {"value": None, "textformat": _t},
-    "/InstalledCapacity": {"value": None, "textformat": _ah},
-    "/ConsumedAmphours": {"value": None, "textformat": _ah},
-    "/Capacity": {"value": None, "textformat": _ah},
-    "/Soc": {"value": None, "textformat": _p},
-    "/TimeToGo": {"value": None, "textformat": _n},
-    "/Balancing": {"value": None, "textformat": _n},
-    "/SystemSwitch": {"value": None, "textformat": _n},
-    # alarms
-    "/Alarms/LowVoltage": {"value": 0, "textformat": _n},
-    "/Alarms/HighVoltage": {"value": 0, "textformat": _n},
-    "/Alarms/LowSoc": {"value": 0, "textformat": _n},
-    "/Alarms/HighChargeCurrent": {"value": 0, "textformat": _n},
-    "/Alarms/HighDischargeCurrent": {"value": 0, "textformat": _n},
-    "/Alarms/HighCurrent": {"value": 0, "textformat": _n},
-    "/Alarms/CellImbalance": {"value": 0, "textformat": _n},
-    "/Alarms/HighChargeTemperature": {"value": 0, "textformat": _n},
-    "/Alarms/LowChargeTemperature": {"value": 0, "textformat": _n},
-    "/Alarms/LowCellVoltage": {"value": 0, "textformat": _n},
-    "/Alarms/LowTemperature": {"value": 0, "textformat": _n},
-    "/Alarms/HighTemperature": {"value": 0, "textformat": _n},
-    "/Alarms/FuseBlown": {"value": 0, "textformat": _n},
-    # info
-    "/Info/ChargeRequest": {"value": None, "textformat": _n},
-    "/Info/MaxChargeVoltage": {"value": None, "textformat": _v},
-    "/Info/MaxChargeCurrent": {"value": None, "textformat": _a},
-    "/Info/MaxDischargeCurrent": {"value": None, "textformat": _a},
-    "/Info/MaxChargeCellVoltage": {"value": None, "textformat": _v3},
-    "/Info/HeatingCurrent": {"value": None, "textformat": _a},
-    "/Info/HeatingPower": {"value": None, "textformat": _w},
-    "/Info/HeatingTemperatureStart": {"value": None, "textformat": _t},
-    "/Info/HeatingTemperatureStop": {"value": None, "textformat": _t},
-    # history
-    "/History/ChargeCycles": {"value": None, "textformat": _n},
-    "/History/MinimumVoltage": {"value": None, "textformat": _v},
-    "/History/MaximumVoltage": {"value": None, "textformat": _v},
-    "/History/TotalAhDrawn": {"value": None, "textformat": _ah},
-    # system
-    "/System/MinVoltageCellId": {"value": None, "textformat": _s},
-    "/System/MinCellVoltage": {"value": None, "textformat": _v3},
-    "/System/MaxVoltageCellId": {"value": None, "textformat": _s},
-    "/System/MaxCellVoltage": {"value": None, "textformat": _v3},
-    "/System/MinTemperatureCellId": {"value": None, "textformat": _s},
-    "/System/MinCellTemperature": {"value": None, "textformat": _t},
-    "/System/MaxTemperatureCellId": {"value": None, "textformat": _s},
-    "/System/MaxCellTemperature": {"value": None, "textformat": _t},
-    "/System/MOSTemperature": {"value": None, "textformat": _t},
-    "/System/NrOfCellsPerBattery": {"value": 0, "textformat": _n},
-    "/System/NrOfModulesOnline": {"value": 1, "textformat": _n},
-    "/System/NrOfModulesOffline": {"value": 0, "textformat": _n},
-    "/System/NrOfModulesBlockingCharge": {"value": 0, "textformat": _n},
-    "/System/NrOfModulesBlockingDischarge": {"value": 0, "textformat": _n},
-    # cell voltages
-    "/Voltages/Sum": {"value": None, "textformat": _v},
-    "/Voltages/Diff": {"value": None, "textformat": _v3},
-    "/Voltages/Cell1": {"value": None, "textformat": _v3},
-    "/Voltages/Cell2": {"value": None, "textformat": _v3},
-    "/Voltages/Cell3": {"value": None, "textformat": _v3},
-    "/Voltages/Cell4": {"value": None, "textformat": _v3},
-    "/Voltages/Cell5": {"value": None, "textformat": _v3},
-    "/Voltages/Cell6": {"value": None, "textformat": _v3},
-    "/Voltages/Cell7": {"value": None, "textformat": _v3},
-    "/Voltages/Cell8": {"value": None, "textformat": _v3},
-    "/Voltages/Cell9": {"value": None, "textformat": _v3},
-    "/Voltages/Cell10": {"value": None, "textformat": _v3},
-    "/Voltages/Cell11": {"value": None, "textformat": _v3},
-    "/Voltages/Cell12": {"value": None, "textformat": _v3},
-    "/Voltages/Cell13": {"value": None, "textformat": _v3},
-    "/Voltages/Cell14": {"value": None, "textformat": _v3},
-    "/Voltages/Cell15": {"value": None, "textformat": _v3},
-    "/Voltages/Cell16": {"value": None, "textformat": _v3},
-    "/Voltages/Cell17": {"value": None, "textformat": _v3},
-    "/Voltages/Cell18": {"value": None, "textformat": _v3},
-    "/Voltages/Cell19": {"value": None, "textformat": _v3},
-    "/Voltages/Cell20": {"value": None, "textformat": _v3},
-    "/Voltages/Cell21": {"value": None, "textformat": _v3},
-    "/Voltages/Cell22": {"value": None, "textformat": _v3},
-    "/Voltages/Cell23": {"value": None, "textformat": _v3},
-    "/Voltages/Cell24": {"value": None, "textformat": _v3},
-    "/Balances/Cell1": {"value": None, "textformat": _n},
-    "/Balances/Cell2": {"value": None, "textformat": _n},
-    "/Balances/Cell3": {"value": None, "textformat": _n},
-    "/Balances/Cell4": {"value": None, "textformat": _n},
-    "/Balances/Cell5": {"value": None, "textformat": _n},
-    "/Balances/Cell6": {"value": None, "textformat": _n},
-    "/Balances/Cell7": {"value": None, "textformat": _n},
-    "/Balances/Cell8": {"value": None, "textformat": _n},
-    "/Balances/Cell9": {"value": None, "textformat": _n},
-    "/Balances/Cell10": {"value": None, "textformat": _n},
-    "/Balances/Cell11": {"value": None, "textformat": _n},
-    "/Balances/Cell12": {"value": None, "textformat": _n},
-    "/Balances/Cell13": {"value": None, "textformat": _n},
-    "/Balances/Cell14": {"value": None, "textformat": _n},
-    "/Balances/Cell15": {"value": None, "textformat": _n},
-    "/Balances/Cell16": {"value": None, "textformat": _n},
-    "/Balances/Cell17": {"value": None, "textformat": _n},
-    "/Balances/Cell18": {"value": None, "textformat": _n},
-    "/Balances/Cell19": {"value": None, "textformat": _n},
-    "/Balances/Cell20": {"value": None, "textformat": _n},
-    "/Balances/Cell21": {"value": None, "textformat": _n},
-    "/Balances/Cell22": {"value": None, "textformat": _n},
-    "/Balances/Cell23": {"value": None, "textformat": _n},
-    "/Balances/Cell24": {"value": None, "textformat": _n},
-    # IO
-    "/Io/AllowToBalance": {"value": None, "textformat": _n},
-    "/Io/AllowToCharge": {"value": None, "textformat": _n},
-    "/Io/AllowToDischarge": {"value": None, "textformat": _n},
-    "/Io/AllowToHeat": {"value": None, "textformat": _n},
-    "/Io/ExternalRelay": {"value": None, "textformat": _n},
-    # Time To Soc
-    "/TimeToSoC/0": {"value": None, "textformat": _s},
-    "/TimeToSoC/5": {"value": None, "textformat": _s},
-    "/TimeToSoC/10": {"value": None, "textformat": _s},
-    "/TimeToSoC/15": {"value": None, "textformat": _s},
-    "/TimeToSoC/20": {"value": None, "textformat": _s},
-    "/TimeToSoC/25": {"value": None, "textformat": _s},
-    "/TimeToSoC/30": {"value": None, "textformat": _s},
-    "/TimeToSoC/35": {"value": None, "textformat": _s},
-    "/TimeToSoC/40": {"value": None, "textformat": _s},
-    "/TimeToSoC/45": {"value": None, "textformat": _s},
-    "/TimeToSoC/50": {"value": None, "textformat": _s},
-    "/TimeToSoC/55": {"value": None, "textformat": _s},
-    "/TimeToSoC/60": {"value": None, "textformat": _s},
-    "/TimeToSoC/65": {"value": None, "textformat": _s},
-    "/TimeToSoC/70": {"value": None, "textformat": _s},
-    "/TimeToSoC/75": {"value": None, "textformat": _s},
-    "/TimeToSoC/80": {"value": None, "textformat": _s},
-    "/TimeToSoC/85": {"value": None, "textformat": _s},
-    "/TimeToSoC/90": {"value": None, "textformat": _s},
-    "/TimeToSoC/95": {"value": None, "textformat": _s},
-    "/TimeToSoC/100": {"value": None, "textformat": _s},
-    # EXTRA
-    "/Alarms/BmsCable": {"value": None, "textformat": _n},
-    "/Alarms/HighCellVoltage": {"value": None, "textformat": _n},
-    "/Alarms/HighInternalTemperature": {"value": None, "textformat": _n},
-    "/Alarms/InternalFailure": {"value": None, "textformat": _n},
-    "/Alarms/StateOfHealth": {"value": None, "textformat": _n},
-    "/ConnectionInformation": {"value": None, "textformat": _s},
-    "/CurrentAvg": {"value": None, "textformat": _a},
-    "/Dc/0/MidVoltage": {"value": None, "textformat": _v},
-    "/Dc/0/MidVoltageDeviation": {"value": None, "textformat": _v},
-    "/Heating": {"value": None, "textformat": _n},
-    "/History/AverageDischarge": {"value": None, "textformat": _n},
-    "/History/ChargedEnergy": {"value": None, "textformat": _n},
-    "/History/DeepestDischarge": {"value": None, "textformat": _n},
-    "/History/DischargedEnergy": {"value": None, "textformat": _n},
-    "/History/FullDischarges": {"value": None, "textformat": _n},
-    "/History/HighVoltageAlarms": {"value": None, "textformat": _n},
-    "/History/LastDischarge": {"value": None, "textformat": _n},
-    "/History/LowVoltageAlarms": {"value": None, "textformat": _n},
-    "/History/MaximumCellVoltage": {"value": None, "textformat": _n},
-    "/History/MaximumTemperature": {"value": None, "textformat": _n},
-    "/History/MinimumCellVoltage": {"value": None, "textformat": _n},
-    "/History/MinimumTemperature": {"value": None, "textformat": _n},
-    "/History/TimeSinceLastFullCharge": {"value": None, "textformat": _n},
-    "/Info/BatteryLowVoltage": {"value": None, "textformat": _n},
-    "/Info/ChargeLimitation": {"value": None, "textformat": _s},
-    "/Info/ChargeMode": {"value": None, "textformat": _s},
-    "/Info/DischargeLimitation": {"value": None, "textformat": _s},
-    "/Io/ForceChargingOff": {"value": None, "textformat": _n},
-    "/Io/ForceDischargingOff": {"value": None, "textformat": _n},
-    "/Io/TurnBalancingOff": {"value": None, "textformat": _n},
-    "/Settings/HasTemperature": {"value": None, "textformat": _n},
-    "/SocBms": {"value": None, "textformat": _p},
-    "/Soh": {"value": None, "textformat": _p},
-    "/State": {"value": None, "textformat": _n},
-    "/System/Temperature1": {"value": None, "textformat": _t},
-    "/System/Temperature1Name": {"value": None, "textformat": _s},
-    "/System/Temperature2": {"value": None, "textformat": _t},
-    "/System/Temperature2Name": {"value": None, "textformat": _s},
-    "/System/Temperature3": {"value": None, "textformat": _t},
-    "/System/Temperature3Name": {"value": None, "textformat": _s},
-    "/System/Temperature4": {"value": None, "textformat": _t},
-    "/System/Temperature4Name": {"value": None, "textformat": _s},
-}
-
-ignore_list = [
-    "/FirmwareVersion",
-    "/HardwareVersion",
-    "/Connected",
-    "/CustomName",
-    "/DeviceInstance",
-    "/DeviceName",
-    "/ErrorCode",
-    "/Family",
-    "/Manufacturer",
-    "/Mgmt/Connection",
-    "/Mgmt/ProcessName",
-    "/Mgmt/ProcessVersion",
-    "/ProductId",
-    "/ProductName",
-    "/Serial",
-    "/Info/ChargeModeDebug",
-    "/Info/ChargeModeDebugFloat",
-    "/Info/ChargeModeDebugBulk",
-    "/History/CanBeCleared",
-    "/History/Clear",
-    "/JsonData",
-]
+
+# maximum time in seconds between two attempts to reconnect to the MQTT broker
+reconnect_max_delay = 15
+
+battery_schema = BatterySchema()
+
+# topic -> battery config, used to dispatch the MQTT messages. Topics which do not belong to a
+# battery are cached as None, so every topic is looked up in the discovery filters only once
+batteries = {}
+for battery in battery_configs:
+    battery["state"] = BatteryState(
+        battery_schema,
+        TTG_enabled=TTG_enabled,
+        TTG_soc=TTG_soc,
+        TTG_recalculate_every=TTG_recalculate_every,
+    )
+
+    # create the D-Bus service in the GLib main loop, as soon as the first valid data was received
+    battery["state"].on_change = lambda battery=battery: schedule_battery_service(battery)
+    batteries[battery["topic"]] = battery
+
+subscriptions = [battery["topic"] for battery in battery_configs + discovery_configs]
+
+aggregate = None
+if aggregate_config is not None:
+    aggregate_config["state"] = BatteryState(battery_schema, TTG_enabled=0)
+
+    # the D-Bus service is created, as soon as the first battery sent valid data
+    aggregate_config["state"].on_change = lambda: schedule_battery_service(aggregate_config)
+    aggregate = BatteryAggregate(aggregate_config["state"], timeout=timeout)
+
+
+def discover_battery(topic):
+    """Create a battery for a new topic, if it matches a discovery topic filter, else return None."""
+    for discovery in discovery_matcher.iter_match(topic):
+        break
+    else:
+        return None
+
+    used_instances = [battery["device_instance"] for battery in batteries.values() if battery is not None]
+    if aggregate_config is not None:
+        used_instances.append(aggregate_config["device_instance"])
+
+    # use the number in the configured topic level as offset to the device instance, e.g. the
+    # battery instance of N/<VRM_ID>/battery/<BATTERY_INSTANCE>/JsonData with level 3. Else the number
+    # is derived from the topic, so that the battery keeps its device instance after a restart,
+    # independent of the order in which the batteries appear
+    levels = topic.split("/")
+    level = discovery["device_instance_level"]
+    if level != "" and int(level) < len(levels) and levels[int(level)].isdigit():
+        number = int(levels[int(level)])
+    else:
+        number = zlib.crc32(topic.encode()) % 100 + 1
+
+    device_instance = discovery["device_instance"] + number
+    while device_instance in used_instances:
+        device_instance += 1
+
+    battery = {
+        "topic": topic,
+        "device_instance": device_instance,
+        "device_name": discovery["device_name"] + " " + str(number),
+        "discovery": discovery,
+        "state": BatteryState(
+            battery_schema,
+            TTG_enabled=TTG_enabled,
+            TTG_soc=TTG_soc,
+            TTG_recalculate_every=TTG_recalculate_every,
+        ),
+    }
+
+    # create the D-Bus service in the GLib main loop, as soon as the first valid data was received
+    battery["state"].on_change = lambda: schedule_battery_service(battery)
+
+    logging.info('Discovered battery on topic "%s" with device instance %i' % (topic, device_instance))
+    return battery
 
 
 # MQTT requests
 def on_disconnect(client, userdata, flags, reason_code, properties):
     global connected
+    connected = 0
     logging.warning("MQTT client: Got disconnected")
     if reason_code != 0:
         logging.warning("MQTT client: Unexpected MQTT disconnection. Will auto-reconnect")
     else:
         logging.warning("MQTT client: reason_code value:" + str(reason_code))
 
-    while connected == 0:
-        try:
-            logging.warning(f"MQTT client: Trying to reconnect to broker {config['MQTT']['broker_address']} on port {config['MQTT']['broker_port']}")
-            client.connect(host=config["MQTT"]["broker_address"], port=int(config["MQTT"]["broker_port"]))
-            connected = 1
-        except Exception as err:
-            logging.error(f"MQTT client: Error in retrying to connect with broker ({config['MQTT']['broker_address']}:{config['MQTT']['broker_port']}): {err}")
-            logging.error("MQTT client: Retrying in 15 seconds")
-            connected = 0
-            sleep(15)
+    # the network thread of the client reconnects after the delay set with reconnect_delay_set(). The
+    # values are invalidated when the timeout is exceeded meanwhile
+    logging.warning(f"MQTT client: Trying to reconnect to broker {config['MQTT']['broker_address']} on port {config['MQTT']['broker_port']}")
+
+
+def on_connect_fail(client, userdata):
+    logging.error(f"MQTT client: Error in retrying to connect with broker ({config['MQTT']['broker_address']}:{config['MQTT']['broker_port']})")
+    logging.error("MQTT client: Retrying in up to %i seconds" % reconnect_max_delay)
 
 
 def on_connect(client, userdata, flags, reason_code, properties):
@@ -365,7 +364,7 @@ def on_connect(client, userdata, flags, reason_code, properties):
     if reason_code == 0:
         logging.info("MQTT client: Connected to MQTT broker!")
         connected = 1
-        client.subscribe(config["MQTT"]["topic"])
+        client.subscribe([(topic, 0) for topic in subscriptions])
     else:
         logging.error("MQTT client: Failed to connect, return code %d\n", reason_code)
 
@@ -373,159 +372,18 @@ def on_connect(client, userdata, flags, reason_code, properties):
 def on_message(client, userdata, msg):
     try:
 
-        global battery_dict, last_changed, TTG_enabled, TTG_soc, TTG_recalculate_every, TTG_update
+        # record the message, to replay it with benchmarks/replay_capture.py
+        if capture is not None:
+            capture.write(msg.timestamp, msg.topic, msg.payload)
 
         # get JSON from topic
-        if msg.topic == config["MQTT"]["topic"]:
-            if msg.payload != "" and msg.payload != b"":
-                jsonpayload = json.loads(msg.payload)
-
-                last_changed = int(time())
-
-                if "value" in jsonpayload:
-                    jsonpayload = json.loads(jsonpayload["value"])
-
-                if (
-                    "Dc" in jsonpayload
-                    and "Soc" in jsonpayload
-                    and (("Power" in jsonpayload["Dc"] and "Voltage" in jsonpayload["Dc"]) or ("0" in jsonpayload["Dc"] and "Power" in jsonpayload["Dc"]["0"] and "Voltage" in jsonpayload["Dc"]["0"]))
-                ):
-
-                    # save JSON data into battery_dict
-                    for key_1, data_1 in jsonpayload.items():
-
-                        if type(data_1) is dict:
-
-                            for key_2, data_2 in data_1.items():
-
-                                if key_1 == "Dc":
-
-                                    # logging.error(f"data_1: {data_1}")
-                                    # logging.error(f"data_2: {data_2}")
-
-                                    if "0" in data_1:
-
-                                        for key_3, data_3 in data_2.items():
-                                            key = "/" + key_1 + "/" + key_2 + "/" + key_3
-                                            if key in battery_dict and (type(data_3) is str or type(data_3) is int or type(data_3) is float or data_3 is None):
-                                                battery_dict[key]["value"] = data_3 if data_3 is not None else None  # use is not, because 0 is valid
-                                            elif key not in ignore_list:
-                                                logging.warning('#3 Received key "' + str(key) + '" with value "' + str(data_3) + '" is not valid')
-
-                                    else:
-                                        key = "/" + key_1 + "/0/" + key_2
-                                        if key in battery_dict and (type(data_2) is str or type(data_2) is int or type(data_2) is float or data_2 is None):
-                                            battery_dict[key]["value"] = data_2 if data_2 is not None else None  # use is not, because 0 is valid
-                                        elif key not in ignore_list:
-                                            logging.warning('#2 Received key "' + str(key) + '" with value "' + str(data_2) + '" is not valid')
-
-                                else:
-                                    key = "/" + key_1 + "/" + key_2
-                                    if key in battery_dict and (type(data_2) is str or type(data_2) is int or type(data_2) is float or data_2 is None):
-                                        battery_dict[key]["value"] = data_2 if data_2 is not None else None  # use is not, because 0 is valid
-                                    elif key not in ignore_list:
-                                        logging.warning('#2 Received key "' + str(key) + '" with value "' + str(data_2) + '" is not valid')
-
-                        else:
-
-                            key = "/" + key_1
-                            if key in battery_dict and (type(data_1) is str or type(data_1) is int or type(data_1) is float or data_1 is None):
-                                battery_dict[key]["value"] = data_1 if data_1 is not None else None  # use is not, because 0 is valid
-                            elif key not in ignore_list:
-                                logging.warning('#1 Received key "' + str(key) + '" with value "' + str(data_1) + '" is not valid')
-
-                    # ------ calculate possible values if missing -----
-                    # Current
-                    if "Current" not in jsonpayload["Dc"]:
-                        battery_dict["/Dc/0/Current"]["value"] = (
-                            round(
-                                (battery_dict["/Dc/0/Power"]["value"] / battery_dict["/Dc/0/Voltage"]["value"]),
-                                3,
-                            )
-                            if battery_dict["/Dc/0/Voltage"]["value"] != 0
-                            else 0
-                        )
-
-                    # ConsumedAmphours
-                    if "ConsumedAmphours" not in jsonpayload and battery_dict["/InstalledCapacity"]["value"] is not None and battery_dict["/Capacity"]["value"] is not None:
-                        battery_dict["/ConsumedAmphours"]["value"] = battery_dict["/InstalledCapacity"]["value"] - battery_dict["/Capacity"]["value"]
-
-                    # Capacity
-                    if "Capacity" not in jsonpayload and battery_dict["/InstalledCapacity"]["value"] is not None and battery_dict["/ConsumedAmphours"]["value"] is not None:
-                        battery_dict["/Capacity"]["value"] = battery_dict["/InstalledCapacity"]["value"] - battery_dict["/ConsumedAmphours"]["value"]
-
-                    # ConsumedAmphours & Capacity based on InstalledCapacity and SoC
-                    if "ConsumedAmphours" not in jsonpayload and "Capacity" not in jsonpayload and battery_dict["/InstalledCapacity"]["value"] is not None:
-                        battery_dict["/ConsumedAmphours"]["value"] = round(
-                            battery_dict["/InstalledCapacity"]["value"] * (100 - battery_dict["/Soc"]["value"]) / 100,
-                            2,
-                        )
-                        battery_dict["/Capacity"]["value"] = round(
-                            battery_dict["/InstalledCapacity"]["value"] * battery_dict["/Soc"]["value"] / 100,
-                            2,
-                        )
-
-                    # TimeToGo
-                    if (
-                        "TimeToGo" not in jsonpayload
-                        and TTG_enabled == 1
-                        and battery_dict["/Dc/0/Current"]["value"] is not None
-                        and battery_dict["/InstalledCapacity"]["value"] is not None
-                        and battery_dict["/Capacity"]["value"] is not None
-                        and int(time()) - TTG_update >= TTG_recalculate_every
-                    ):
-                        TTG_update = int(time())
-
-                        # charging -> calculate time until 100% SoC
-                        if battery_dict["/Dc/0/Current"]["value"] > 0:
-                            battery_dict["/TimeToGo"]["value"] = abs(
-                                round(
-                                    ((battery_dict["/InstalledCapacity"]["value"] - battery_dict["/Capacity"]["value"]) / battery_dict["/Dc/0/Current"]["value"] * 60 * 60),
-                                    0,
-                                )
-                            )
-
-                        # discharging -> calculate time until TTG_soc SoC
-                        elif battery_dict["/Dc/0/Current"]["value"] < 0:
-                            battery_dict["/TimeToGo"]["value"] = abs(
-                                round(
-                                    ((battery_dict["/Capacity"]["value"] - (battery_dict["/InstalledCapacity"]["value"] * TTG_soc / 100)) / battery_dict["/Dc/0/Current"]["value"] * 60 * 60 * -1),
-                                    0,
-                                )
-                            )
-
-                        # if current is 0 display 30 days
-                        else:
-                            battery_dict["/TimeToGo"]["value"] = 60 * 60 * 24 * 30
-
-                    # MinVoltageCellId, MinCellVoltage, MaxVoltageCellId, MaxCellVoltage, Sum, Diff
-                    if "Voltages" in jsonpayload and len(jsonpayload["Voltages"]) > 0:
-                        if "System" not in jsonpayload or "MinVoltageCellId" not in jsonpayload["System"]:
-                            battery_dict["/System/MinVoltageCellId"]["value"] = min(jsonpayload["Voltages"], key=jsonpayload["Voltages"].get)
-
-                        if "System" not in jsonpayload or "MinCellVoltage" not in jsonpayload["System"]:
-                            battery_dict["/System/MinCellVoltage"]["value"] = min(jsonpayload["Voltages"].values())
-
-                        if "System" not in jsonpayload or "MaxVoltageCellId" not in jsonpayload["System"]:
-                            battery_dict["/System/MaxVoltageCellId"]["value"] = max(jsonpayload["Voltages"], key=jsonpayload["Voltages"].get)
-
-                        if "System" not in jsonpayload or "MaxCellVoltage" not in jsonpayload["System"]:
-                            battery_dict["/System/MaxCellVoltage"]["value"] = max(jsonpayload["Voltages"].values())
-
-                        if "Sum" not in jsonpayload["Voltages"]:
-                            battery_dict["/Voltages/Sum"]["value"] = sum(jsonpayload["Voltages"].values())
-
-                        if "Diff" not in jsonpayload["Voltages"] and battery_dict["/System/MinCellVoltage"]["value"] is not None and battery_dict["/System/MaxCellVoltage"]["value"] is not None:
-                            battery_dict["/Voltages/Diff"]["value"] = battery_dict["/System/MaxCellVoltage"]["value"] - battery_dict["/System/MinCellVoltage"]["value"]
-
-                else:
-                    logging.warning("Received JSON doesn't contain minimum required values")
-                    logging.warning('Example: {"Dc":{"Power":321.6,"Voltage":52.7},"Soc":63}')
-                    logging.debug("MQTT payload: " + str(msg.payload)[1:])
-
-            else:
-                logging.warning("Received message was empty and therefore it was ignored")
-                logging.debug("MQTT payload: " + str(msg.payload)[1:])
+        battery = batteries.get(msg.topic, False)
+        if battery is False:
+            battery = batteries[msg.topic] = discover_battery(msg.topic)
+
+        if battery is not None:
+            if battery["state"].ingest_payload(msg.payload, msg.timestamp) and aggregate is not None:
+                aggregate.update(battery["state"], battery["device_name"])
 
     except TypeError as e:
         logging.error("Received message is not valid. Check the README and sample payload. %s" % e)
@@ -543,18 +401,44 @@ def on_message(client, userdata, msg):
         logging.debug("MQTT payload: " + str(msg.payload)[1:])
 
 
+# percentiles of the latency histograms published under /Debug/Latency
+latency_percentiles = {"P50": 50, "P95": 95, "P99": 99}
+
+
+def _milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
 class DbusMqttBatteryService:
     def __init__(
         self,
         servicename,
         deviceinstance,
-        paths,
+        state,
         productname="MQTT Battery",
         customname="MQTT Battery",
         connection="MQTT Battery service",
+        bus=None,
+        topic="",
+        snapshot=None,
+        perf_paths=False,
     ):
 
-        self._dbusservice = VeDbusService(servicename, register=False)
+        self._state = state
+        self._topic = topic
+
+        # False while the values are invalidated after a timeout
+        self._connected = True
+
+        # file where the values are saved, None to disable the snapshot
+        self._snapshot = snapshot
+        self._snapshot_generation = 0
+
+        # perf counters of the whole driver, published under /Debug/Perf by one service only
+        self._perf = perf if perf_paths else None
+
+        self._dbusservice = VeDbusService(servicename, bus=bus, register=False, signaltext=signal_text == 1)
+        self._registered = False
 
         logging.debug("%s /DeviceInstance = %d" % (servicename, deviceinstance))
 
@@ -575,38 +459,209 @@ class DbusMqttBatteryService:
         # self._dbusservice.add_path('/HardwareVersion', '')
         self._dbusservice.add_path("/Connected", 1)
 
-        self._dbusservice.add_path("/Latency", None)
-
-        for path, settings in paths.items():
-            self._dbusservice.add_path(
-                path,
-                settings["value"],
-                gettextcallback=settings["textformat"],
-                writeable=True,
-                onchangecallback=self._handlechangedvalue,
-            )
+        self._dbusservice.add_path("/Latency", None, gettextcallback=_ms)
+
+        # latency from receiving the MQTT message and from creating it by the producer until it is on D-Bus
+        if debug_latency:
+            self._latency = LatencyHistogram()
+            self._producer_latency = LatencyHistogram()
+            for prefix in ("/Debug/Latency", "/Debug/Latency/Producer"):
+                self._dbusservice.add_path(prefix + "/Count", 0, gettextcallback=_n)
+                for name in latency_percentiles:
+                    self._dbusservice.add_path(prefix + "/" + name, None, gettextcallback=_ms)
+                self._dbusservice.add_path(prefix + "/Max", None, gettextcallback=_ms)
+
+        # time of the stages of the whole driver
+        if self._perf is not None:
+            for name in stage_names:
+                self._dbusservice.add_path("/Debug/Perf/" + name + "/Count", 0, gettextcallback=_n)
+                for value in ("Total", "Mean", "Max"):
+                    self._dbusservice.add_path("/Debug/Perf/" + name + "/" + value, None, gettextcallback=_ms)
+
+        self._dbusservice.add_path("/UpdateIndex", 0, gettextcallback=_n)
+
+        # 1 while the values are restored from a snapshot and no new MQTT message was received
+        self._stale = state.stale
+        self._dbusservice.add_path("/Stale", int(state.stale), gettextcallback=_n, valuetype=int)
+
+        # values of the frames taken from state, see _take_frame()
+        self._values = list(state.schema.defaults)
+
+        # the paths of the cells are added and removed with the cells of the battery, see _update_cells().
+        # With lazy_export a path is added as soon as it gets a value, see _update_paths()
+        frame, changed = self._take_frame()
+        cells = frame.cells if frame is not None else state.front.cells
+        schema = state.schema
+        self._exported = set()
+        for slot, value in enumerate(self._values):
+            if (not schema.is_cell[slot] or slot in cells) and (not lazy_export or value is not None):
+                self._add_path(self._dbusservice, slot, value)
+        self._cells = cells
 
         # register VeDbusService after all paths where added
         self._dbusservice.register()
+        self._registered = True
 
-        GLib.timeout_add(1000, self._update)  # pause 1000ms before the next request
+        if publish_mode == "event":
+            # publish as soon as the MQTT thread reports new data
+            self._update_pending = False
+            self._last_publish = 0
+            state.on_change = self._schedule_update
 
-    def _update(self):
+            # publish the messages which arrived while the service was created
+            self._schedule_update()
 
-        global battery_dict, last_changed, last_updated
+            if timeout != 0:
+                GLib.timeout_add_seconds(timeout, self._check_timeout)
+        else:
+            GLib.timeout_add(1000, self._update)  # pause 1000ms before the next request
 
-        now = int(time())
+        if snapshot is not None:
+            GLib.timeout_add_seconds(snapshot_interval, self._save_snapshot)
 
-        if last_changed != last_updated:
+        if debug_latency or self._perf is not None:
+            GLib.timeout_add_seconds(debug_interval, self._update_debug)
 
-            for setting, data in battery_dict.items():
+    def _update(self):
+        self._publish()
+        return self._check_timeout(rearm=False)
+
+    def _schedule_update(self):
+        # called from the MQTT thread. GLib.idle_add and GLib.timeout_add are thread safe
+        if self._update_pending:
+            return
+        self._update_pending = True
+
+        # combine fast MQTT messages, so that D-Bus is updated at most every publish_min_interval
+        delay = self._last_publish + publish_min_interval - monotonic()
+        if delay > 0:
+            GLib.timeout_add(int(delay * 1000) + 1, self._publish_event)
+        else:
+            GLib.idle_add(self._publish_event)
+
+    def _publish_event(self):
+        # reset first, so that data arriving during the publish schedules a new run
+        self._update_pending = False
+        self._last_publish = monotonic()
+        self._publish()
+        return False
+
+    def _publish(self):
+        start = monotonic()
+        frame = self._batch(self._update_paths)
+
+        # the values are on D-Bus, after the batch sent its signal
+        now = monotonic()
+        if perf is not None:
+            perf.add(DBUS_UPDATE, now - start)
+
+        if debug_latency and frame is not None and frame.received is not None:
+            self._latency.add(now - frame.received)
+            if frame.produced is not None:
+                self._producer_latency.add(now - frame.produced)
+
+    def _batch(self, function):
+        if batch_signals:
+            # collect all changes and send them with one ItemsChanged signal
+            with self._dbusservice as dbusservice:
+                return function(dbusservice)
+        else:
+            return function(self._dbusservice)
+
+    def _add_path(self, dbusservice, slot, value):
+        schema = self._state.schema
+        self._exported.add(slot)
+        textformat = schema.textformats[slot]
+        if perf is not None and textformat is not None:
+            textformat = perf.timed(TEXT_FORMAT, textformat)
+
+        # the batch announces a path added after the registration with its ItemsChanged signal. Without
+        # it, the path is added invalid and then set, so its value is sent with PropertiesChanged
+        announce = self._registered and dbusservice is self._dbusservice and value is not None
+        dbusservice.add_path(
+            schema.paths[slot],
+            None if announce else value,
+            gettextcallback=textformat,
+            writeable=True,
+            onchangecallback=self._handlechangedvalue,
+        )
+        if announce:
+            dbusservice[schema.paths[slot]] = value
+
+    def _take_frame(self):
+        """Take the front frame of the state and apply its changes to the values. Return the frame and its
+        slot -> value changes, or None and None if there is no new frame."""
+        frame = self._state.take_frame()
+        if frame is None:
+            return None, None
+
+        values = self._values
+        defaults = self._state.schema.defaults
+        if len(values) < len(defaults):
+            values.extend(defaults[len(values) :])
+
+        changed = frame.changed()
+        for slot, value in changed.items():
+            values[slot] = value
+        return frame, changed
+
+    def _update_cells(self, dbusservice, frame):
+        paths = self._state.schema.paths
+
+        if not lazy_export:
+            for slot in frame.cells - self._cells:
+                self._add_path(dbusservice, slot, self._values[slot])
+
+        # invalidate the value first, so that the consumers get notified
+        for slot in self._cells - frame.cells:
+            if slot in self._exported:
+                self._exported.remove(slot)
+                dbusservice[paths[slot]] = None
+                del self._dbusservice[paths[slot]]
+
+        self._cells = frame.cells
+
+    def _update_paths(self, dbusservice):
+
+        state = self._state
+
+        # only push the paths which changed since the last update
+        frame, changed = self._take_frame()
+        if frame is not None:
+            values = self._values
+
+            if frame.cells is not self._cells:
+                self._update_cells(dbusservice, frame)
+
+            # after a timeout all values were invalidated, so push all of them again
+            dirty = changed
+            if not self._connected:
+                logging.warning("Received new data, the values are published again")
+                self._connected = True
+                dbusservice["/Connected"] = 1
+                dirty = range(len(values))
+
+            paths = state.schema.paths
+            slots = state.schema.slots
+            is_cell = state.schema.is_cell
+            exported = self._exported
+            for slot in dirty:
+                setting = paths[slot]
+                value = values[slot]
+
+                # add the path with its first value, except for removed cells
+                if slot not in exported:
+                    if value is not None and (not is_cell[slot] or slot in frame.cells):
+                        self._add_path(dbusservice, slot, value)
+                    continue
 
                 try:
-                    self._dbusservice[setting] = data["value"]
+                    dbusservice[setting] = value
 
                 except TypeError as e:
-                    logging.error('Received key "' + setting + '" with value "' + str(data["value"]) + '" is not valid: ' + str(e))
-                    sys.exit()
+                    logging.error('Received key "' + setting + '" with value "' + str(value) + '" is not valid: ' + str(e))
+                    if timeout_action == "exit":
+                        sys.exit()
 
                 except Exception:
                     exception_type, exception_object, exception_traceback = sys.exc_info()
@@ -614,20 +669,82 @@ class DbusMqttBatteryService:
                     line = exception_traceback.tb_lineno
                     logging.error(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
 
-            logging.info("Battery: {:.0f} W - {:.2f} V - {:.2f} %".format(battery_dict["/Dc/0/Power"]["value"], battery_dict["/Dc/0/Voltage"]["value"], battery_dict["/Soc"]["value"]))
+            logging.info("Battery: {:.0f} W - {:.2f} V - {:.2f} %".format(values[slots["/Dc/0/Power"]], values[slots["/Dc/0/Voltage"]], values[slots["/Soc"]]))
 
-            last_updated = last_changed
-
-        # quit driver if timeout is exceeded
-        if timeout != 0 and (now - last_changed) > timeout:
-            logging.error("Driver stopped. Timeout of %i seconds exceeded, since no new MQTT message was received in this time." % timeout)
-            sys.exit()
+        stale = state.stale
+        if stale != self._stale:
+            self._stale = stale
+            dbusservice["/Stale"] = int(stale)
 
         # increment UpdateIndex - to show that new data is available
-        index = self._dbusservice["/UpdateIndex"] + 1  # increment index
+        index = dbusservice["/UpdateIndex"] + 1  # increment index
         if index > 255:  # maximum value of the index
             index = 0  # overflow from 255 to 0
-        self._dbusservice["/UpdateIndex"] = index
+        dbusservice["/UpdateIndex"] = index
+
+        return frame
+
+    def _check_timeout(self, rearm=True):
+        idle = monotonic() - self._state.last_changed
+
+        if timeout != 0 and idle > timeout:
+            # quit driver if timeout is exceeded
+            if timeout_action == "exit":
+                logging.error("Driver stopped. Timeout of %i seconds exceeded, since no new MQTT message was received in this time." % timeout)
+                sys.exit()
+
+            # keep the MQTT connection and the D-Bus service, but show that there is no valid data
+            if self._connected:
+                logging.warning("Timeout of %i seconds exceeded, since no new MQTT message was received in this time. The values are invalidated until new data arrives." % timeout)
+                self._batch(self._invalidate_paths)
+
+            idle = 0
+
+        # in event mode there is no periodic update, so wake up again when the timeout would be exceeded
+        if rearm:
+            GLib.timeout_add_seconds(int(max(timeout - idle + 1, 1)), self._check_timeout)
+            return False
+
+        return True
+
+    def _update_debug(self):
+        self._batch(self._update_debug_paths)
+        return True
+
+    def _update_debug_paths(self, dbusservice):
+        if debug_latency:
+            dbusservice["/Latency"] = _milliseconds(self._latency.last)
+
+            for prefix, histogram in (("/Debug/Latency", self._latency), ("/Debug/Latency/Producer", self._producer_latency)):
+                dbusservice[prefix + "/Count"] = histogram.count
+                for name, percent in latency_percentiles.items():
+                    dbusservice[prefix + "/" + name] = _milliseconds(histogram.percentile(percent))
+                dbusservice[prefix + "/Max"] = _milliseconds(histogram.max)
+
+        if self._perf is not None:
+            for name, values in self._perf.stats().items():
+                for value, number in values.items():
+                    dbusservice["/Debug/Perf/" + name + "/" + value] = number
+
+    def _invalidate_paths(self, dbusservice):
+        # set first, so that a message arriving meanwhile publishes the values again
+        self._connected = False
+        self._state.invalidated = True
+        paths = self._state.schema.paths
+        for slot in self._exported:
+            dbusservice[paths[slot]] = None
+        dbusservice["/Connected"] = 0
+
+    def _save_snapshot(self):
+        state = self._state
+
+        # save only if a message was received since the last snapshot, so that the snapshot expires
+        # when the battery is offline. Restored values are not saved again for the same reason
+        generation = state.generation
+        if generation != self._snapshot_generation and not state.stale:
+            self._snapshot_generation = generation
+            save_snapshot(self._snapshot, self._topic, state.schema.paths, self._values)
+
         return True
 
     def _handlechangedvalue(self, path, value):
@@ -635,7 +752,82 @@ class DbusMqttBatteryService:
         return True  # accept the change
 
 
+# battery which publishes the perf counters under /Debug/Perf, see add_battery_service()
+perf_battery = None
+
+
+def get_bus():
+    return dbus.SessionBus(private=True) if "DBUS_SESSION_BUS_ADDRESS" in os.environ else dbus.SystemBus(private=True)
+
+
+def add_battery_service(battery):
+    global perf_battery
+
+    if "service" not in battery:
+        # the perf counters are the same for all batteries, so only the aggregate battery or, without
+        # it, the first battery publishes them
+        if perf is not None and perf_battery is None and (aggregate_config is None or battery is aggregate_config):
+            perf_battery = battery
+
+        battery["service"] = DbusMqttBatteryService(
+            servicename="com.victronenergy.battery.mqtt_battery_" + str(battery["device_instance"]),
+            deviceinstance=battery["device_instance"],
+            customname=battery["device_name"],
+            state=battery["state"],
+            connection="MQTT Battery service (" + battery["topic"] + ")",
+            bus=get_bus() if private_bus else None,
+            topic=battery["topic"],
+            snapshot=snapshot_file(snapshot_path, battery["topic"]) if snapshot_enabled and battery is not aggregate_config else None,
+            perf_paths=battery is perf_battery,
+        )
+    return False
+
+
+def schedule_battery_service(battery):
+    # called from the MQTT thread
+    if not battery.get("service_scheduled"):
+        battery["service_scheduled"] = True
+        GLib.idle_add(add_battery_service, battery)
+
+
+def restore_snapshots():
+    for topic, values, age in load_snapshots(snapshot_path, snapshot_max_age):
+        battery = batteries.get(topic, False)
+        if battery is False:
+            battery = batteries[topic] = discover_battery(topic)
+
+        if battery is not None:
+            logging.info('Restored values of topic "%s" from a snapshot of %i seconds ago' % (topic, age))
+            battery["state"].restore(values)
+
+
+def publish_stats(client):
+    client.publish(debug_stats_topic, json.dumps({"Perf": perf.stats()}))
+    return True
+
+
+def check_first_data(started):
+    waiting = monotonic() - started
+    if all("service" in battery for battery in battery_configs):
+        return False
+
+    # check if timeout was exceeded
+    if timeout_action == "exit" and timeout != 0 and waiting >= timeout:
+        logging.error("Driver stopped. Timeout of %i seconds exceeded, since no new MQTT message was received in this time." % timeout)
+        sys.exit()
+
+    logging.warning("Waiting since %i seconds for receiving first data..." % waiting)
+
+    # wake up again when the timeout would be exceeded
+    if timeout_action == "exit" and timeout != 0 and timeout - waiting < 60:
+        GLib.timeout_add_seconds(max(int(timeout - waiting), 1), check_first_data, started)
+        return False
+    return True
+
+
 def main():
+    global capture
+
     _thread.daemon = True  # allow the program to quit
 
     from dbus.mainloop.glib import (
@@ -645,12 +837,28 @@ def main():
     # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
     DBusGMainLoop(set_as_default=True)
 
+    # publish the last values of the batteries immediately, until the first MQTT message arrives
+    if snapshot_enabled:
+        restore_snapshots()
+
+    if debug_capture != "":
+        try:
+            capture = CaptureWriter(debug_capture, debug_capture_max_size)
+            logging.warning('Capturing the received MQTT messages to "%s"' % debug_capture)
+        except OSError as e:
+            logging.error('Could not open capture "%s": %s' % (debug_capture, e))
+
     # MQTT setup
-    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id="MqttBattery_" + get_vrm_portal_id() + "_" + str(config["DEFAULT"]["device_instance"]))
+    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id="MqttBattery_" + get_vrm_portal_id() + "_" + str((battery_configs + discovery_configs)[0]["device_instance"]))
     client.on_disconnect = on_disconnect
     client.on_connect = on_connect
+    client.on_connect_fail = on_connect_fail
+    client.reconnect_delay_set(min_delay=1, max_delay=reconnect_max_delay)
     client.on_message = on_message
 
+    if perf is not None:
+        perf.instrument_client(client)
+
     # check tls and use settings, if provided
     if "tls_enabled" in config["MQTT"] and config["MQTT"]["tls_enabled"] == "1":
         logging.info("MQTT client: TLS is enabled")
@@ -675,33 +883,12 @@ def main():
     client.connect(host=config["MQTT"]["broker_address"], port=int(config["MQTT"]["broker_port"]))
     client.loop_start()
 
-    # wait to receive first data, else the JSON is empty and phase setup won't work
-    i = 0
-    while battery_dict["/Dc/0/Power"]["value"] is None:
-        if i % 12 != 0 or i == 0:
-            logging.info("Waiting 5 seconds for receiving first data...")
-        else:
-            logging.warning("Waiting since %s seconds for receiving first data..." % str(i * 5))
-
-        # check if timeout was exceeded
-        if timeout != 0 and timeout <= (i * 5):
-            logging.error("Driver stopped. Timeout of %i seconds exceeded, since no new MQTT message was received in this time." % timeout)
-            sys.exit()
-
-        sleep(5)
-        i += 1
-
-    paths_dbus = {
-        "/UpdateIndex": {"value": 0, "textformat": _n},
-    }
-    paths_dbus.update(battery_dict)
+    if perf is not None and debug_stats_topic != "":
+        GLib.timeout_add_seconds(debug_interval, publish_stats, client)
 
-    DbusMqttBatteryService(
-        servicename="com.victronenergy.battery.mqtt_battery_" + str(config["DEFAULT"]["device_instance"]),
-        deviceinstance=int(config["DEFAULT"]["device_instance"]),
-        customname=config["DEFAULT"]["device_name"],
-        paths=paths_dbus,
-    )
+    # the D-Bus service of a battery is created as soon as its first valid data was received
+    logging.info("Waiting for receiving first data...")
+    GLib.timeout_add_seconds(min(timeout, 60) if timeout != 0 else 60, check_first_data, monotonic())
 
     logging.info("Connected to dbus and switching over to GLib.MainLoop() (= event based)")
     mainloop = GLib.MainLoop()
@@ -63,13 +63,8 @@ if TYPE_CHECKING:
 
     class _InPacket(TypedDict):
         command: int
-        have_remaining: int
-        remaining_count: list[int]
-        remaining_mult: int
         remaining_length: int
         packet: bytearray
-        to_process: int
-        pos: int
 
 
     class _OutPacket(TypedDict):
@@ -112,6 +107,11 @@ try:
 except AttributeError:
     time_func = time.time
 
+# Size of the read-ahead buffer of _packet_read() and the free space at its
+# end, below which an incomplete packet is moved to the start of the buffer.
+_IN_BUFFER_SIZE = 65536
+_IN_BUFFER_MIN_FREE = 4096
+
 try:
     import dns.resolver
 
@@ -801,14 +801,13 @@ class Client:
         self._password: bytes | None = None
         self._in_packet: _InPacket = {
             "command": 0,
-            "have_remaining": 0,
-            "remaining_count": [],
-            "remaining_mult": 1,
             "remaining_length": 0,
             "packet": bytearray(b""),
-            "to_process": 0,
-            "pos": 0,
         }
+        self._in_buffer = bytearray(_IN_BUFFER_SIZE)
+        self._in_view = memoryview(self._in_buffer)
+        self._in_start = 0
+        self._in_end = 0
         self._out_packet: collections.deque[_OutPacket] = collections.deque()
         self._last_msg_in = time_func()
         self._last_msg_out = time_func()
@@ -1105,6 +1104,27 @@ class Client:
                 MQTT_LOG_DEBUG, "socket was None: %s", err)
             raise ConnectionError() from err
 
+    def _sock_recv_into(self, buffer: memoryview) -> int:
+        if self._sock is None:
+            raise ConnectionError("self._sock is None")
+        recv_into = getattr(self._sock, "recv_into", None)
+        if recv_into is None:
+            # _WebsocketWrapper has no recv_into()
+            data = self._sock_recv(len(buffer))
+            buffer[:len(data)] = data
+            return len(data)
+        try:
+            return recv_into(buffer)
+        except ssl.SSLWantReadError as err:
+            raise BlockingIOError() from err
+        except ssl.SSLWantWriteError as err:
+            self._call_socket_register_write()
+            raise BlockingIOError() from err
+        except AttributeError as err:
+            self._easy_log(
+                MQTT_LOG_DEBUG, "socket was None: %s", err)
+            raise ConnectionError() from err
+
     def _sock_send(self, buf: bytes) -> int:
         if self._sock is None:
             raise ConnectionError("self._sock is None")
@@ -1551,16 +1571,8 @@ class Client:
         if self._port <= 0:
             raise ValueError('Invalid port number.')
 
-        self._in_packet = {
-            "command": 0,
-            "have_remaining": 0,
-            "remaining_count": [],
-            "remaining_mult": 1,
-            "remaining_length": 0,
-            "packet": bytearray(b""),
-            "to_process": 0,
-            "pos": 0,
-        }
+        self._in_packet_reset()
+        self._in_buffer_reset()
 
         self._ping_t = 0.0
         self._state = _ConnectionState.MQTT_CS_CONNECTING
@@ -3053,110 +3065,129 @@ class Client:
 
     def _packet_read(self) -> MQTTErrorCode:
         # This gets called if pselect() indicates that there is network data
-        # available - ie. at least one byte.  What we do depends on what data we
-        # already have.
-        # If we've not got a command, attempt to read one and save it. This should
-        # always work because it's only a single byte.
-        # Then try to read the remaining length. This may fail because it is may
-        # be more than one byte - will need to save data pending next read if it
-        # does fail.
-        # Then try to read the remaining payload, where 'payload' here means the
-        # combined variable header and actual payload. This is the most likely to
-        # fail due to longer length, so save current data and current position.
-        # After all data is read, send to _mqtt_handle_packet() to deal with.
-        # Finally, free the memory and reset everything to starting conditions.
-        if self._in_packet['command'] == 0:
-            try:
-                command = self._sock_recv(1)
-            except BlockingIOError:
-                return MQTTErrorCode.MQTT_ERR_AGAIN
-            except TimeoutError as err:
-                self._easy_log(
-                    MQTT_LOG_ERR, 'timeout on socket: %s', err)
-                return MQTTErrorCode.MQTT_ERR_CONN_LOST
-            except OSError as err:
-                self._easy_log(
-                    MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
-                return MQTTErrorCode.MQTT_ERR_CONN_LOST
-            else:
-                if len(command) == 0:
-                    return MQTTErrorCode.MQTT_ERR_CONN_LOST
-                self._in_packet['command'] = command[0]
-
-        if self._in_packet['have_remaining'] == 0:
-            # Read remaining
-            # Algorithm for decoding taken from pseudo code at
-            # http://publib.boulder.ibm.com/infocenter/wmbhelp/v6r0m0/topic/com.ibm.etools.mft.doc/ac10870_.htm
-            while True:
-                try:
-                    byte = self._sock_recv(1)
-                except BlockingIOError:
-                    return MQTTErrorCode.MQTT_ERR_AGAIN
-                except OSError as err:
-                    self._easy_log(
-                        MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
-                    return MQTTErrorCode.MQTT_ERR_CONN_LOST
-                else:
-                    if len(byte) == 0:
-                        return MQTTErrorCode.MQTT_ERR_CONN_LOST
-                    byte_value = byte[0]
-                    self._in_packet['remaining_count'].append(byte_value)
-                    # Max 4 bytes length for remaining length as defined by protocol.
-                    # Anything more likely means a broken/malicious client.
-                    if len(self._in_packet['remaining_count']) > 4:
-                        return MQTTErrorCode.MQTT_ERR_PROTOCOL
-
-                    self._in_packet['remaining_length'] += (
-                        byte_value & 127) * self._in_packet['remaining_mult']
-                    self._in_packet['remaining_mult'] = self._in_packet['remaining_mult'] * 128
+        # available - ie. at least one byte.
+        # Read everything that is available with a single recv_into() into the
+        # read-ahead buffer, then handle all complete packets in the buffer.
+        # Before, the command byte and every remaining length byte were read
+        # with their own recv() call, which are at least three system calls
+        # (and TLS record reads) per packet.
+        # An incomplete packet stays in the buffer until the next call. The
+        # buffer grows, if a packet is larger than the buffer, and shrinks
+        # back to _IN_BUFFER_SIZE when the large packet was handled.
+        buffer = self._in_buffer
+        if self._in_start == self._in_end:
+            self._in_start = self._in_end = 0
+        elif len(buffer) - self._in_end < _IN_BUFFER_MIN_FREE:
+            # move the incomplete packet to the start of the buffer
+            length = self._in_end - self._in_start
+            buffer[:length] = buffer[self._in_start:self._in_end]
+            self._in_start = 0
+            self._in_end = length
 
+        try:
+            count = self._sock_recv_into(self._in_view[self._in_end:])
+        except BlockingIOError:
+            return MQTTErrorCode.MQTT_ERR_AGAIN
+        except TimeoutError as err:
+            self._easy_log(
+                MQTT_LOG_ERR, 'timeout on socket: %s', err)
+            return MQTTErrorCode.MQTT_ERR_CONN_LOST
+        except OSError as err:
+            self._easy_log(
+                MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
+            return MQTTErrorCode.MQTT_ERR_CONN_LOST
+        if count == 0:
+            return MQTTErrorCode.MQTT_ERR_CONN_LOST
+        self._in_end += count
+
+        rc = MQTTErrorCode.MQTT_ERR_SUCCESS
+        while self._sock is not None:
+            start = self._in_start
+            end = self._in_end
+
+            # Read remaining length, at most 4 bytes as defined by protocol.
+            # Anything more likely means a broken/malicious client.
+            pos = start + 1
+            remaining_length = 0
+            remaining_mult = 1
+            while True:
+                if pos >= end:
+                    # the buffer is empty or contains only the start of the
+                    # next fixed header, shrink it after a large packet
+                    if len(buffer) > _IN_BUFFER_SIZE:
+                        self._in_buffer_reserve(0)
+                    return rc
+                byte_value = buffer[pos]
+                pos += 1
+                remaining_length += (byte_value & 127) * remaining_mult
+                remaining_mult *= 128
                 if (byte_value & 128) == 0:
                     break
+                if pos - start > 4:
+                    return MQTTErrorCode.MQTT_ERR_PROTOCOL
+
+            if end - pos < remaining_length:
+                # wait for the rest of the packet, make room for it if needed
+                # or shrink the buffer after a large packet
+                size = pos - start + remaining_length
+                if size > len(buffer) - start or (len(buffer) > _IN_BUFFER_SIZE and size <= _IN_BUFFER_SIZE):
+                    self._in_buffer_reserve(size)
+                return rc
 
-            self._in_packet['have_remaining'] = 1
-            self._in_packet['to_process'] = self._in_packet['remaining_length']
+            # All data for this packet is read. The packet handlers only use
+            # command, remaining_length and packet, so only these are set in
+            # the dict, which is reused for every packet.
+            self._in_start = pos + remaining_length
+            in_packet = self._in_packet
+            in_packet["command"] = buffer[start]
+            in_packet["remaining_length"] = remaining_length
+            in_packet["packet"] = buffer[pos:self._in_start]
+            rc = self._packet_handle()
 
-        count = 100 # Don't get stuck in this loop if we have a huge message.
-        while self._in_packet['to_process'] > 0:
-            try:
-                data = self._sock_recv(self._in_packet['to_process'])
-            except BlockingIOError:
-                return MQTTErrorCode.MQTT_ERR_AGAIN
-            except OSError as err:
-                self._easy_log(
-                    MQTT_LOG_ERR, 'failed to receive on socket: %s', err)
-                return MQTTErrorCode.MQTT_ERR_CONN_LOST
-            else:
-                if len(data) == 0:
-                    return MQTTErrorCode.MQTT_ERR_CONN_LOST
-                self._in_packet['to_process'] -= len(data)
-                self._in_packet['packet'] += data
-            count -= 1
-            if count == 0:
-                with self._msgtime_mutex:
-                    self._last_msg_in = time_func()
-                return MQTTErrorCode.MQTT_ERR_AGAIN
+            # Free data and reset values
+            self._in_packet_reset()
 
-        # All data for this packet is read.
-        self._in_packet['pos'] = 0
-        rc = self._packet_handle()
+            with self._msgtime_mutex:
+                self._last_msg_in = time_func()
 
-        # Free data and reset values
-        self._in_packet = {
-            "command": 0,
-            "have_remaining": 0,
-            "remaining_count": [],
-            "remaining_mult": 1,
-            "remaining_length": 0,
-            "packet": bytearray(b""),
-            "to_process": 0,
-            "pos": 0,
-        }
+            if rc:
+                return rc
+
+            # the buffer was replaced by reconnect() in a callback
+            if buffer is not self._in_buffer:
+                return rc
 
-        with self._msgtime_mutex:
-            self._last_msg_in = time_func()
         return rc
 
+    def _in_packet_reset(self) -> None:
+        # Reset the values of the incoming packet in place.
+        in_packet = self._in_packet
+        in_packet["command"] = 0
+        in_packet["remaining_length"] = 0
+        in_packet["packet"] = bytearray(b"")
+
+    def _in_buffer_reserve(self, size: int) -> None:
+        # Replace the read-ahead buffer with one of at least size bytes, but
+        # not less than _IN_BUFFER_SIZE, which starts with the incomplete
+        # packet. A bytearray with an exported memoryview can not be resized.
+        length = self._in_end - self._in_start
+        buffer = bytearray(max(size, _IN_BUFFER_SIZE))
+        buffer[:length] = self._in_buffer[self._in_start:self._in_end]
+        self._in_view.release()
+        self._in_buffer = buffer
+        self._in_view = memoryview(buffer)
+        self._in_start = 0
+        self._in_end = length
+
+    def _in_buffer_reset(self) -> None:
+        # Drop the data of the previous connection. A new buffer is used, so
+        # that _packet_read() notices a reconnect() from a callback.
+        self._in_view.release()
+        self._in_buffer = bytearray(_IN_BUFFER_SIZE)
+        self._in_view = memoryview(self._in_buffer)
+        self._in_start = 0
+        self._in_end = 0
+
     def _packet_write(self) -> MQTTErrorCode:
         while True:
             try:
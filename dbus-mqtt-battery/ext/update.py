@@ -1,7 +1,15 @@
 # This script is used to update single files from different submodules
+#
+# The modules are replaced completely. Local changes to a module are kept as patches/<name>.patch and
+# applied again after the update, see the "patch" key of the modules. If a patch does not apply to the
+# new version anymore, the script stops and the changes have to be ported by hand. After changing a
+# patched module, recreate its patch from the unchanged files of the module, e.g. for velib_python:
+#   git diff --relative=dbus-mqtt-battery/ext/velib_python <commit with the unchanged module> -- dbus-mqtt-battery/ext/velib_python > dbus-mqtt-battery/ext/patches/velib_python.patch
+# Run it from the root of the repository.
 
 import os
 import requests
+import subprocess
 import tarfile
 import shutil
 
@@ -15,13 +23,15 @@ modules = [
     # name: module name
     # user/repository: GitHub user/repository
     # extract: extract only this folder from the tarball
-    {"name": "paho", "user/repository": "eclipse-paho/paho.mqtt.python", "extract": "/src/paho"},
-    {"name": "velib_python", "user/repository": "victronenergy/velib_python", "extract": ""},
+    # patch: optional patch in the patches directory, which is applied to the module after the update
+    {"name": "paho", "user/repository": "eclipse-paho/paho.mqtt.python", "extract": "/src/paho", "patch": "paho.patch"},
+    {"name": "velib_python", "user/repository": "victronenergy/velib_python", "extract": "", "patch": "velib_python.patch"},
     {"name": "venus-os_overlay-fs", "user/repository": "mr-manuel/venus-os_overlay-fs", "extract": ""},
 ]
 
 root_dir = "./dbus-mqtt-battery/ext"
 temp_dir = f"{root_dir}/.temp"
+patch_dir = f"{root_dir}/patches"
 
 
 def update_file(dir, url):
@@ -48,7 +58,16 @@ def update_file(dir, url):
     print(f'File "{filename}" downloaded and saved in "{dir}".')
 
 
-def update_module(name, repo_url, extract):
+def apply_patch(name, patch):
+    print(f"|- Apply patch: {patch}...")
+
+    # git apply also works outside of a git repository. The paths in the patch are relative to the module
+    result = subprocess.run(["git", "apply", "--verbose", f"--directory={os.path.normpath(root_dir)}/{name}", os.path.join(patch_dir, patch)])
+    if result.returncode != 0:
+        raise Exception(f'ERROR: Patch "{patch}" does not apply to the new version of "{name}". Port the changes by hand and recreate the patch.')
+
+
+def update_module(name, repo_url, extract, patch=None):
     print(f"Updating module: {name}...")
 
     # Fetch the latest release information from the GitHub API
@@ -141,6 +160,9 @@ def update_module(name, repo_url, extract):
             shutil.move(s, d)
 
         print(f'|- Tarball "{tag_name}.tar.gz" from "{tarball_url}" downloaded and saved in "{directory_name}".')
+
+    if patch is not None:
+        apply_patch(name, patch)
     print()
 
 
@@ -158,7 +180,7 @@ if __name__ == "__main__":
     print()
 
     for entry in modules:
-        update_module(entry["name"], entry["user/repository"], entry["extract"])
+        update_module(entry["name"], entry["user/repository"], entry["extract"], entry.get("patch"))
 
     # remove the temporary directory
     print("Remove temporary directory")
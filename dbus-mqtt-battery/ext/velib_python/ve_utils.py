@@ -200,66 +200,161 @@ def read_file(path):
 	return content
 
 
-def wrap_dbus_value(value):
-	if value is None:
-		return VEDBUS_INVALID
+def _wrap_invalid(value):
+	return VEDBUS_INVALID
+
+def _wrap_float(value):
+	return dbus.Double(value, variant_level=1)
+
+def _wrap_bool(value):
+	return dbus.Boolean(value, variant_level=1)
+
+def _wrap_int(value):
+	if -0x80000000 <= value <= 0x7fffffff:
+		return dbus.Int32(value, variant_level=1)
+	return dbus.Int64(value, variant_level=1)
+
+def _wrap_str(value):
+	return dbus.String(value, variant_level=1)
+
+def _wrap_list(value):
+	if len(value) == 0:
+		# If the list is empty we cannot infer the type of the contents. So assume unsigned integer.
+		# A (signed) integer is dangerous, because an empty list of signed integers is used to encode
+		# an invalid value.
+		return dbus.Array([], signature=dbus.Signature('u'), variant_level=1)
+	return dbus.Array([wrap_dbus_value(x) for x in value], variant_level=1)
+
+def _wrap_dict(value):
+	# Wrapping the keys of the dictionary causes D-Bus errors like:
+	# 'arguments to dbus_message_iter_open_container() were incorrect,
+	# assertion "(type == DBUS_TYPE_ARRAY && contained_signature &&
+	# *contained_signature == DBUS_DICT_ENTRY_BEGIN_CHAR) || (contained_signature == NULL ||
+	# _dbus_check_is_valid_signature (contained_signature))" failed in file ...'
+	return dbus.Dictionary({(k, wrap_dbus_value(v)) for k, v in value.items()}, variant_level=1)
+
+# Wrapper by exact type. Subclasses, like the dbus types themselves, are handled by the
+# isinstance checks in _wrap_dbus_value_subclass.
+_wrappers = {
+	type(None): _wrap_invalid,
+	float: _wrap_float,
+	bool: _wrap_bool,
+	int: _wrap_int,
+	str: _wrap_str,
+	list: _wrap_list,
+	dict: _wrap_dict,
+}
+
+def _wrap_dbus_value_subclass(value):
 	if isinstance(value, float):
-		return dbus.Double(value, variant_level=1)
+		return _wrap_float(value)
 	if isinstance(value, bool):
-		return dbus.Boolean(value, variant_level=1)
+		return _wrap_bool(value)
 	if isinstance(value, int):
-		try:
-			return dbus.Int32(value, variant_level=1)
-		except OverflowError:
-			return dbus.Int64(value, variant_level=1)
+		return _wrap_int(value)
 	if isinstance(value, str):
-		return dbus.String(value, variant_level=1)
+		return _wrap_str(value)
 	if isinstance(value, list):
-		if len(value) == 0:
-			# If the list is empty we cannot infer the type of the contents. So assume unsigned integer.
-			# A (signed) integer is dangerous, because an empty list of signed integers is used to encode
-			# an invalid value.
-			return dbus.Array([], signature=dbus.Signature('u'), variant_level=1)
-		return dbus.Array([wrap_dbus_value(x) for x in value], variant_level=1)
+		return _wrap_list(value)
 	if isinstance(value, dict):
-		# Wrapping the keys of the dictionary causes D-Bus errors like:
-		# 'arguments to dbus_message_iter_open_container() were incorrect,
-		# assertion "(type == DBUS_TYPE_ARRAY && contained_signature &&
-		# *contained_signature == DBUS_DICT_ENTRY_BEGIN_CHAR) || (contained_signature == NULL ||
-		# _dbus_check_is_valid_signature (contained_signature))" failed in file ...'
-		return dbus.Dictionary({(k, wrap_dbus_value(v)) for k, v in value.items()}, variant_level=1)
+		return _wrap_dict(value)
 	return value
 
 
+def wrap_dbus_value(value):
+	if value is None:
+		return VEDBUS_INVALID
+	wrapper = _wrappers.get(value.__class__)
+	if wrapper is not None:
+		return wrapper(value)
+	return _wrap_dbus_value_subclass(value)
+
+
 dbus_int_types = (dbus.Int32, dbus.UInt32, dbus.Byte, dbus.Int16, dbus.UInt16, dbus.UInt32, dbus.Int64, dbus.UInt64)
 
 
-def unwrap_dbus_value(val):
-	"""Converts D-Bus values back to the original type. For example if val is of type DBus.Double,
-	a float will be returned."""
+def _unwrap_int(val):
+	return int(val)
+
+def _unwrap_float(val):
+	return float(val)
+
+def _unwrap_str(val):
+	return str(val)
+
+def _unwrap_bool(val):
+	return bool(val)
+
+def _unwrap_array(val):
+	v = [unwrap_dbus_value(x) for x in val]
+	return None if len(v) == 0 else v
+
+def _unwrap_byte_array(val):
+	return "".join([bytes(x) for x in val])
+
+def _unwrap_list(val):
+	return [unwrap_dbus_value(x) for x in val]
+
+def _unwrap_dict(val):
+	# Do not unwrap the keys, see comment in wrap_dbus_value
+	return dict([(x, unwrap_dbus_value(y)) for x, y in val.items()])
+
+def _unwrap_none(val):
+	return val
+
+# Unwrapper by exact type, other types are handled by the isinstance checks in
+# _unwrap_dbus_value_subclass.
+_unwrappers = dict.fromkeys(dbus_int_types, _unwrap_int)
+_unwrappers.update({
+	dbus.Double: _unwrap_float,
+	dbus.Array: _unwrap_array,
+	dbus.Signature: _unwrap_str,
+	dbus.String: _unwrap_str,
+	dbus.ByteArray: _unwrap_byte_array,
+	list: _unwrap_list,
+	tuple: _unwrap_list,
+	dbus.Dictionary: _unwrap_dict,
+	dict: _unwrap_dict,
+	dbus.Boolean: _unwrap_bool,
+	# plain Python values are returned as they are
+	type(None): _unwrap_none,
+	int: _unwrap_none,
+	float: _unwrap_none,
+	str: _unwrap_none,
+	bool: _unwrap_none,
+})
+
+def _unwrap_dbus_value_subclass(val):
 	if isinstance(val, dbus_int_types):
 		return int(val)
 	if isinstance(val, dbus.Double):
 		return float(val)
 	if isinstance(val, dbus.Array):
-		v = [unwrap_dbus_value(x) for x in val]
-		return None if len(v) == 0 else v
+		return _unwrap_array(val)
 	if isinstance(val, (dbus.Signature, dbus.String)):
 		return str(val)
 	# Python has no byte type, so we convert to an integer.
 	if isinstance(val, dbus.Byte):
 		return int(val)
 	if isinstance(val, dbus.ByteArray):
-		return "".join([bytes(x) for x in val])
+		return _unwrap_byte_array(val)
 	if isinstance(val, (list, tuple)):
-		return [unwrap_dbus_value(x) for x in val]
+		return _unwrap_list(val)
 	if isinstance(val, (dbus.Dictionary, dict)):
-		# Do not unwrap the keys, see comment in wrap_dbus_value
-		return dict([(x, unwrap_dbus_value(y)) for x, y in val.items()])
+		return _unwrap_dict(val)
 	if isinstance(val, dbus.Boolean):
 		return bool(val)
 	return val
 
+
+def unwrap_dbus_value(val):
+	"""Converts D-Bus values back to the original type. For example if val is of type DBus.Double,
+	a float will be returned."""
+	unwrapper = _unwrappers.get(val.__class__)
+	if unwrapper is not None:
+		return unwrapper(val)
+	return _unwrap_dbus_value_subclass(val)
+
 # When supported, only name owner changes for the the given namespace are reported. This
 # prevents spending cpu time at irrelevant changes, like scripts accessing the bus temporarily.
 def add_name_owner_changed_receiver(dbus, name_owner_changed, namespace="com.victronenergy"):
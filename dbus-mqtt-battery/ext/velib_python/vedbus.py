@@ -5,6 +5,7 @@ import dbus.service
 import logging
 import os
 import weakref
+from bisect import bisect_left, insort
 from collections import defaultdict
 from ve_utils import wrap_dbus_value, unwrap_dbus_value
 
@@ -59,10 +60,19 @@ notset = object()
 
 # Export ourselves as a D-Bus service.
 class VeDbusService(object):
-	def __init__(self, servicename, bus=None, register=None):
+	# @param signaltext	Send the text of the values in the PropertiesChanged and ItemsChanged signals.
+	#					Without it, the text is only formatted when someone calls GetText or GetItems.
+	def __init__(self, servicename, bus=None, register=None, signaltext=True):
 		# dict containing the VeDbusItemExport objects, with their path as the key.
 		self._dbusobjects = {}
+		# sorted paths of _dbusobjects, the paths of a subtree are next to each other
+		self._dbuspaths = []
+		# incremented on every added, removed or changed path, see VeDbusRootExport.GetItems
+		self._generation = 0
+		self._signaltext = signaltext
 		self._dbusnodes = {}
+		# number of object paths below each tree node, the node is removed with its last path
+		self._dbusnodecounts = defaultdict(int)
 		self._ratelimiters = []
 		self._dbusname = None
 		self.name = servicename
@@ -122,12 +132,20 @@ class VeDbusService(object):
 		itemtype = itemtype or VeDbusItemExport
 		item = itemtype(self._dbusconn, path, value, description, writeable,
 				self._value_changed, gettextcallback, deletecallback=self._item_deleted, valuetype=valuetype)
+		item._signaltext = self._signaltext
+		item._service = self
+		self._generation += 1
 
+		isnew = path not in self._dbusobjects
 		spl = path.split('/')
 		for i in range(2, len(spl)):
 			subPath = '/'.join(spl[:i])
 			if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
 				self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
+			if isnew:
+				self._dbusnodecounts[subPath] += 1
+		if isnew:
+			insort(self._dbuspaths, path)
 		self._dbusobjects[path] = item
 		logging.debug('added %s with start value %s. Writeable is %s' % (path, value, writeable))
 		return item
@@ -156,13 +174,18 @@ class VeDbusService(object):
 		return self._onchangecallbacks[path](path, newvalue)
 
 	def _item_deleted(self, path):
+		self._generation += 1
 		self._dbusobjects.pop(path)
-		for np in list(self._dbusnodes.keys()):
-			if np != '/':
-				for ip in self._dbusobjects:
-					if ip.startswith(np + '/'):
-						break
-				else:
+		del self._dbuspaths[bisect_left(self._dbuspaths, path)]
+
+		# only the parents of the path can become empty
+		spl = path.split('/')
+		for i in range(2, len(spl)):
+			np = '/'.join(spl[:i])
+			self._dbusnodecounts[np] -= 1
+			if self._dbusnodecounts[np] == 0:
+				del self._dbusnodecounts[np]
+				if np in self._dbusnodes:
 					self._dbusnodes[np].__del__()
 					self._dbusnodes.pop(np)
 
@@ -179,6 +202,14 @@ class VeDbusService(object):
 	def __contains__(self, path):
 		return path in self._dbusobjects
 
+	# Returns the paths below the prefix, which has to end with a '/'
+	def _subtree(self, prefix):
+		paths = self._dbuspaths
+		i = bisect_left(paths, prefix)
+		while i < len(paths) and paths[i].startswith(prefix):
+			yield paths[i]
+			i += 1
+
 	def __enter__(self):
 		l = ServiceContext(self)
 		self._ratelimiters.append(l)
@@ -217,11 +248,14 @@ class ServiceContext(object):
 			self.changes.clear()
 
 	def add_path(self, path, value, *args, **kwargs):
-		self.parent.add_path(path, value, *args, **kwargs)
-		self.changes[path] = {
-			'Value': wrap_dbus_value(value),
-			'Text': self.parent._dbusobjects[path].GetText()
-		}
+		item = self.parent.add_path(path, value, *args, **kwargs)
+		if self.parent._signaltext:
+			self.changes[path] = {
+				'Value': wrap_dbus_value(value),
+				'Text': item.GetText()
+			}
+		else:
+			self.changes[path] = {'Value': wrap_dbus_value(value)}
 
 	def del_tree(self, root):
 		root = root.rstrip('/')
@@ -456,11 +490,11 @@ class VeDbusTreeExport(dbus.service.Object):
 		px = path
 		if not px.endswith('/'):
 			px += '/'
-		for p, item in self._service._dbusobjects.items():
-			if p.startswith(px):
-				v = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
-				r[p[len(px):]] = v
-		logging.debug(r)
+		objects = self._service._dbusobjects
+		for p in self._service._subtree(px):
+			item = objects[p]
+			v = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
+			r[p[len(px):]] = v
 		return r
 
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='v')
@@ -476,21 +510,38 @@ class VeDbusTreeExport(dbus.service.Object):
 		return self._get_value_handler(self.path)
 
 class VeDbusRootExport(VeDbusTreeExport):
+	def __init__(self, bus, objectPath, service):
+		VeDbusTreeExport.__init__(self, bus, objectPath, service)
+
+		# reply of GetItems and the generation of the service it was created for
+		self._items = None
+		self._itemsgeneration = None
+
 	@dbus.service.signal('com.victronenergy.BusItem', signature='a{sa{sv}}')
 	def ItemsChanged(self, changes):
 		pass
 
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='a{sa{sv}}')
 	def GetItems(self):
-		return {
-			path: {
-				'Value': wrap_dbus_value(item.local_get_value()),
-				'Text': item.GetText() }
-			for path, item in self._service._dbusobjects.items()
-		}
+		# repeated calls without any change in between get the same reply
+		if self._itemsgeneration != self._service._generation:
+			self._items = {
+				path: {
+					'Value': wrap_dbus_value(item.local_get_value()),
+					'Text': item.GetText() }
+				for path, item in self._service._dbusobjects.items()
+			}
+			self._itemsgeneration = self._service._generation
+		return self._items
 
 
 class VeDbusItemExport(dbus.service.Object):
+	# send the text of the value in the PropertiesChanged signal, see VeDbusService
+	_signaltext = True
+
+	# the VeDbusService this item was added to, its generation is incremented on every change
+	_service = None
+
 	## Constructor of VeDbusItemExport
 	#
 	# Use this object to export (publish), values on the dbus
@@ -516,6 +567,9 @@ class VeDbusItemExport(dbus.service.Object):
 		self._deletecallback = deletecallback
 		self._type = valuetype
 
+		# text of the current value, formatted on first use by GetText
+		self._text = None
+
 	# To force immediate deregistering of this dbus object, explicitly call __del__().
 	def __del__(self):
 		if self._path is None: return
@@ -539,6 +593,13 @@ class VeDbusItemExport(dbus.service.Object):
 			return None
 
 		self._value = newvalue
+		self._text = None
+		if self._service is not None:
+			self._service._generation += 1
+
+		if not self._signaltext:
+			return {'Value': wrap_dbus_value(newvalue)}
+
 		return {
 			'Value': wrap_dbus_value(newvalue),
 			'Text': self.GetText()
@@ -605,6 +666,12 @@ class VeDbusItemExport(dbus.service.Object):
 	# @return text A text-value. '---' when local value is invalid
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='s')
 	def GetText(self):
+		# the text is cached until the value changes
+		if self._text is None:
+			self._text = self._get_text()
+		return self._text
+
+	def _get_text(self):
 		if self._value is None:
 			return '---'
 
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+from bisect import bisect_left
+
+# upper bounds of the buckets in seconds, four buckets per doubling from 50 µs to about 90 s.
+# A percentile is the upper bound of its bucket, so it is at most 19% too high
+BUCKET_BOUNDS = tuple(0.00005 * 2 ** (index / 4) for index in range(84))
+
+
+class LatencyHistogram:
+    """Latencies in seconds counted in fixed buckets.
+
+    Adding a latency is one bisect and one increment and the memory does not grow with the number
+    of latencies, so it can run for the whole lifetime of the driver.
+    """
+
+    __slots__ = ("counts", "count", "max", "last")
+
+    def __init__(self):
+        # the last bucket counts the latencies above the highest bound
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.max = None
+        self.last = None
+
+    def add(self, latency):
+        # the clock of a producer can be ahead of ours
+        if latency < 0:
+            latency = 0.0
+
+        self.counts[bisect_left(BUCKET_BOUNDS, latency)] += 1
+        self.count += 1
+        self.last = latency
+        if self.max is None or latency > self.max:
+            self.max = latency
+
+    def percentile(self, percent):
+        """Return the latency below which percent of all latencies are, None without latencies."""
+        if self.count == 0:
+            return None
+
+        rank = self.count * percent / 100
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= rank and count > 0:
+                break
+
+        if index == len(BUCKET_BOUNDS):
+            return self.max
+        return min(BUCKET_BOUNDS[index], self.max)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import logging
+import os
+import struct
+from time import monotonic
+
+# Append-only log of the received MQTT messages, to replay them later with benchmarks/replay_capture.py.
+# The file starts with MAGIC, followed by one record per message: the time.monotonic() when it was
+# received, the length of the topic and of the payload, then the topic and the payload as bytes.
+
+MAGIC = b"DMBCAP\x00\x01"
+RECORD = struct.Struct("<dHI")
+
+
+class CaptureWriter:
+    """Appends the messages to a capture file until max_size bytes are reached. Used by the MQTT thread only."""
+
+    def __init__(self, filename, max_size):
+        self.filename = filename
+        self.max_size = max_size
+
+        directory = os.path.dirname(filename)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        self._file = open(filename, "ab")
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._file.write(MAGIC)
+            self._size = len(MAGIC)
+        self._flushed = monotonic()
+
+    def write(self, timestamp, topic, payload):
+        if self._file is None:
+            return
+
+        topic = topic.encode()
+        size = RECORD.size + len(topic) + len(payload)
+        if self._size + size > self.max_size:
+            logging.warning('Capture "%s" reached the maximum size of %i bytes and was stopped' % (self.filename, self.max_size))
+            self.close()
+            return
+
+        self._file.write(RECORD.pack(timestamp, len(topic), len(payload)))
+        self._file.write(topic)
+        self._file.write(payload)
+        self._size += size
+
+        # write the buffer at most once per second, a crash loses only the last messages
+        if timestamp - self._flushed >= 1:
+            self._file.flush()
+            self._flushed = timestamp
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_capture(filename):
+    """Yield (timestamp, topic, payload) of every message in the capture file. An incomplete last record is skipped."""
+    with open(filename, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('"%s" is not a capture file' % filename)
+
+        while True:
+            header = file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            timestamp, topic_length, payload_length = RECORD.unpack(header)
+            topic = file.read(topic_length)
+            payload = file.read(payload_length)
+            if len(payload) < payload_length:
+                return
+            yield timestamp, topic.decode(), payload
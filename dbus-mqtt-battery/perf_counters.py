@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+from time import monotonic
+
+# stages of the pipeline from the socket to D-Bus. A stage contains the stages called by it, e.g.
+# HANDLE_PUBLISH contains on_message with JSON_LOADS, MAPPING and DERIVED
+SOCKET_READ = 0
+HANDLE_PUBLISH = 1
+JSON_LOADS = 2
+MAPPING = 3
+DERIVED = 4
+DBUS_UPDATE = 5
+TEXT_FORMAT = 6
+
+stage_names = ("SocketRead", "HandlePublish", "JsonLoads", "Mapping", "Derived", "DbusUpdate", "TextFormat")
+
+
+class PerfCounters:
+    """Number of runs, total and maximum time of every stage, in preallocated lists.
+
+    Adding a time is two monotonic() calls and three list updates, so the counters can stay enabled.
+    Every stage runs either in the MQTT thread or in the GLib mainloop, so no lock is needed.
+    """
+
+    __slots__ = ("counts", "totals", "maxima", "_timed")
+
+    def __init__(self):
+        self.counts = [0] * len(stage_names)
+        self.totals = [0.0] * len(stage_names)
+        self.maxima = [0.0] * len(stage_names)
+
+        # (stage, function) -> wrapper, so that shared functions like the text formatters are wrapped once
+        self._timed = {}
+
+    def add(self, stage, seconds):
+        self.counts[stage] += 1
+        self.totals[stage] += seconds
+        if seconds > self.maxima[stage]:
+            self.maxima[stage] = seconds
+
+    def timed(self, stage, function):
+        """Return function wrapped, so that its time is added to stage."""
+        wrapper = self._timed.get((stage, function))
+        if wrapper is None:
+            add = self.add
+
+            def wrapper(*args, **kwargs):
+                start = monotonic()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    add(stage, monotonic() - start)
+
+            self._timed[(stage, function)] = wrapper
+        return wrapper
+
+    def instrument_client(self, client):
+        """Time the socket reads and the handling of the PUBLISH packets of a paho MQTT client."""
+        client._sock_recv_into = self.timed(SOCKET_READ, client._sock_recv_into)
+        client._handle_publish = self.timed(HANDLE_PUBLISH, client._handle_publish)
+
+    def stats(self):
+        """Return {stage name: {"Count", "Total", "Mean", "Max"}} with the times in milliseconds."""
+        stats = {}
+        for stage, name in enumerate(stage_names):
+            count = self.counts[stage]
+            stats[name] = {
+                "Count": count,
+                "Total": round(self.totals[stage] * 1000, 3),
+                "Mean": round(self.totals[stage] / count * 1000, 3) if count > 0 else None,
+                "Max": round(self.maxima[stage] * 1000, 3) if count > 0 else None,
+            }
+        return stats
+
+
+# counters of the driver, None while disabled
+counters = None
+
+
+def enable():
+    """Create the counters of the driver and return them."""
+    global counters
+    counters = PerfCounters()
+    return counters
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# Loads the driver without a MQTT broker and a dbus-daemon, for the tests and the benchmarks: the
+# VeDbusService is replaced by the MockDbusService and GLib by mock_gobject of the velib_python tests.
+# dbus-python is replaced by mock_dbus, so it does not have to be installed.
+#
+# The driver is copied to a temporary directory with its own config.ini, so the config of the
+# installation is not used.
+#
+# Usage:
+#   driver = load_driver(directory, config_text)
+#   driver.on_message(None, None, message(driver, topic, payload))
+#   mock_gobject.timer_manager.run(1)
+
+import importlib.util
+import os
+import shutil
+import sys
+import types
+from time import monotonic
+
+driver_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dbus-mqtt-battery")
+sys.path.insert(1, os.path.join(driver_path, "ext", "velib_python", "test"))
+import mock_dbus  # noqa: E402
+import mock_gobject  # noqa: E402
+from mock_dbus_service import MockDbusService  # noqa: E402
+
+
+class MockVeDbusService(MockDbusService):
+    """MockDbusService with the arguments of VeDbusService, which formats the text of changed values like signaltext."""
+
+    def __init__(self, servicename, bus=None, register=True, signaltext=True):
+        super().__init__(servicename)
+        self._signaltext = signaltext
+        self._textformats = {}
+
+    def add_path(self, path, value, description="", writeable=False, onchangecallback=None, gettextcallback=None, valuetype=None, itemtype=None):
+        super().add_path(path, value, description, writeable, onchangecallback, gettextcallback, itemtype)
+        self._textformats[path] = gettextcallback
+
+    def __setitem__(self, path, value):
+        super().__setitem__(path, value)
+        textformat = self._textformats[path]
+        if self._signaltext and textformat is not None and value is not None:
+            textformat(path, value)
+
+
+def load_driver(directory, config_text):
+    """Copy the driver with config_text as config.ini to directory and import it with GLib and dbus replaced by mocks."""
+    shutil.copytree(driver_path, directory, ignore=shutil.ignore_patterns("config.ini", "__pycache__"))
+    with open(os.path.join(directory, "config.ini"), "w") as file:
+        file.write(config_text)
+
+    repository = types.ModuleType("gi.repository")
+    repository.GLib = mock_gobject
+    sys.modules["gi"] = types.ModuleType("gi")
+    sys.modules["gi.repository"] = repository
+    mock_dbus.install()
+
+    sys.path.insert(1, directory)
+    spec = importlib.util.spec_from_file_location("dbus_mqtt_battery", os.path.join(directory, "dbus-mqtt-battery.py"))
+    driver = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(driver)
+    driver.VeDbusService = MockVeDbusService
+    return driver
+
+
+def message(driver, topic, payload):
+    """MQTT message as received by the MQTT client of the driver."""
+    msg = driver.mqtt.MQTTMessage(topic=topic.encode())
+    msg.payload = payload
+    msg.timestamp = monotonic()
+    return msg
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+# Stand-in for dbus-python, so that the driver and velib_python can be imported on machines without
+# libdbus and without a system bus, e.g. on CI. The D-Bus types are subclasses of the Python types
+# with the variant_level and signature arguments of dbus-python. Objects are not exported and signals
+# are not sent, the methods decorated with dbus.service.signal are called like normal methods.
+#
+# Usage:
+#   import mock_dbus
+#   mock_dbus.install()
+#   import dbus
+
+import sys
+import types
+
+
+def _type(base, name, bits=None, signed=True):
+    """D-Bus type based on the Python type base, which accepts and stores variant_level.
+
+    Integer types with bits raise an OverflowError for values out of their range, like dbus-python.
+    """
+    if bits is not None:
+        low = -(2 ** (bits - 1)) if signed else 0
+        high = low + 2**bits
+
+    def __new__(cls, value=base(), variant_level=0):
+        instance = base.__new__(cls, value)
+        if bits is not None and not low <= instance < high:
+            raise OverflowError("value %s out of range for %s" % (value, name))
+        instance.variant_level = variant_level
+        return instance
+
+    return type(name, (base,), {"__new__": __new__})
+
+
+class Array(list):
+    def __init__(self, value=(), signature=None, variant_level=0):
+        super().__init__(value)
+        self.signature = signature
+        self.variant_level = variant_level
+
+
+class Dictionary(dict):
+    def __init__(self, value=(), signature=None, variant_level=0):
+        super().__init__(value)
+        self.signature = signature
+        self.variant_level = variant_level
+
+
+class Struct(tuple):
+    def __new__(cls, value=(), signature=None, variant_level=0):
+        instance = super().__new__(cls, value)
+        instance.signature = signature
+        instance.variant_level = variant_level
+        return instance
+
+
+class DBusException(Exception):
+    pass
+
+
+class Bus:
+    """Connection without a bus, names and objects are accepted and ignored."""
+
+    def __init__(self, private=False):
+        self.private = private
+
+    def get_object(self, *args, **kwargs):
+        raise DBusException("no D-Bus available in mock_dbus")
+
+    def add_signal_receiver(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+class Object:
+    def __init__(self, conn=None, object_path=None, bus_name=None):
+        self._connection = conn
+        self.__dbus_object_path__ = object_path
+
+    def remove_from_connection(self, connection=None, path=None):
+        self._connection = None
+
+
+class BusName:
+    def __init__(self, name, bus=None, allow_replacement=False, replace_existing=False, do_not_queue=False):
+        self.name = name
+        self.bus = bus
+
+    # called by VeDbusService.__del__ to release the name
+    def __del__(self):
+        pass
+
+
+def method(dbus_interface, in_signature=None, out_signature=None, **kwargs):
+    return lambda function: function
+
+
+def signal(dbus_interface, signature=None, **kwargs):
+    return lambda function: function
+
+
+def DBusGMainLoop(set_as_default=False):
+    pass
+
+
+def install():
+    """Add the modules dbus, dbus.service, dbus.exceptions, dbus.mainloop and dbus.mainloop.glib to sys.modules."""
+    dbus = types.ModuleType("dbus")
+    for name, base, bits, signed in (
+        ("Boolean", int, None, False),
+        ("Byte", int, 8, False),
+        ("Int16", int, 16, True),
+        ("UInt16", int, 16, False),
+        ("Int32", int, 32, True),
+        ("UInt32", int, 32, False),
+        ("Int64", int, 64, True),
+        ("UInt64", int, 64, False),
+        ("Double", float, None, False),
+        ("String", str, None, False),
+        ("ObjectPath", str, None, False),
+        ("Signature", str, None, False),
+        ("ByteArray", bytes, None, False),
+    ):
+        setattr(dbus, name, _type(base, name, bits, signed))
+    dbus.Array = Array
+    dbus.Dictionary = Dictionary
+    dbus.Struct = Struct
+    dbus.Bus = Bus
+    dbus.SystemBus = Bus
+    dbus.SessionBus = Bus
+
+    exceptions = types.ModuleType("dbus.exceptions")
+    exceptions.DBusException = DBusException
+    dbus.exceptions = exceptions
+
+    service = types.ModuleType("dbus.service")
+    service.Object = Object
+    service.BusName = BusName
+    service.method = method
+    service.signal = signal
+    dbus.service = service
+
+    mainloop = types.ModuleType("dbus.mainloop")
+    glib = types.ModuleType("dbus.mainloop.glib")
+    glib.DBusGMainLoop = DBusGMainLoop
+    mainloop.glib = glib
+    dbus.mainloop = mainloop
+
+    sys.modules.update(
+        {
+            "dbus": dbus,
+            "dbus.exceptions": exceptions,
+            "dbus.service": service,
+            "dbus.mainloop": mainloop,
+            "dbus.mainloop.glib": glib,
+        }
+    )
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "dbus-mqtt-battery"))
+from battery_schema import BatterySchema  # noqa: E402
+from battery_state import MAX_FRAME_DEPTH, BatteryState, _loads  # noqa: E402
+
+
+def payload(power, **values):
+    return json.dumps(dict({"Dc": {"Power": power, "Voltage": 52.0}, "Soc": 50}, **values)).encode()
+
+
+class LoadsTest(unittest.TestCase):
+    def test_same_result_as_json_loads(self):
+        for document in [b'{"Soc": 50}', ' {"Soc": 50}\n', b'{"Soc": 5\xc3\xa4}', "[1, 2]", b"\xef\xbb\xbf{}"]:
+            try:
+                expected = json.loads(document)
+            except ValueError as error:
+                with self.assertRaises(error.__class__):
+                    _loads(document)
+            else:
+                self.assertEqual(_loads(document), expected)
+
+    def test_trailing_data_raises(self):
+        with self.assertRaises(ValueError):
+            _loads(b'{"Soc": 50} {}')
+
+
+class FrameTest(unittest.TestCase):
+    def setUp(self):
+        self.state = BatteryState(BatterySchema())
+        self.slots = self.state.schema.slots
+
+    def test_frame_contains_only_the_changes(self):
+        self.state.ingest_payload(payload(100.0))
+        self.state.take_frame()
+
+        self.state.ingest_payload(payload(200.0))
+        changed = self.state.take_frame().changed()
+        self.assertEqual(changed, {self.slots["/Dc/0/Power"]: 200.0, self.slots["/Dc/0/Current"]: round(200.0 / 52.0, 3)})
+
+    def test_frames_not_taken_are_combined(self):
+        self.state.ingest_payload(payload(100.0, Soh=99))
+        self.state.ingest_payload(payload(200.0))
+
+        changed = self.state.take_frame().changed()
+        self.assertEqual(changed[self.slots["/Dc/0/Power"]], 200.0)
+        self.assertEqual(changed[self.slots["/Soh"]], 99)
+        self.assertIsNone(self.state.take_frame())
+
+    def test_frames_not_taken_do_not_pile_up(self):
+        for power in range(3 * MAX_FRAME_DEPTH):
+            self.state.ingest_payload(payload(float(power), Soh=power))
+
+        frame = self.state.front
+        self.assertLessEqual(frame.depth, MAX_FRAME_DEPTH)
+        changed = frame.changed()
+        self.assertEqual(changed[self.slots["/Soh"]], 3 * MAX_FRAME_DEPTH - 1)
+        self.assertEqual(changed[self.slots["/Dc/0/Voltage"]], 52.0)
+
+
+class CellTest(unittest.TestCase):
+    def setUp(self):
+        self.state = BatteryState(BatterySchema())
+        self.slot = self.state.schema.slot
+
+    def cells(self):
+        return {self.state.schema.paths[slot] for slot in self.state.cells}
+
+    def test_same_cells(self):
+        self.state.ingest_payload(payload(100.0, Voltages={"Cell1": 3.3, "Cell2": 3.4}))
+        cells = self.state.cells
+        self.state.ingest_payload(payload(100.0, Voltages={"Cell1": 3.31, "Cell2": 3.4}))
+        self.assertIs(self.state.cells, cells)
+        self.assertEqual(self.state["/Voltages/Cell1"], 3.31)
+
+    def test_cell_not_sent_anymore_is_removed(self):
+        self.state.ingest_payload(payload(100.0, Voltages={"Cell1": 3.3, "Cell2": 3.4}))
+        self.state.ingest_payload(payload(100.0, Voltages={"Cell1": 3.3, "Cell3": 3.4}))
+        self.assertEqual(self.cells(), {"/Voltages/Cell1", "/Voltages/Cell3"})
+        self.assertIsNone(self.state["/Voltages/Cell2"])
+
+    def test_cell_with_invalid_value_is_removed_until_it_is_valid(self):
+        self.state.ingest_payload(payload(100.0, Voltages={"Cell1": 3.3, "Cell2": 3.4}))
+        self.state.ingest_payload(payload(100.0, Voltages={"Cell1": 3.3, "Cell2": [3.4]}))
+        self.assertEqual(self.cells(), {"/Voltages/Cell1"})
+
+        self.state.ingest_payload(payload(100.0, Voltages={"Cell1": 3.3, "Cell2": [3.4]}))
+        self.assertEqual(self.cells(), {"/Voltages/Cell1"})
+
+        self.state.ingest_payload(payload(100.0, Voltages={"Cell1": 3.3, "Cell2": 3.4}))
+        self.assertEqual(self.cells(), {"/Voltages/Cell1", "/Voltages/Cell2"})
+
+    def test_cells_as_list(self):
+        self.state.ingest_payload(payload(100.0, Voltages=[3.3, 3.4]))
+        self.assertEqual(self.cells(), {"/Voltages/Cell1", "/Voltages/Cell2"})
+        self.assertEqual(self.state["/Voltages/Cell2"], 3.4)
+
+    def test_cells_from_number_of_cells(self):
+        self.state.ingest_payload(payload(100.0, System={"NrOfCellsPerBattery": 2}))
+        self.assertEqual(self.cells(), {"/Voltages/Cell1", "/Voltages/Cell2", "/Balances/Cell1", "/Balances/Cell2"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "dbus-mqtt-battery"))
+from cell_stats import cell_stats  # noqa: E402
+
+
+class CellStatsTest(unittest.TestCase):
+    def test_dict(self):
+        stats = cell_stats({"C1": 3.31, "C2": 3.29, "C3": 3.35, "C4": 3.29, "C5": 3.35})
+        self.assertEqual((stats.count, stats.min_id, stats.min, stats.max_id, stats.max), (5, "C2", 3.29, "C3", 3.35))
+        self.assertAlmostEqual(stats.sum, 16.59)
+        self.assertAlmostEqual(stats.diff, 0.06)
+
+    def test_list(self):
+        stats = cell_stats([3.31, 3.29, 3.35])
+        self.assertEqual((stats.min_id, stats.max_id), ("Cell2", "Cell3"))
+
+    def test_summary_keys_and_invalid_values_are_skipped(self):
+        stats = cell_stats({"Cell1": 3.3, "Cell2": "n/a", "Cell3": None, "Cell4": 3.4, "Sum": 6.7, "Diff": 0.1})
+        self.assertEqual((stats.count, stats.min_id, stats.max_id), (2, "Cell1", "Cell4"))
+        self.assertAlmostEqual(stats.sum, 6.7)
+
+        stats = cell_stats([None, 3.4, "n/a", 3.3])
+        self.assertEqual((stats.count, stats.min_id, stats.max_id), (2, "Cell4", "Cell2"))
+
+    def test_no_valid_cell(self):
+        self.assertIsNone(cell_stats({}))
+        self.assertIsNone(cell_stats(["n/a", None]))
+
+    def test_mean_and_std(self):
+        stats = cell_stats([3.2, 3.4, 3.3, 3.3])
+        self.assertAlmostEqual(stats.mean, 3.3)
+        self.assertAlmostEqual(stats.std, 0.0707107, places=6)
+
+
+if __name__ == "__main__":
+    unittest.main()
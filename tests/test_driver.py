@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+# Tests of the driver without a MQTT broker and without D-Bus. The driver is loaded with load_driver()
+# of driver_loader.py, which replaces GLib, dbus-python and the VeDbusService by mocks.
+# The messages are passed to on_message and the GLib callbacks are run with mock_gobject.
+#
+# Usage: python -m unittest discover tests
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from driver_loader import load_driver, message
+import mock_gobject
+
+config = """[DEFAULT]
+logging = ERROR
+device_name = Test
+device_instance = 100
+timeout = 60
+
+[DBUS]
+publish_mode = event
+publish_min_interval = 0
+
+[SNAPSHOT]
+enabled = 0
+
+[DEBUG]
+latency = 0
+perf = 0
+
+[MQTT]
+broker_address = localhost
+broker_port = 1883
+topic = test/battery
+"""
+
+payload = json.dumps({"Dc": {"Power": 321.6, "Voltage": 52.7}, "Soc": 63}).encode()
+
+
+class DriverTestCase(unittest.TestCase):
+    """Loads a new copy of the driver with config for every test."""
+
+    config = config
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        mock_gobject.timer_manager.reset()
+        self.driver = load_driver(os.path.join(self._directory.name, "dbus-mqtt-battery"), self.config)
+
+    def send(self, payload, topic="test/battery"):
+        """Pass a message to on_message and run the GLib callbacks it scheduled."""
+        self.driver.on_message(None, None, message(self.driver, topic, payload))
+        self.run_callbacks()
+
+    def run_callbacks(self):
+        mock_gobject.timer_manager.run(1)
+
+    def state(self, topic="test/battery"):
+        return self.driver.batteries[topic]["state"]
+
+    def dbusservice(self, topic="test/battery"):
+        return self.driver.batteries[topic]["service"]._dbusservice
+
+
+class SnapshotTest(DriverTestCase):
+    def test_identical_message_clears_stale(self):
+        self.send(payload)
+        state = self.state()
+
+        # restore the values, which were just received, like after a restart of the driver
+        state.restore({path: value for path, value in zip(state.schema.paths, state.values) if value is not None})
+        self.run_callbacks()
+        self.assertEqual(self.dbusservice()["/Stale"], 1)
+
+        self.send(payload)
+        self.assertFalse(state.stale)
+        self.assertEqual(self.dbusservice()["/Stale"], 0)
+        self.assertEqual(self.dbusservice()["/Dc/0/Power"], 321.6)
+
+
+discovery_config = config.replace("topic = test/battery", "topic = test/+/battery")
+
+
+class DiscoveryTest(DriverTestCase):
+    config = discovery_config
+
+    def load_snapshot_driver(self, directory):
+        """Load another copy of the driver, which saves its snapshots in the snapshot directory of this test."""
+        config = self.config.replace("[SNAPSHOT]\nenabled = 0", "[SNAPSHOT]\nenabled = 1\npath = " + os.path.join(self._directory.name, "snapshots"))
+        return load_driver(os.path.join(self._directory.name, directory), config)
+
+    def device_instances(self, driver):
+        return {topic: battery["device_instance"] for topic, battery in driver.batteries.items() if battery is not None}
+
+    def test_device_instance_does_not_depend_on_the_order(self):
+        self.send(payload, "test/a/battery")
+        self.send(payload, "test/b/battery")
+
+        driver = load_driver(os.path.join(self._directory.name, "reversed"), self.config)
+        for topic in ["test/b/battery", "test/a/battery"]:
+            driver.on_message(None, None, message(driver, topic, payload))
+        self.assertEqual(self.device_instances(driver), self.device_instances(self.driver))
+
+    def test_snapshot_is_restored_to_its_topic(self):
+        driver = self.load_snapshot_driver("first")
+        for topic, power in [("test/b/battery", 200.0), ("test/a/battery", 100.0)]:
+            driver.on_message(None, None, message(driver, topic, json.dumps({"Dc": {"Power": power, "Voltage": 52.7}, "Soc": 63}).encode()))
+        self.run_callbacks()
+        for battery in driver.batteries.values():
+            battery["service"]._save_snapshot()
+        self.assertEqual(len(os.listdir(os.path.join(self._directory.name, "snapshots"))), 2)
+
+        # after the restart the batteries are restored in the order of the files
+        restarted = self.load_snapshot_driver("restarted")
+        restarted.restore_snapshots()
+        self.assertEqual(self.device_instances(restarted), self.device_instances(driver))
+        self.assertEqual(restarted.batteries["test/a/battery"]["state"]["/Dc/0/Power"], 100.0)
+        self.assertEqual(restarted.batteries["test/b/battery"]["state"]["/Dc/0/Power"], 200.0)
+
+
+class TimeoutTest(DriverTestCase):
+    def timeout(self):
+        """Let the last message be older than the timeout and run the timeout check."""
+        self.state().last_changed -= self.driver.timeout + 1
+        self.driver.batteries["test/battery"]["service"]._check_timeout(rearm=False)
+
+    def test_timeout_invalidates_values(self):
+        self.send(payload)
+        self.timeout()
+        self.assertEqual(self.dbusservice()["/Connected"], 0)
+        self.assertIsNone(self.dbusservice()["/Dc/0/Power"])
+        self.assertIsNone(self.dbusservice()["/Soc"])
+
+    def test_identical_message_reconnects(self):
+        self.send(payload)
+        self.timeout()
+
+        self.send(payload)
+        self.assertEqual(self.dbusservice()["/Connected"], 1)
+        self.assertEqual(self.dbusservice()["/Dc/0/Power"], 321.6)
+        self.assertEqual(self.dbusservice()["/Dc/0/Voltage"], 52.7)
+        self.assertEqual(self.dbusservice()["/Soc"], 63)
+
+
+class LazyExportTest(DriverTestCase):
+    """Uses the VeDbusService of velib_python on mock_dbus, to check the signals."""
+
+    def setUp(self):
+        super().setUp()
+        vedbus = sys.modules["vedbus"]
+        self.driver.VeDbusService = vedbus.VeDbusService
+        self.properties_changed = self.record(vedbus.VeDbusItemExport, "PropertiesChanged")
+        self.items_changed = self.record(vedbus.VeDbusRootExport, "ItemsChanged")
+
+    def record(self, cls, signal):
+        """Record the (object path, changes) of every signal. The changes are copied, since the batch clears them afterwards."""
+        signals = []
+        patcher = mock.patch.object(cls, signal, lambda self, changes: signals.append((self._path, dict(changes))))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return signals
+
+    def test_path_added_without_batch_sends_value(self):
+        self.driver.batch_signals = 0
+        self.send(payload)
+        self.assertNotIn("/Soh", self.dbusservice())
+
+        self.send(json.dumps({"Dc": {"Power": 321.6, "Voltage": 52.7}, "Soc": 63, "Soh": 98}).encode())
+        self.assertEqual(self.dbusservice()["/Soh"], 98)
+        self.assertEqual([changes["Value"] for path, changes in self.properties_changed if path == "/Soh"], [98])
+        self.assertEqual(self.items_changed, [])
+
+    def test_path_added_with_batch_sends_value(self):
+        self.send(payload)
+        self.send(json.dumps({"Dc": {"Power": 321.6, "Voltage": 52.7}, "Soc": 63, "Soh": 98}).encode())
+        self.assertEqual(self.items_changed[-1][1]["/Soh"]["Value"], 98)
+        self.assertEqual([changes for path, changes in self.properties_changed if path == "/Soh"], [])
+
+
+aggregate_config = config.replace(
+    "[MQTT]",
+    """[AGGREGATE]
+enabled = 1
+
+[BATTERY:1]
+topic = test/battery/1
+device_name = Battery
+device_instance = 101
+
+[BATTERY:2]
+topic = test/battery/2
+device_name = Battery
+device_instance = 102
+
+[MQTT]""",
+)
+
+
+def pack(power, max_charge_current, capacity=None, time_to_go=None):
+    data = {"Dc": {"Power": power, "Voltage": 52.0}, "Soc": 50, "Info": {"MaxChargeCurrent": max_charge_current}}
+    if capacity is not None:
+        data.update({"InstalledCapacity": 2 * capacity, "Capacity": capacity, "TimeToGo": time_to_go})
+    return json.dumps(data).encode()
+
+
+class AggregateTest(DriverTestCase):
+    config = aggregate_config
+
+    def aggregate(self):
+        return self.driver.aggregate_config["service"]._dbusservice
+
+    def test_timed_out_battery_is_removed(self):
+        self.send(pack(100.0, 50.0), "test/battery/1")
+        self.send(pack(200.0, 50.0), "test/battery/2")
+        self.assertEqual(self.aggregate()["/Info/MaxChargeCurrent"], 100.0)
+        self.assertEqual(self.aggregate()["/Dc/0/Power"], 300.0)
+        self.assertEqual(self.aggregate()["/System/NrOfModulesOnline"], 2)
+
+        self.state("test/battery/1").last_changed -= self.driver.timeout + 1
+        self.send(pack(200.0, 50.0), "test/battery/2")
+        self.assertEqual(self.aggregate()["/Info/MaxChargeCurrent"], 50.0)
+        self.assertEqual(self.aggregate()["/Dc/0/Power"], 200.0)
+        self.assertEqual(self.aggregate()["/System/NrOfModulesOnline"], 1)
+
+        # back with the same values as before the timeout
+        self.send(pack(100.0, 50.0), "test/battery/1")
+        self.assertEqual(self.aggregate()["/Info/MaxChargeCurrent"], 100.0)
+        self.assertEqual(self.aggregate()["/System/NrOfModulesOnline"], 2)
+
+    def test_identical_messages_keep_aggregate_alive(self):
+        self.send(pack(100.0, 50.0), "test/battery/1")
+        aggregate_state = self.driver.aggregate_config["state"]
+        aggregate_state.last_changed -= self.driver.timeout + 1
+
+        self.send(pack(100.0, 50.0), "test/battery/1")
+        self.assertLess(self.driver.monotonic() - aggregate_state.last_changed, self.driver.timeout)
+
+    def test_time_to_go_of_batteries_in_parallel(self):
+        self.send(pack(-100.0, 50.0, capacity=30.0, time_to_go=3600), "test/battery/1")
+        self.send(pack(-100.0, 50.0, capacity=90.0, time_to_go=7200), "test/battery/2")
+        # 120 Ah discharged with 30 Ah / 1 h + 90 Ah / 2 h
+        self.assertEqual(self.aggregate()["/TimeToGo"], 5760)
+
+    def test_time_to_go_without_empty_battery(self):
+        self.send(pack(-100.0, 50.0, capacity=0.0, time_to_go=0), "test/battery/1")
+        self.send(pack(-100.0, 50.0, capacity=90.0, time_to_go=7200), "test/battery/2")
+        self.assertEqual(self.aggregate()["/TimeToGo"], 7200)
+
+
+class PerfTest(DriverTestCase):
+    config = aggregate_config.replace("perf = 0", "perf = 1")
+
+    def setUp(self):
+        super().setUp()
+        # the perf counters are global, disable them again for the other tests
+        self.addCleanup(setattr, sys.modules["perf_counters"], "counters", None)
+
+    def services_with_perf(self):
+        batteries = [battery for battery in list(self.driver.batteries.values()) + [self.driver.aggregate_config] if battery is not None]
+        return [battery["topic"] for battery in batteries if "service" in battery and "/Debug/Perf/Mapping/Count" in battery["service"]._dbusservice]
+
+    def test_perf_counters_on_the_aggregate(self):
+        self.send(pack(100.0, 50.0), "test/battery/1")
+        self.send(pack(200.0, 50.0), "test/battery/2")
+        self.assertEqual(self.services_with_perf(), ["aggregate"])
+
+    def test_perf_counters_on_the_first_battery_without_aggregate(self):
+        self.driver = load_driver(os.path.join(self._directory.name, "without_aggregate"), self.config.replace("[AGGREGATE]\nenabled = 1", "[AGGREGATE]\nenabled = 0"))
+        self.send(pack(100.0, 50.0), "test/battery/2")
+        self.send(pack(200.0, 50.0), "test/battery/1")
+        self.assertEqual(self.services_with_perf(), ["test/battery/2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
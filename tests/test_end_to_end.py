@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+# Reconnect of the driver under load, with the MQTT broker and the end-to-end benchmark of the
+# benchmarks directory. Takes a few seconds.
+#
+# Usage: python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+import bench_end_to_end  # noqa: E402
+import mock_gobject  # noqa: E402
+
+
+class ReconnectTest(unittest.TestCase):
+    def setUp(self):
+        # the benchmark adds a GLib.MainLoop to mock_gobject
+        self.addCleanup(vars(mock_gobject).pop, "MainLoop", None)
+        mock_gobject.timer_manager.reset()
+
+    def test_no_message_lost_by_the_driver(self):
+        results = bench_end_to_end.run(rate=100, duration=2.5, disconnect_every=1)
+        self.assertGreaterEqual(results["disconnects"], 1)
+        self.assertEqual(results["reconnects"], results["disconnects"])
+        self.assertEqual(results["lost_by_driver"], 0)
+        self.assertGreater(results["received"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
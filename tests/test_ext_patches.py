@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+# The patches in dbus-mqtt-battery/ext/patches are applied by ext/update.py after a module was
+# replaced by a new version. They have to contain all local changes of the modules, so that they are
+# not lost with the next update. Needs git.
+#
+# Usage: python -m unittest discover tests
+
+import os
+import shutil
+import subprocess
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ext = os.path.join("dbus-mqtt-battery", "ext")
+patches = os.path.join(root, ext, "patches")
+
+
+@unittest.skipIf(shutil.which("git") is None, "git is not installed")
+class PatchTest(unittest.TestCase):
+    def test_modules_contain_their_patches(self):
+        for patch in sorted(os.listdir(patches)):
+            with self.subTest(patch=patch):
+                # the patch can only be reversed, if the patched lines of the module are the same as in the patch
+                directory = ext + "/" + os.path.splitext(patch)[0]
+                result = subprocess.run(["git", "apply", "--check", "--reverse", "--directory=" + directory, os.path.join(patches, patch)], cwd=root, capture_output=True, text=True)
+                self.assertEqual(result.returncode, 0, result.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
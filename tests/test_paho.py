@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# Tests of the read-ahead buffer of the vendored paho client.py, see ext/patches. The socket is replaced
+# by a socket, which returns the data of the test in the given chunks.
+#
+# Usage: python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "dbus-mqtt-battery", "ext"))
+from paho.mqtt import client as mqtt  # noqa: E402
+
+
+def publish(topic, payload):
+    """QoS 0 PUBLISH packet."""
+    variable = len(topic).to_bytes(2, "big") + topic.encode() + payload
+    remaining_length = len(variable)
+    header = bytearray([0x30])
+    while True:
+        byte_value = remaining_length % 128
+        remaining_length //= 128
+        header.append(byte_value | 128 if remaining_length else byte_value)
+        if not remaining_length:
+            return bytes(header) + variable
+
+
+class ChunkSocket:
+    """Socket, which returns one chunk per recv_into() call."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def recv_into(self, buffer):
+        if not self.chunks:
+            raise BlockingIOError()
+        chunk = self.chunks.pop(0)
+        buffer[: len(chunk)] = chunk[: len(buffer)]
+        if len(chunk) > len(buffer):
+            self.chunks.insert(0, chunk[len(buffer) :])
+        return min(len(chunk), len(buffer))
+
+    def close(self):
+        pass
+
+
+class PacketReadTest(unittest.TestCase):
+    def setUp(self):
+        self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+        self.client._sock = self.socket = ChunkSocket()
+        self.messages = []
+        self.client.on_message = lambda client, userdata, msg: self.messages.append((msg.topic, msg.payload))
+
+    def read(self, *chunks):
+        """Let the client read all chunks and return the codes of the _packet_read() calls."""
+        self.socket.chunks.extend(chunks)
+        codes = []
+        while self.socket.chunks:
+            codes.append(self.client._packet_read())
+        return codes
+
+    def test_fixed_header_split_across_reads(self):
+        # remaining length of 200 needs two bytes
+        packet = publish("battery/1", b"x" * 190)
+        self.read(packet[:1], packet[1:2], packet[2:3], packet[3:])
+        self.assertEqual(self.messages, [("battery/1", b"x" * 190)])
+
+    def test_several_packets_in_one_read(self):
+        packets = [publish("battery/%d" % number, b"%d" % number) for number in range(5)]
+        # the last packet is incomplete and is handled with the next read
+        data = b"".join(packets)
+        self.assertEqual(self.read(data[:-3]), [mqtt.MQTT_ERR_SUCCESS])
+        self.assertEqual(len(self.messages), 4)
+
+        self.read(data[-3:])
+        self.assertEqual(self.messages, [("battery/%d" % number, b"%d" % number) for number in range(5)])
+        self.assertEqual(self.client._in_start, self.client._in_end)
+
+    def test_packet_larger_than_the_buffer(self):
+        payload = bytes(range(256)) * 1024
+        packet = publish("battery/1", payload)
+        self.assertGreater(len(packet), mqtt._IN_BUFFER_SIZE)
+        self.read(packet[:1000], packet[1000:100000], packet[100000:] + publish("battery/2", b"1")[:3])
+        self.assertEqual(self.messages, [("battery/1", payload)])
+
+        # the buffer shrinks back with the next packet
+        self.assertEqual(len(self.client._in_buffer), mqtt._IN_BUFFER_SIZE)
+        self.read(publish("battery/2", b"1")[3:])
+        self.assertEqual(self.messages[1:], [("battery/2", b"1")])
+
+    def test_buffer_shrinks_after_packet_larger_than_the_buffer(self):
+        self.read(publish("battery/1", b"x" * 100000))
+        self.assertEqual(len(self.client._in_buffer), mqtt._IN_BUFFER_SIZE)
+
+    def test_reconnect_mid_packet(self):
+        packet = publish("battery/1", b"x" * 100)
+        self.socket.chunks.extend([packet[:50], b""])
+        self.assertEqual(self.client._packet_read(), mqtt.MQTT_ERR_SUCCESS)
+        self.assertEqual(self.client._packet_read(), mqtt.MQTT_ERR_CONN_LOST)
+
+        # reset of reconnect(), which can not connect without a broker
+        self.client._in_packet_reset()
+        self.client._in_buffer_reset()
+
+        # the rest of the incomplete packet of the lost connection is not used
+        self.read(publish("battery/2", b"1"))
+        self.assertEqual(self.messages, [("battery/2", b"1")])
+
+    def test_reconnect_in_callback(self):
+        def on_message(client, userdata, msg):
+            self.messages.append((msg.topic, msg.payload))
+            client._in_buffer_reset()
+
+        # the packets after the reconnect() belong to the lost connection
+        self.client.on_message = on_message
+        self.read(publish("battery/1", b"1") + publish("battery/2", b"2"))
+        self.assertEqual(self.messages, [("battery/1", b"1")])
+
+        self.read(publish("battery/3", b"3"))
+        self.assertEqual(self.messages, [("battery/1", b"1"), ("battery/3", b"3")])
+
+
+if __name__ == "__main__":
+    unittest.main()
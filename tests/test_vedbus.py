@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# Tests of the changes to the vendored velib_python vedbus.py, see ext/patches. dbus-python is replaced
+# by mock_dbus, so the objects are not exported and the methods are called directly.
+#
+# Usage: python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), "..", "dbus-mqtt-battery", "ext", "velib_python"))
+import mock_dbus  # noqa: E402
+
+mock_dbus.install()
+from vedbus import VeDbusService  # noqa: E402
+from ve_utils import wrap_dbus_value  # noqa: E402
+
+
+def service(*paths):
+    dbusservice = VeDbusService("com.victronenergy.battery.test", bus=mock_dbus.Bus(), register=False)
+    for path in paths:
+        dbusservice.add_path(path, len(path), gettextcallback=lambda path, value: "%d chars" % value)
+    return dbusservice
+
+
+def linear_values(dbusservice, path, get_text=False):
+    """VeDbusTreeExport._get_value_handler of velib_python, which scanned all paths."""
+    r = {}
+    px = path
+    if not px.endswith("/"):
+        px += "/"
+    for p, item in dbusservice._dbusobjects.items():
+        if p.startswith(px):
+            v = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
+            r[p[len(px) :]] = v
+    return r
+
+
+class SubtreeTest(unittest.TestCase):
+    paths = ["/Dc/0/Voltage", "/Dc/0/Power", "/Dc/1/Voltage", "/Dc/10/Voltage", "/Dc/0Power", "/Dca", "/Soc", "/Voltages/Cell1", "/Voltages/Cell10", "/Voltages/Cell2"]
+
+    def setUp(self):
+        self.service = service(*self.paths)
+
+    def test_values_and_texts_of_nodes(self):
+        for node in ["/", "/Dc", "/Dc/0", "/Dc/1", "/Voltages"]:
+            with self.subTest(node=node):
+                tree = self.service._dbusnodes[node]
+                self.assertEqual(tree.GetValue(), linear_values(self.service, node))
+                self.assertEqual(tree.GetText(), linear_values(self.service, node, True))
+
+    def test_node_without_common_prefix_of_siblings(self):
+        self.assertEqual(set(self.service._dbusnodes["/Dc/0"].GetValue()), {"Voltage", "Power"})
+
+    def test_values_after_paths_were_added_and_removed(self):
+        del self.service["/Dc/0/Power"]
+        self.service.add_path("/Dc/0/Current", 2.5)
+        self.service.add_path("/Dc/0/Temperature", 25.0)
+
+        tree = self.service._dbusnodes["/Dc/0"]
+        self.assertEqual(tree.GetValue(), linear_values(self.service, "/Dc/0"))
+        self.assertEqual(tree.GetValue(), {"Current": 2.5, "Temperature": 25.0, "Voltage": 13})
+        self.assertEqual(self.service._dbuspaths, sorted(self.service._dbusobjects))
+
+
+class NodeTest(unittest.TestCase):
+    def setUp(self):
+        self.service = service("/Dc/0/Voltage", "/Dc/0/Power", "/Dc/1/Voltage", "/Soc")
+
+    def test_node_is_removed_with_its_last_path(self):
+        node = self.service._dbusnodes["/Dc/0"]
+        del self.service["/Dc/0/Voltage"]
+        self.assertIs(self.service._dbusnodes["/Dc/0"], node)
+        self.assertIsNotNone(node._path)
+
+        del self.service["/Dc/0/Power"]
+        self.assertNotIn("/Dc/0", self.service._dbusnodes)
+        self.assertIsNone(node._path)
+        self.assertIn("/Dc", self.service._dbusnodes)
+
+        del self.service["/Dc/1/Voltage"]
+        self.assertEqual(set(self.service._dbusnodes), {"/"})
+        self.assertEqual(self.service._dbusnodecounts, {})
+
+    def test_node_is_created_again_with_a_new_path(self):
+        del self.service["/Dc/1/Voltage"]
+        self.assertNotIn("/Dc/1", self.service._dbusnodes)
+
+        self.service.add_path("/Dc/1/Voltage", 13.1)
+        self.assertIn("/Dc/1", self.service._dbusnodes)
+        self.assertEqual(self.service._dbusnodes["/Dc/1"].GetValue(), {"Voltage": 13.1})
+
+        # the node has to count the new path, else it is removed with the last path of the old ones
+        del self.service["/Dc/0/Voltage"]
+        del self.service["/Dc/0/Power"]
+        self.assertIn("/Dc", self.service._dbusnodes)
+        del self.service["/Dc/1/Voltage"]
+        self.assertNotIn("/Dc", self.service._dbusnodes)
+
+
+class GetItemsTest(unittest.TestCase):
+    def setUp(self):
+        self.service = service("/Dc/0/Voltage", "/Soc")
+        self.items = self.service.root.GetItems()
+
+    def test_same_reply_without_changes(self):
+        self.service["/Soc"] = 4
+        self.assertIs(self.service.root.GetItems(), self.service.root.GetItems())
+
+    def test_set_value(self):
+        self.service["/Soc"] = 50
+        self.assertEqual(self.service.root.GetItems()["/Soc"], {"Value": 50, "Text": "50 chars"})
+
+    def test_set_value_in_context(self):
+        with self.service as context:
+            context["/Soc"] = 50
+        self.assertEqual(self.service.root.GetItems()["/Soc"], {"Value": 50, "Text": "50 chars"})
+
+    def test_add_path(self):
+        self.service.add_path("/Dc/0/Power", 100.0)
+        self.assertEqual(self.service.root.GetItems()["/Dc/0/Power"], {"Value": 100.0, "Text": "100.0"})
+
+    def test_delete_path(self):
+        del self.service["/Soc"]
+        self.assertEqual(set(self.service.root.GetItems()), {"/Dc/0/Voltage"})
+
+    def test_text_changes_with_the_value(self):
+        self.service["/Soc"] = None
+        self.assertEqual(self.service.root.GetItems()["/Soc"]["Text"], "---")
+        self.assertEqual(self.service._dbusobjects["/Soc"].GetText(), "---")
+
+        self.service["/Soc"] = 7
+        self.assertEqual(self.service.root.GetItems()["/Soc"]["Text"], "7 chars")
+
+    def test_reply_is_not_changed_afterwards(self):
+        self.service["/Soc"] = 50
+        self.assertEqual(self.items["/Soc"]["Value"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()